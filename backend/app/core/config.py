@@ -9,11 +9,26 @@ class Settings(BaseSettings):
     # Google AI Configuration
     # GOOGLE_API_KEY: str = os.getenv("GOOGLE_API_KEY", "")
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
+    OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-4o")
+    
+    # Shared keep-alive HTTP pool for OpenAI calls (chat model and transcription)
+    OPENAI_HTTP2: bool = os.getenv("OPENAI_HTTP2", "true").lower() == "true"
+    OPENAI_MAX_CONNECTIONS: int = int(os.getenv("OPENAI_MAX_CONNECTIONS", "50"))
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    OPENAI_KEEPALIVE_EXPIRY_SECONDS: float = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY_SECONDS", "120"))
+    OPENAI_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+    OPENAI_TIMEOUT_SECONDS: float = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+    OPENAI_TRANSCRIBE_TIMEOUT_SECONDS: float = float(os.getenv("OPENAI_TRANSCRIBE_TIMEOUT_SECONDS", "120"))
+    OPENAI_CONNECT_RETRIES: int = int(os.getenv("OPENAI_CONNECT_RETRIES", "2"))
+    OPENAI_MAX_RETRIES: int = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
     
     # AWS Configuration
     AWS_ACCESS_KEY_ID: str = os.getenv("AWS_ACCESS_KEY_ID", "")
     AWS_SECRET_ACCESS_KEY: str = os.getenv("AWS_SECRET_ACCESS_KEY", "")
     AWS_REGION: str = os.getenv("AWS_REGION", "ca-central-1")
+    POLLY_MAX_CONNECTIONS: int = int(os.getenv("POLLY_MAX_CONNECTIONS", "10"))
+    POLLY_TIMEOUT_SECONDS: float = float(os.getenv("POLLY_TIMEOUT_SECONDS", "15"))
+    POLLY_MAX_ATTEMPTS: int = int(os.getenv("POLLY_MAX_ATTEMPTS", "3"))
     
     # Database Configuration
     DATABASE_HOST: str = os.getenv("DATABASE_HOST", "")
@@ -21,6 +36,120 @@ class Settings(BaseSettings):
     DATABASE_USER: str = os.getenv("DATABASE_USER", "")
     DATABASE_PASSWORD: str = os.getenv("DATABASE_PASSWORD", "")
     DATABASE_NAME: str = os.getenv("DATABASE_NAME", "")
+    # Full SQLAlchemy URL; overrides the DATABASE_* parts above when set (e.g. sqlite:// for local benchmarks)
+    DATABASE_URL: str = os.getenv("DATABASE_URL", "")
+    # Connection pool; size + overflow should cover AGENT_MAX_CONCURRENCY per worker
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    # Read replicas for agent queries (comma-separated SQLAlchemy URLs); each gets its own pool.
+    # REPLICA_LAG_QUERY overrides SHOW REPLICA STATUS, e.g. for SQLite stand-ins.
+    DATABASE_REPLICA_URLS: str = os.getenv("DATABASE_REPLICA_URLS", "")
+    REPLICA_MAX_LAG_SECONDS: float = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+    REPLICA_HEALTH_CHECK_SECONDS: float = float(os.getenv("REPLICA_HEALTH_CHECK_SECONDS", "15"))
+    REPLICA_LAG_QUERY: str = os.getenv("REPLICA_LAG_QUERY", "")
+    
+    # Schema cache: hard TTL, and how often to check the information_schema fingerprint
+    SCHEMA_CACHE_TTL_SECONDS: int = int(os.getenv("SCHEMA_CACHE_TTL_SECONDS", "3600"))
+    SCHEMA_CACHE_CHECK_SECONDS: int = int(os.getenv("SCHEMA_CACHE_CHECK_SECONDS", "60"))
+    
+    # Local query router: skip the routing/greeting LLM calls when confident enough
+    QUERY_ROUTER_ENABLED: bool = os.getenv("QUERY_ROUTER_ENABLED", "true").lower() == "true"
+    QUERY_ROUTER_CONFIDENCE: float = float(os.getenv("QUERY_ROUTER_CONFIDENCE", "0.8"))
+    
+    # Answer cache: per-patient answers keyed by normalized question
+    ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_MAX_ENTRIES: int = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+    ANSWER_CACHE_TTL_SECONDS: int = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "900"))
+    # Per-patient TTL overrides, e.g. "143:300,245:60"
+    ANSWER_CACHE_PATIENT_TTLS: str = os.getenv("ANSWER_CACHE_PATIENT_TTLS", "")
+    ANSWER_CACHE_VERSION_CHECK_SECONDS: int = int(os.getenv("ANSWER_CACHE_VERSION_CHECK_SECONDS", "30"))
+    # Bag-of-words cosine similarity for near-duplicate questions; 0 disables
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0"))
+    
+    # SQL plan cache: parameterized generate_query results keyed by question intent
+    SQL_PLAN_CACHE_ENABLED: bool = os.getenv("SQL_PLAN_CACHE_ENABLED", "true").lower() == "true"
+    SQL_PLAN_CACHE_MAX_ENTRIES: int = int(os.getenv("SQL_PLAN_CACHE_MAX_ENTRIES", "500"))
+    
+    # SQL guard: generated queries are checked, limited and cost-estimated before they run
+    SQL_GUARD_ENABLED: bool = os.getenv("SQL_GUARD_ENABLED", "true").lower() == "true"
+    SQL_GUARD_DEFAULT_LIMIT: int = int(os.getenv("SQL_GUARD_DEFAULT_LIMIT", "100"))
+    SQL_GUARD_MAX_LIMIT: int = int(os.getenv("SQL_GUARD_MAX_LIMIT", "1000"))
+    SQL_GUARD_EXPLAIN_ENABLED: bool = os.getenv("SQL_GUARD_EXPLAIN_ENABLED", "true").lower() == "true"
+    SQL_GUARD_MAX_EXAMINED_ROWS: int = int(os.getenv("SQL_GUARD_MAX_EXAMINED_ROWS", "1000000"))
+    SQL_GUARD_MAX_EXECUTION_MS: int = int(os.getenv("SQL_GUARD_MAX_EXECUTION_MS", "10000"))
+    
+    # Query log: one JSON line per executed agent query, read by app.services.index_advisor
+    QUERY_LOG_ENABLED: bool = os.getenv("QUERY_LOG_ENABLED", "true").lower() == "true"
+    QUERY_LOG_PATH: str = os.getenv("QUERY_LOG_PATH", "logs/query_log.jsonl")
+    QUERY_LOG_MAX_BYTES: int = int(os.getenv("QUERY_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+    
+    # Tracing: spans around graph nodes and LLM/DB/Polly/Whisper calls, exported as
+    # OTLP/JSON lines; latency histograms are served on /metrics either way
+    TRACING_ENABLED: bool = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+    TRACE_EXPORT_PATH: str = os.getenv("TRACE_EXPORT_PATH", "logs/traces.jsonl")
+    TRACE_EXPORT_MAX_BYTES: int = int(os.getenv("TRACE_EXPORT_MAX_BYTES", str(100 * 1024 * 1024)))
+    TRACE_SERVICE_NAME: str = os.getenv("TRACE_SERVICE_NAME", "health-informatics-backend")
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    
+    # Patient snapshots: a patient's rows copied into in-memory SQLite for follow-up questions
+    PATIENT_SNAPSHOT_ENABLED: bool = os.getenv("PATIENT_SNAPSHOT_ENABLED", "false").lower() == "true"
+    PATIENT_SNAPSHOT_MAX_BYTES: int = int(os.getenv("PATIENT_SNAPSHOT_MAX_BYTES", str(256 * 1024 * 1024)))
+    PATIENT_SNAPSHOT_MAX_ROWS: int = int(os.getenv("PATIENT_SNAPSHOT_MAX_ROWS", "50000"))
+    PATIENT_SNAPSHOT_VERSION_CHECK_SECONDS: int = int(os.getenv("PATIENT_SNAPSHOT_VERSION_CHECK_SECONDS", "30"))
+    
+    # Query execution budget: results stream in batches and stop at these limits
+    QUERY_STREAM_BATCH_ROWS: int = int(os.getenv("QUERY_STREAM_BATCH_ROWS", "500"))
+    QUERY_MAX_ROWS: int = int(os.getenv("QUERY_MAX_ROWS", "5000"))
+    QUERY_MAX_BYTES: int = int(os.getenv("QUERY_MAX_BYTES", str(16 * 1024 * 1024)))
+    
+    # Rows of a query result shown to the LLM; the full table is rendered locally
+    RESULT_PREVIEW_ROWS: int = int(os.getenv("RESULT_PREVIEW_ROWS", "20"))
+    
+    # Prompt token budgets per graph node ("node:tokens,..."); over budget the
+    # question, non-essential schema columns and preview rows are trimmed to fit,
+    # and measured counts show up in /debug/cache.
+    # Counts use tiktoken (which downloads its encoding once) unless disabled
+    TIKTOKEN_ENABLED: bool = os.getenv("TIKTOKEN_ENABLED", "true").lower() == "true"
+    PROMPT_TOKEN_BUDGETS: str = os.getenv(
+        "PROMPT_TOKEN_BUDGETS", "determine_query_type:1000,generate_query:2500,format_query_results:4000"
+    )
+    
+    # LLM token accounting: prompt + completion ceiling per agent request (0 = none),
+    # prices for the cost estimate, and whether ChatResponse carries the usage
+    # (off by default: per-node usage and cost are internal, see /debug/cache)
+    LLM_MAX_TOKENS_PER_REQUEST: int = int(os.getenv("LLM_MAX_TOKENS_PER_REQUEST", "20000"))
+    LLM_INPUT_COST_PER_1M_TOKENS: float = float(os.getenv("LLM_INPUT_COST_PER_1M_TOKENS", "2.50"))
+    LLM_OUTPUT_COST_PER_1M_TOKENS: float = float(os.getenv("LLM_OUTPUT_COST_PER_1M_TOKENS", "10.00"))
+    TOKEN_USAGE_IN_RESPONSE: bool = os.getenv("TOKEN_USAGE_IN_RESPONSE", "false").lower() == "true"
+    
+    # Per-worker concurrency: agent runs in flight, how long extra requests queue,
+    # and threads for blocking DB/boto3 work moved off the event loop
+    AGENT_MAX_CONCURRENCY: int = int(os.getenv("AGENT_MAX_CONCURRENCY", "16"))
+    AGENT_QUEUE_TIMEOUT_SECONDS: float = float(os.getenv("AGENT_QUEUE_TIMEOUT_SECONDS", "30"))
+    BLOCKING_IO_THREADS: int = int(os.getenv("BLOCKING_IO_THREADS", "32"))
+    
+    # Text-to-speech: audio is synthesized in the background (eager) or on first play
+    AUDIO_DIR: str = os.getenv("AUDIO_DIR", "audio")
+    AUDIO_EAGER_SYNTHESIS: bool = os.getenv("AUDIO_EAGER_SYNTHESIS", "true").lower() == "true"
+    AUDIO_JOB_TTL_SECONDS: int = int(os.getenv("AUDIO_JOB_TTL_SECONDS", "3600"))
+    AUDIO_SYNTHESIS_TIMEOUT_SECONDS: float = float(os.getenv("AUDIO_SYNTHESIS_TIMEOUT_SECONDS", "30"))
+    AUDIO_JOB_MAX_BYTES: int = int(os.getenv("AUDIO_JOB_MAX_BYTES", str(64 * 1024 * 1024)))
+    # Janitor for files left in AUDIO_DIR (uploads, files from older versions)
+    AUDIO_FILE_MAX_AGE_SECONDS: int = int(os.getenv("AUDIO_FILE_MAX_AGE_SECONDS", "3600"))
+    AUDIO_DIR_MAX_BYTES: int = int(os.getenv("AUDIO_DIR_MAX_BYTES", str(256 * 1024 * 1024)))
+    AUDIO_JANITOR_INTERVAL_SECONDS: int = int(os.getenv("AUDIO_JANITOR_INTERVAL_SECONDS", "300"))
+    
+    # Content-addressed TTS cache: memory tier plus an optional disk tier (empty dir disables it)
+    TTS_CACHE_ENABLED: bool = os.getenv("TTS_CACHE_ENABLED", "true").lower() == "true"
+    TTS_CACHE_MEMORY_BYTES: int = int(os.getenv("TTS_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+    TTS_CACHE_DIR: str = os.getenv("TTS_CACHE_DIR", "audio/tts_cache")
+    TTS_CACHE_DISK_BYTES: int = int(os.getenv("TTS_CACHE_DISK_BYTES", str(256 * 1024 * 1024)))
+    
+    # Largest voice upload /chat/transcribe accepts (Whisper's own limit is 25 MB)
+    TRANSCRIBE_MAX_UPLOAD_BYTES: int = int(os.getenv("TRANSCRIBE_MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
     
     # Application Configuration
     DEFAULT_PATIENT_ID: str = os.getenv("DEFAULT_PATIENT_ID", "143")
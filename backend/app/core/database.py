@@ -1,16 +1,286 @@
 from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import create_engine, text, inspect, event
+from sqlalchemy.exc import DBAPIError, DisconnectionError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.elements import TextClause
 from app.core.config import settings
+from app.core.query_result import QueryResult
 import time
-from typing import Optional
+import random
+import hashlib
+import threading
+from typing import Optional, List, Dict, Union, Iterator
+from contextlib import closing
 import logging
 import pymysql
 
 logger = logging.getLogger(__name__)
 
+# PyMySQL type codes -> names (DECIMAL, DATE, VAR_STRING, ...) for QueryResult.driver_types
+MYSQL_TYPE_NAMES = {
+    code: name for name, code in vars(pymysql.constants.FIELD_TYPE).items() if name.isupper()
+}
+
+# Upper bounds (ms) of the checkout wait histogram buckets; the last bucket is open-ended
+POOL_WAIT_BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000, 5000]
+
+
+class PoolMetrics:
+    """Counters and a checkout wait-time histogram fed by SQLAlchemy pool events"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+        self.timeouts = 0
+        self.wait_counts = [0] * (len(POOL_WAIT_BUCKETS_MS) + 1)
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.waits = 0
+
+    def record_wait(self, wait_ms: float, timed_out: bool = False):
+        with self._lock:
+            bucket = next((i for i, bound in enumerate(POOL_WAIT_BUCKETS_MS) if wait_ms <= bound), len(POOL_WAIT_BUCKETS_MS))
+            self.wait_counts[bucket] += 1
+            self.wait_total_ms += wait_ms
+            self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+            self.waits += 1
+            if timed_out:
+                self.timeouts += 1
+
+    def increment(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def attach(self, pool):
+        """Listen to a pool's lifecycle events"""
+        event.listen(pool, "checkout", lambda *args: self.increment("checkouts"))
+        event.listen(pool, "checkin", lambda *args: self.increment("checkins"))
+        event.listen(pool, "connect", lambda *args: self.increment("connects"))
+        event.listen(pool, "invalidate", lambda *args: self.increment("invalidations"))
+        event.listen(pool, "soft_invalidate", lambda *args: self.increment("soft_invalidations"))
+
+    def wait_percentile(self, fraction: float) -> Optional[float]:
+        """Upper bucket bound containing the given fraction of checkout waits"""
+        if not self.waits:
+            return None
+        target = fraction * self.waits
+        running = 0
+        for index, count in enumerate(self.wait_counts):
+            running += count
+            if running >= target:
+                return POOL_WAIT_BUCKETS_MS[index] if index < len(POOL_WAIT_BUCKETS_MS) else round(self.wait_max_ms, 1)
+        return round(self.wait_max_ms, 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            labels = [f"<={bound}ms" for bound in POOL_WAIT_BUCKETS_MS] + [f">{POOL_WAIT_BUCKETS_MS[-1]}ms"]
+            return {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "soft_invalidations": self.soft_invalidations,
+                "checkout_timeouts": self.timeouts,
+                "checkout_wait_histogram": dict(zip(labels, self.wait_counts)),
+                "checkout_wait_avg_ms": round(self.wait_total_ms / self.waits, 2) if self.waits else 0.0,
+                "checkout_wait_p95_ms": self.wait_percentile(0.95),
+                "checkout_wait_max_ms": round(self.wait_max_ms, 2),
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times how long each checkout waits for a free connection"""
+    metrics: Optional[PoolMetrics] = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            # Only exhaustion counts; a refused or failed connect is not a pool timeout
+            if self.metrics:
+                self.metrics.record_wait((time.perf_counter() - start) * 1000, timed_out=True)
+            raise
+        if self.metrics:
+            self.metrics.record_wait((time.perf_counter() - start) * 1000)
+        return connection
+
+
+def build_engine_options(uri: str) -> dict:
+    """create_engine() pool arguments from settings; SQLite keeps its own pool class"""
+    options = {
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
+    if make_url(uri).get_backend_name() != "sqlite":
+        options.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+        )
+    return options
+
+
+# Errors that mean "this server is unavailable" rather than "this query is wrong"
+FAILOVER_ERRORS = (OperationalError, DisconnectionError, PoolTimeoutError)
+# Read target that pins a query to the primary (see DatabaseManager.choose_read_target)
+PRIMARY_TARGET = "primary"
+
+
+class ReplicaSet:
+    """Read replicas with their own pools, health-checked and weighted for routing.
+
+    Health (SELECT 1 latency) and replication lag are re-checked at most every
+    check_seconds. Replicas that are down or lag more than max_lag_seconds get
+    no traffic; the rest are picked at random weighted by inverse latency.
+    choose() returns None when no replica is usable, meaning "use the primary".
+    """
+
+    def __init__(self, urls: List[str], max_lag_seconds: float, check_seconds: float, lag_query: str = ""):
+        self._max_lag_seconds = max_lag_seconds
+        self._check_seconds = check_seconds
+        self._lag_query = lag_query
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._primary_fallbacks = 0
+        self.replicas = []
+        for index, url in enumerate(urls):
+            engine = create_engine(url, **build_engine_options(url))
+            metrics = PoolMetrics()
+            metrics.attach(engine.pool)
+            if isinstance(engine.pool, InstrumentedQueuePool):
+                engine.pool.metrics = metrics
+            self.replicas.append({
+                "name": f"replica-{index}",
+                "url": make_url(url).render_as_string(hide_password=True),
+                "engine": engine,
+                "metrics": metrics,
+                "healthy": True,
+                "lag_seconds": None,
+                "latency_ms": None,
+                "queries": 0,
+                "failures": 0,
+                "last_error": None,
+            })
+
+    def _measure_lag(self, connection, backend: str) -> Optional[float]:
+        """Replication lag in seconds; None when the server doesn't report it"""
+        if self._lag_query:
+            value = connection.execute(text(self._lag_query)).scalar()
+            return float(value) if value is not None else None
+        if backend != "mysql":
+            return 0.0
+        for statement, column in (("SHOW REPLICA STATUS", "Seconds_Behind_Source"),
+                                  ("SHOW SLAVE STATUS", "Seconds_Behind_Master")):
+            try:
+                row = connection.execute(text(statement)).mappings().first()
+            except DBAPIError:
+                continue
+            if row is None:
+                # Not configured as a replica (e.g. a local stand-in)
+                return 0.0
+            value = row.get(column)
+            return float(value) if value is not None else None
+        return None
+
+    def check_health(self, force: bool = False):
+        """Refresh health, latency and lag of every replica (throttled)"""
+        now = time.time()
+        if not force and now - self._last_check < self._check_seconds:
+            return
+        if not self._lock.acquire(blocking=False):
+            # Another thread is already checking
+            return
+        try:
+            for replica in self.replicas:
+                start = time.perf_counter()
+                try:
+                    with replica["engine"].connect() as connection:
+                        connection.execute(text("SELECT 1"))
+                        replica["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+                        replica["lag_seconds"] = self._measure_lag(connection, replica["engine"].dialect.name)
+                    replica["healthy"] = True
+                    replica["last_error"] = None
+                except Exception as e:
+                    replica["healthy"] = False
+                    replica["last_error"] = str(e)[:200]
+                    logger.warning(f"⚠️ Replica {replica['name']} health check failed: {e}")
+            self._last_check = time.time()
+        finally:
+            self._lock.release()
+
+    def _eligible(self, replica: dict) -> bool:
+        lag = replica["lag_seconds"]
+        return replica["healthy"] and lag is not None and lag <= self._max_lag_seconds
+
+    def choose(self) -> Optional[dict]:
+        """Pick a replica for a read, or None to use the primary"""
+        self.check_health()
+        candidates = [replica for replica in self.replicas if self._eligible(replica)]
+        if not candidates:
+            self._primary_fallbacks += 1
+            return None
+        weights = [1.0 / (1.0 + (replica["latency_ms"] or 0.0)) for replica in candidates]
+        replica = random.choices(candidates, weights=weights)[0]
+        replica["queries"] += 1
+        return replica
+
+    def use(self, name: str) -> Optional[dict]:
+        """The named replica for a read chosen earlier, or None if it has since failed"""
+        for replica in self.replicas:
+            # Already counted in "queries" when choose() picked it
+            if replica["name"] == name and replica["healthy"]:
+                return replica
+        self._primary_fallbacks += 1
+        return None
+
+    def mark_failed(self, replica: dict, error: Exception):
+        """Take a replica out of rotation until its next successful health check"""
+        replica["healthy"] = False
+        replica["failures"] += 1
+        replica["last_error"] = str(error)[:200]
+        self._primary_fallbacks += 1
+
+    def get_stats(self) -> dict:
+        return {
+            "max_lag_seconds": self._max_lag_seconds,
+            "primary_fallbacks": self._primary_fallbacks,
+            "replicas": [
+                {
+                    "name": replica["name"],
+                    "url": replica["url"],
+                    "healthy": replica["healthy"],
+                    "eligible": self._eligible(replica),
+                    "lag_seconds": replica["lag_seconds"],
+                    "latency_ms": replica["latency_ms"],
+                    "queries": replica["queries"],
+                    "failures": replica["failures"],
+                    "last_error": replica["last_error"],
+                    "checked_out": replica["engine"].pool.checkedout() if isinstance(replica["engine"].pool, QueuePool) else None,
+                    "checkout_wait_p95_ms": replica["metrics"].wait_percentile(0.95),
+                }
+                for replica in self.replicas
+            ],
+        }
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica["engine"].dispose()
+
+
 class DatabaseManager:
     """Singleton database manager with connection pooling"""
     _instance: Optional['DatabaseManager'] = None
     _db: Optional[SQLDatabase] = None
+    _engine: Optional[Engine] = None
+    _pool_metrics: Optional[PoolMetrics] = None
+    _replicas: Optional[ReplicaSet] = None
     
     def __new__(cls):
         if cls._instance is None:
@@ -27,10 +297,25 @@ class DatabaseManager:
         logger.info("🔄 Initializing database connection...")
         
         # Create connection string
-        mysql_uri = f"mysql+pymysql://{settings.DATABASE_USER}:{settings.DATABASE_PASSWORD}@{settings.DATABASE_HOST}:{settings.DATABASE_PORT}/{settings.DATABASE_NAME}"
+        mysql_uri = settings.DATABASE_URL or f"mysql+pymysql://{settings.DATABASE_USER}:{settings.DATABASE_PASSWORD}@{settings.DATABASE_HOST}:{settings.DATABASE_PORT}/{settings.DATABASE_NAME}"
+        
+        # Create LangChain SQLDatabase instance on top of our own pooled engine
+        self._engine = create_engine(mysql_uri, **build_engine_options(mysql_uri))
+        self._pool_metrics = PoolMetrics()
+        self._pool_metrics.attach(self._engine.pool)
+        if isinstance(self._engine.pool, InstrumentedQueuePool):
+            self._engine.pool.metrics = self._pool_metrics
+        self._db = SQLDatabase(self._engine)
         
-        # Create LangChain SQLDatabase instance (it will handle connection internally)
-        self._db = SQLDatabase.from_uri(mysql_uri)
+        replica_urls = [url.strip() for url in settings.DATABASE_REPLICA_URLS.split(",") if url.strip()]
+        if replica_urls:
+            self._replicas = ReplicaSet(
+                replica_urls,
+                max_lag_seconds=settings.REPLICA_MAX_LAG_SECONDS,
+                check_seconds=settings.REPLICA_HEALTH_CHECK_SECONDS,
+                lag_query=settings.REPLICA_LAG_QUERY,
+            )
+            logger.info(f"📚 {len(replica_urls)} read replica(s) configured")
         
         connection_duration = time.time() - connection_start
         logger.info(f"✅ Database connection initialized in {connection_duration*1000:.0f}ms")
@@ -41,6 +326,143 @@ class DatabaseManager:
             self._initialize_connection()
         return self._db
     
+    def get_engine(self) -> Engine:
+        """Get the SQLAlchemy engine behind the database instance"""
+        if self._engine is None:
+            self._initialize_connection()
+        return self._engine
+    
+    def reload_schema(self):
+        """Re-reflect table metadata after a DDL change, keeping the same engine"""
+        if self._engine is None:
+            self._initialize_connection()
+            return
+        self._db = SQLDatabase(self._engine)
+        logger.info("🔄 Database schema metadata reloaded")
+    
+    def stream_query(self, query: Union[str, TextClause], parameters: Optional[dict] = None,
+                     batch_size: Optional[int] = None, engine: Optional[Engine] = None) -> Iterator[QueryResult]:
+        """Yield a query's result in fixed-size column batches.
+
+        Uses an unbuffered server-side cursor (PyMySQL SSCursor) so only one batch
+        is held in memory at a time. If the consumer stops early, the connection
+        is invalidated instead of draining the rest of the result from the server.
+        """
+        batch_size = batch_size or settings.QUERY_STREAM_BATCH_ROWS
+        statement = text(query) if isinstance(query, str) else query
+        with (engine or self.get_engine()).connect() as connection:
+            connection = connection.execution_options(stream_results=True, max_row_buffer=batch_size)
+            result = connection.execute(statement, parameters or {})
+            if not result.returns_rows:
+                return
+            columns = list(result.keys())
+            description = result.cursor.description or []
+            driver_types = [MYSQL_TYPE_NAMES.get(column[1]) for column in description]
+            try:
+                for rows in result.partitions(batch_size):
+                    yield QueryResult.from_rows(columns, rows, driver_types)
+            except GeneratorExit:
+                connection.invalidate()
+                raise
+    
+    def choose_read_target(self) -> str:
+        """Server for an upcoming read: a replica name, or PRIMARY_TARGET.
+
+        Pass it to explain_query and execute_query so a statement is admitted
+        and run on the same server.
+        """
+        replica = self._replicas.choose() if self._replicas else None
+        return replica["name"] if replica else PRIMARY_TARGET
+
+    def _read_replica(self, target: Optional[str]) -> Optional[dict]:
+        """Replica for a read: the chosen target, or a fresh choice when none was made"""
+        if not self._replicas or target == PRIMARY_TARGET:
+            return None
+        return self._replicas.use(target) if target else self._replicas.choose()
+
+    def execute_query(self, query: Union[str, TextClause], parameters: Optional[dict] = None,
+                      max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+                      read_only: bool = False, target: Optional[str] = None) -> QueryResult:
+        """Run a query and return a typed, column-oriented result.
+
+        read_only queries go to a healthy, caught-up replica when replicas are
+        configured (the one named by target, if given), and are retried on the
+        primary if the replica is unreachable.
+        """
+        replica = self._read_replica(target) if read_only else None
+        if replica is None:
+            return self._execute_on(self.get_engine(), query, parameters, max_rows, max_bytes)
+        try:
+            return self._execute_on(replica["engine"], query, parameters, max_rows, max_bytes)
+        except FAILOVER_ERRORS as e:
+            logger.warning(f"⚠️ Replica {replica['name']} failed, retrying on primary: {e}")
+            self._replicas.mark_failed(replica, e)
+            return self._execute_on(self.get_engine(), query, parameters, max_rows, max_bytes)
+    
+    def _execute_on(self, engine: Engine, query: Union[str, TextClause], parameters: Optional[dict],
+                    max_rows: Optional[int], max_bytes: Optional[int]) -> QueryResult:
+        """Stream a query on one engine until the row or byte budget is reached.
+
+        A result cut short by the budget is marked as truncated.
+        """
+        max_rows = max_rows or settings.QUERY_MAX_ROWS
+        max_bytes = max_bytes or settings.QUERY_MAX_BYTES
+        batches: List[QueryResult] = []
+        row_count = 0
+        byte_count = 0
+        truncation_reason = None
+        
+        with closing(self.stream_query(query, parameters, engine=engine)) as stream:
+            for batch in stream:
+                if row_count + batch.row_count > max_rows:
+                    batch = batch.head(max_rows - row_count)
+                    truncation_reason = f"row limit of {max_rows} reached"
+                byte_count += batch.estimated_bytes
+                batches.append(batch)
+                row_count += batch.row_count
+                if truncation_reason is None and byte_count >= max_bytes:
+                    truncation_reason = f"byte limit of {max_bytes} reached"
+                if truncation_reason:
+                    break
+        
+        query_result = QueryResult.concat(batches)
+        if truncation_reason:
+            query_result.truncated = True
+            query_result.truncation_reason = truncation_reason
+            logger.warning(f"✂️ Query result truncated after {query_result.row_count} rows: {truncation_reason}")
+        return query_result
+    
+    def explain_query(self, query: str, target: Optional[str] = None) -> Optional[dict]:
+        """Optimizer row estimate for a read query via MySQL EXPLAIN.
+
+        Returns {"estimated_rows", "full_scans"} or None when the dialect has no
+        row estimates. Runs on target (from choose_read_target), which should be
+        where the query itself will run.
+        """
+        replica = self._read_replica(target)
+        engine = replica["engine"] if replica else self.get_engine()
+        if engine.dialect.name != "mysql":
+            return None
+        with engine.connect() as connection:
+            # no_parameters: keep "%" in LIKE patterns away from the driver's formatting
+            result = connection.execution_options(no_parameters=True).exec_driver_sql(f"EXPLAIN {query}")
+            plan = [dict(row) for row in result.mappings()]
+        
+        # Nested-loop estimate of rows examined: each table is read once per row
+        # surviving the tables joined before it (rows x filtered%), per SELECT
+        examined = 0.0
+        fanout: Dict[str, float] = {}
+        full_scans = []
+        for step in plan:
+            select_id = str(step.get("id"))
+            rows = float(step.get("rows") or 1)
+            outer_rows = fanout.get(select_id, 1.0)
+            examined += outer_rows * rows
+            fanout[select_id] = outer_rows * max(rows * float(step.get("filtered") or 100) / 100, 1.0)
+            if step.get("type") == "ALL" and step.get("table"):
+                full_scans.append(step["table"])
+        return {"estimated_rows": int(examined), "full_scans": full_scans}
+    
     def test_connection(self) -> bool:
         """Test database connectivity"""
         try:
@@ -53,14 +475,34 @@ class DatabaseManager:
             return False
     
     def get_pool_status(self) -> dict:
-        """Get connection status"""
+        """Get connection status with live pool occupancy and checkout metrics"""
         try:
-            if self._db:
-                return {
+            if self._db and self._engine:
+                pool = self._engine.pool
+                status = {
                     "status": "connected",
                     "dialect": str(self._db.dialect),
-                    "database": settings.DATABASE_NAME
+                    "database": settings.DATABASE_NAME,
+                    "pool_class": type(pool).__name__,
+                    "pre_ping": settings.DB_POOL_PRE_PING,
+                    "recycle_seconds": settings.DB_POOL_RECYCLE,
                 }
+                if isinstance(pool, QueuePool):
+                    status.update({
+                        "pool_size": pool.size(),
+                        "max_overflow": settings.DB_MAX_OVERFLOW,
+                        "timeout_seconds": pool.timeout(),
+                        "checked_in": pool.checkedin(),
+                        "checked_out": pool.checkedout(),
+                        "overflow": max(pool.overflow(), 0),
+                        "capacity": pool.size() + max(settings.DB_MAX_OVERFLOW, 0),
+                        "agent_max_concurrency": settings.AGENT_MAX_CONCURRENCY,
+                    })
+                if self._pool_metrics:
+                    status.update(self._pool_metrics.snapshot())
+                if self._replicas:
+                    status["read_replicas"] = self._replicas.get_stats()
+                return status
             return {"status": "not_initialized"}
         except Exception as e:
             logger.error(f"❌ Error getting connection status: {e}")
@@ -72,7 +514,221 @@ class DatabaseManager:
             # LangChain SQLDatabase doesn't have explicit close method
             # It will be garbage collected
             self._db = None
-            logger.info("🔐 Database connection closed")
+        if self._engine:
+            self._engine.dispose()
+            self._engine = None
+        if self._replicas:
+            self._replicas.dispose()
+            self._replicas = None
+        logger.info("🔐 Database connection closed")
 
 # Global database manager instance
-db_manager = DatabaseManager()
\ No newline at end of file
+db_manager = DatabaseManager()
+
+# Tables that hold patient data; always considered relevant for patient questions
+PATIENT_TABLE_KEYWORDS = ['patient', 'registration', 'treatment', 'pathology']
+# Column names that hold the patient identifier, in order of preference
+PATIENT_ID_COLUMNS = ['patient_id', 'patientid', 'patient_no', 'patient_number']
+
+
+class SchemaCache:
+    """Process-wide cache of table names, CREATE TABLE text and sample rows.
+
+    Entries expire after SCHEMA_CACHE_TTL_SECONDS. In between, a cheap schema
+    fingerprint is checked at most every SCHEMA_CACHE_CHECK_SECONDS and the cache
+    is dropped as soon as it changes (DDL, or UPDATE_TIME moving on MySQL).
+    """
+    
+    # MySQL: column definitions checksum plus table create/update times
+    MYSQL_FINGERPRINT_QUERY = """
+        SELECT
+            (SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS('|', TABLE_NAME, COLUMN_NAME,
+                    COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY, ORDINAL_POSITION))), 0))
+             FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE()) AS columns_checksum,
+            (SELECT CONCAT(COALESCE(MAX(CREATE_TIME), ''), ':', COALESCE(MAX(UPDATE_TIME), ''))
+             FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE()) AS table_times
+    """
+    SQLITE_FINGERPRINT_QUERY = "SELECT group_concat(name || ':' || COALESCE(sql, ''), ';') FROM sqlite_master"
+    
+    def __init__(self, manager: DatabaseManager, ttl_seconds: int, check_seconds: int):
+        self._manager = manager
+        self._ttl_seconds = ttl_seconds
+        self._check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._table_names: Optional[List[str]] = None
+        self._table_info: Dict[str, str] = {}
+        self._table_columns: Dict[str, List[dict]] = {}
+        self._fingerprint: Optional[tuple] = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+    
+    def _compute_fingerprint(self) -> Optional[tuple]:
+        """Cheap (ddl, data) fingerprint pair; None when the dialect has no supported query"""
+        db = self._manager.get_database()
+        if db.dialect == "mysql":
+            query = self.MYSQL_FINGERPRINT_QUERY
+        elif db.dialect == "sqlite":
+            query = self.SQLITE_FINGERPRINT_QUERY
+        else:
+            return None
+        try:
+            with self._manager.get_engine().connect() as connection:
+                row = connection.execute(text(query)).fetchone()
+            return tuple(hashlib.sha1(str(value).encode()).hexdigest() for value in row)
+        except Exception as e:
+            logger.error(f"❌ Schema fingerprint query failed: {e}")
+            return None
+    
+    def _clear(self):
+        self._table_names = None
+        self._table_info = {}
+        self._table_columns = {}
+        self._fingerprint = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+    
+    def _validate(self):
+        """Drop cached entries if the TTL expired or the fingerprint changed (lock held)"""
+        now = time.time()
+        if self._table_names is None:
+            return
+        if now - self._loaded_at > self._ttl_seconds:
+            logger.info("⏰ Schema cache TTL expired")
+            self._invalidate_locked(reload_metadata=False)
+            return
+        if now - self._checked_at < self._check_seconds:
+            return
+        self._checked_at = now
+        fingerprint = self._compute_fingerprint()
+        if fingerprint is None or self._fingerprint is None or fingerprint == self._fingerprint:
+            return
+        # Only a DDL change needs the table metadata re-reflected; UPDATE_TIME just stales sample rows
+        ddl_changed = fingerprint[0] != self._fingerprint[0]
+        logger.info(f"🔄 Schema fingerprint changed ({'DDL' if ddl_changed else 'data'}), invalidating schema cache")
+        self._invalidate_locked(reload_metadata=ddl_changed)
+    
+    def _invalidate_locked(self, reload_metadata: bool):
+        self._clear()
+        self._invalidations += 1
+        if reload_metadata:
+            self._manager.reload_schema()
+    
+    def _ensure_loaded(self):
+        """Load table names and the fingerprint they belong to (lock held)"""
+        if self._table_names is not None:
+            return
+        self._fingerprint = self._compute_fingerprint()
+        self._table_names = sorted(self._manager.get_database().get_usable_table_names())
+        self._loaded_at = self._checked_at = time.time()
+    
+    def get_table_names(self) -> List[str]:
+        """Usable table names, as returned by the sql_db_list_tables tool"""
+        with self._lock:
+            self._validate()
+            if self._table_names is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            self._ensure_loaded()
+            return list(self._table_names)
+    
+    def get_table_info(self, table_names: List[str]) -> str:
+        """CREATE TABLE text plus sample rows, as returned by the sql_db_schema tool"""
+        with self._lock:
+            self._validate()
+            self._ensure_loaded()
+            db = self._manager.get_database()
+            missing = set(table_names).difference(self._table_names)
+            if missing:
+                raise ValueError(f"table_names {missing} not found in database")
+            for table_name in table_names:
+                if table_name in self._table_info:
+                    self._hits += 1
+                    continue
+                self._misses += 1
+                self._table_info[table_name] = db.get_table_info([table_name])
+            return "\n\n".join(self._table_info[table_name] for table_name in table_names)
+    
+    def get_table_columns(self, table_name: str) -> List[dict]:
+        """Column names and types for a table, as [{"name": ..., "type": ...}]"""
+        with self._lock:
+            self._validate()
+            self._ensure_loaded()
+            if table_name not in self._table_columns:
+                self._misses += 1
+                columns = inspect(self._manager.get_engine()).get_columns(table_name)
+                self._table_columns[table_name] = [
+                    {"name": column["name"], "type": str(column["type"])} for column in columns
+                ]
+            else:
+                self._hits += 1
+            return list(self._table_columns[table_name])
+    
+    def get_patient_tables(self) -> Dict[str, str]:
+        """Map each patient data table to the column holding the patient id"""
+        patient_tables = {}
+        for table_name in self.get_table_names():
+            table_lower = table_name.lower()
+            if not any(keyword in table_lower for keyword in PATIENT_TABLE_KEYWORDS):
+                continue
+            column_names = {column["name"].lower(): column["name"] for column in self.get_table_columns(table_name)}
+            patient_column = next((column_names[c] for c in PATIENT_ID_COLUMNS if c in column_names), None)
+            # Registration/master tables key the patient by their own id column
+            is_master_table = "registration" in table_lower or table_lower in ("patient", "patients")
+            if patient_column is None and is_master_table:
+                patient_column = column_names.get("id")
+            if patient_column:
+                patient_tables[table_name] = patient_column
+        return patient_tables
+    
+    def invalidate(self):
+        """Drop everything and re-reflect metadata on next use"""
+        with self._lock:
+            self._invalidate_locked(reload_metadata=True)
+    
+    def get_stats(self) -> dict:
+        """Get cache hit/miss statistics"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "tables_cached": len(self._table_info),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+                "invalidations": self._invalidations,
+                "age_seconds": round(time.time() - self._loaded_at, 1) if self._table_names is not None else None,
+            }
+
+
+# Global schema cache instance
+schema_cache = SchemaCache(
+    db_manager,
+    ttl_seconds=settings.SCHEMA_CACHE_TTL_SECONDS,
+    check_seconds=settings.SCHEMA_CACHE_CHECK_SECONDS,
+)
+
+
+def get_patient_data_version(patient_id: str) -> str:
+    """Checksum over a patient's rows in every patient table; changes when any of them change"""
+    engine = db_manager.get_engine()
+    is_mysql = db_manager.get_database().dialect == "mysql"
+    digest = hashlib.sha1()
+    with engine.connect() as connection:
+        for table_name, patient_column in sorted(schema_cache.get_patient_tables().items()):
+            preparer = engine.dialect.identifier_preparer
+            table_sql = preparer.quote(table_name)
+            column_sql = preparer.quote(patient_column)
+            if is_mysql:
+                columns_sql = ", ".join(preparer.quote(c["name"]) for c in schema_cache.get_table_columns(table_name))
+                query = (f"SELECT COUNT(*), COALESCE(SUM(CRC32(CONCAT_WS('|', {columns_sql}))), 0) "
+                         f"FROM {table_sql} WHERE {column_sql} = :patient_id")
+                row = connection.execute(text(query), {"patient_id": patient_id}).fetchone()
+                digest.update(f"{table_name}:{tuple(row)}".encode())
+            else:
+                query = f"SELECT * FROM {table_sql} WHERE {column_sql} = :patient_id"
+                rows = connection.execute(text(query), {"patient_id": patient_id}).fetchall()
+                digest.update(f"{table_name}:{sorted(map(repr, rows))}".encode())
+    return digest.hexdigest()
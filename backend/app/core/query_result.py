@@ -0,0 +1,210 @@
+import datetime
+import decimal
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Logical column types, inferred from the values the driver returned
+TYPE_NULL = "null"
+TYPE_BOOLEAN = "boolean"
+TYPE_INTEGER = "integer"
+TYPE_FLOAT = "float"
+TYPE_DECIMAL = "decimal"
+TYPE_DATE = "date"
+TYPE_DATETIME = "datetime"
+TYPE_STRING = "string"
+TYPE_OBJECT = "object"
+
+NUMERIC_TYPES = (TYPE_INTEGER, TYPE_FLOAT, TYPE_DECIMAL)
+
+
+def infer_column_type(values: Sequence[Any]) -> str:
+    """Logical type of a column from its non-null values"""
+    kinds = set()
+    for value in values:
+        if value is None:
+            continue
+        # bool before int, datetime before date: both are subclasses
+        if isinstance(value, (bool, np.bool_)):
+            kinds.add(TYPE_BOOLEAN)
+        elif isinstance(value, (int, np.integer)):
+            kinds.add(TYPE_INTEGER)
+        elif isinstance(value, (float, np.floating)):
+            kinds.add(TYPE_FLOAT)
+        elif isinstance(value, decimal.Decimal):
+            kinds.add(TYPE_DECIMAL)
+        elif isinstance(value, datetime.datetime):
+            kinds.add(TYPE_DATETIME)
+        elif isinstance(value, datetime.date):
+            kinds.add(TYPE_DATE)
+        elif isinstance(value, str):
+            kinds.add(TYPE_STRING)
+        else:
+            kinds.add(TYPE_OBJECT)
+        if len(kinds) > 1:
+            break
+    if not kinds:
+        return TYPE_NULL
+    if len(kinds) == 1:
+        return kinds.pop()
+    if kinds <= set(NUMERIC_TYPES):
+        return TYPE_FLOAT
+    return TYPE_OBJECT
+
+
+def to_array(values: Sequence[Any], column_type: str, mask: np.ndarray) -> np.ndarray:
+    """Pack a column into a typed NumPy array; nulls are tracked in the mask"""
+    has_nulls = bool(mask.any())
+    if column_type == TYPE_INTEGER and not has_nulls:
+        return np.fromiter(values, dtype=np.int64, count=len(values))
+    if column_type in NUMERIC_TYPES:
+        return np.array([np.nan if value is None else float(value) for value in values], dtype=np.float64)
+    if column_type == TYPE_BOOLEAN and not has_nulls:
+        return np.fromiter(values, dtype=bool, count=len(values))
+    if column_type == TYPE_DATE:
+        return np.array(["NaT" if value is None else value for value in values], dtype="datetime64[D]")
+    if column_type == TYPE_DATETIME:
+        return np.array(["NaT" if value is None else value for value in values], dtype="datetime64[us]")
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+class QueryResult:
+    """Column-oriented, typed result of a SQL query.
+
+    Each column is one NumPy array (int64, float64, datetime64 or object) plus a
+    boolean null mask, Arrow-style, so later stages never have to re-parse the
+    stringified tuples that the sql_db_query tool returns.
+    """
+
+    def __init__(self, columns: List[str], column_types: List[str], arrays: List[np.ndarray],
+                 null_masks: List[np.ndarray], driver_types: Optional[List[Optional[str]]] = None):
+        self.columns = columns
+        self.column_types = column_types
+        self.arrays = arrays
+        self.null_masks = null_masks
+        self.driver_types = driver_types or [None] * len(columns)
+        self.row_count = len(arrays[0]) if arrays else 0
+        # Set when a row/byte budget stopped the fetch early
+        self.truncated = False
+        self.truncation_reason: Optional[str] = None
+
+    @classmethod
+    def from_rows(cls, columns: Sequence[str], rows: Sequence[Sequence[Any]],
+                  driver_types: Optional[List[Optional[str]]] = None) -> "QueryResult":
+        """Transpose driver rows into typed columns"""
+        columns = list(columns)
+        column_values = list(zip(*rows)) if rows else [()] * len(columns)
+        column_types, arrays, null_masks = [], [], []
+        for values in column_values:
+            mask = np.fromiter((value is None for value in values), dtype=bool, count=len(values))
+            column_type = infer_column_type(values)
+            column_types.append(column_type)
+            arrays.append(to_array(values, column_type, mask))
+            null_masks.append(mask)
+        return cls(columns, column_types, arrays, null_masks, driver_types)
+
+    @classmethod
+    def empty(cls) -> "QueryResult":
+        return cls([], [], [], [])
+
+    @classmethod
+    def concat(cls, batches: List["QueryResult"]) -> "QueryResult":
+        """Join streamed batches of the same query into one result"""
+        batches = [batch for batch in batches if batch.columns]
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+
+        first = batches[0]
+        column_types, arrays, null_masks = [], [], []
+        for index in range(len(first.columns)):
+            kinds = {batch.column_types[index] for batch in batches}
+            mask = np.concatenate([batch.null_masks[index] for batch in batches])
+            if len(kinds) == 1:
+                column_type = kinds.pop()
+                array = np.concatenate([batch.arrays[index] for batch in batches])
+            else:
+                # Batches disagree (e.g. an all-NULL batch); re-infer from the plain values
+                values = []
+                for batch in batches:
+                    batch_values = batch.arrays[index].tolist()
+                    values.extend(None if null else value for value, null in zip(batch_values, batch.null_masks[index]))
+                column_type = infer_column_type(values)
+                array = to_array(values, column_type, mask)
+            column_types.append(column_type)
+            arrays.append(array)
+            null_masks.append(mask)
+        return cls(list(first.columns), column_types, arrays, null_masks, first.driver_types)
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def column(self, name: str) -> np.ndarray:
+        """Values of one column"""
+        return self.arrays[self.columns.index(name)]
+
+    def iter_rows(self, limit: Optional[int] = None) -> Iterator[tuple]:
+        """Row tuples of plain Python values, None for nulls"""
+        count = self.row_count if limit is None else min(limit, self.row_count)
+        # tolist() turns int64/float64/datetime64 into int/float/date/datetime in one pass
+        column_lists = []
+        for column_type, array in zip(self.column_types, self.arrays):
+            values = array[:count]
+            if column_type == TYPE_INTEGER and values.dtype != np.int64:
+                # Integer column with NULLs is stored as float64
+                values = np.nan_to_num(values).astype(np.int64)
+            column_lists.append(values.tolist())
+        mask_lists = [mask[:count].tolist() for mask in self.null_masks]
+        for index in range(count):
+            yield tuple(
+                None if masks[index] else values[index]
+                for values, masks in zip(column_lists, mask_lists)
+            )
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """DataFrame built straight from the column arrays (no per-row work for numeric columns)"""
+        data: Dict[str, Any] = {}
+        for name, array, mask in zip(self.columns, self.arrays, self.null_masks):
+            if array.dtype == object and mask.any():
+                array = array.copy()
+                array[mask] = None
+            data[name] = array
+        return pd.DataFrame(data, columns=self.columns)
+
+    def schema(self) -> List[dict]:
+        """Column names with logical and driver types"""
+        return [
+            {"name": name, "type": column_type, "driver_type": driver_type}
+            for name, column_type, driver_type in zip(self.columns, self.column_types, self.driver_types)
+        ]
+
+    def head(self, count: int) -> "QueryResult":
+        """First `count` rows (views of the same buffers)"""
+        return QueryResult(
+            self.columns, self.column_types,
+            [array[:count] for array in self.arrays],
+            [mask[:count] for mask in self.null_masks],
+            self.driver_types,
+        )
+
+    def schema_summary(self) -> str:
+        """Compact "name (type)" list for prompts"""
+        return ", ".join(f"{name} ({column_type})" for name, column_type in zip(self.columns, self.column_types))
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the column buffers themselves (object columns count pointers only)"""
+        return sum(array.nbytes + mask.nbytes for array, mask in zip(self.arrays, self.null_masks))
+
+    @property
+    def estimated_bytes(self) -> int:
+        """Buffer memory plus the payload of string/bytes values in object columns"""
+        total = self.nbytes
+        for array in self.arrays:
+            if array.dtype == object:
+                total += sum(len(value) for value in array if isinstance(value, (str, bytes, bytearray)))
+        return total
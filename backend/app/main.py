@@ -1,11 +1,30 @@
 import os
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+import time
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from contextlib import asynccontextmanager
 from app.core.config import settings
-from app.core.database import db_manager
+from app.core.database import db_manager, schema_cache
 from app.routers import chat
+from app.services.database_agent import agent_graph_factory
+from app.services.answer_cache import answer_cache
+from app.services.sql_plan_cache import sql_plan_cache
+from app.services.sql_guard import sql_guard
+from app.services.query_log import query_log
+from app.services.patient_snapshot import patient_snapshots
+from app.services.http_clients import openai_http
+from app.services.prompt_budget import prompt_stats
+from app.services.audio_jobs import audio_jobs, run_audio_janitor
+from app.services.tts_cache import tts_cache
+from app.services.tracing import tracer
+from app.services.token_usage import token_usage_stats
+from app.services.metrics import (
+    metrics_registry, http_request_duration, http_requests_in_flight, http_request_errors
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,6 +35,11 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("🚀 Application starting up...")
     
+    # Blocking DB/boto3 calls run via asyncio.to_thread on this pool
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=settings.BLOCKING_IO_THREADS, thread_name_prefix="blocking-io")
+    )
+    
     # Initialize and test database connection
     try:
         if db_manager.test_connection():
@@ -27,13 +51,28 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"❌ Database initialization error: {e}")
     
+    # Compile the agent graph once so the first request doesn't pay for it
+    try:
+        agent_graph_factory.get_graph(settings.OPENAI_API_KEY)
+        logger.info("✅ Agent graph compiled")
+    except Exception as e:
+        logger.error(f"❌ Agent graph compilation error: {e}")
+    
+    # Keep the audio directory bounded on long-running instances
+    janitor_task = asyncio.create_task(run_audio_janitor())
+    
     logger.info(f"🌐 Port: {os.environ.get('PORT', '8080')}")
     
     yield
     
+    janitor_task.cancel()
+    
     # Shutdown
     logger.info("🔄 Application shutting down...")
     db_manager.close_connections()
+    agent_graph_factory.reset()
+    await openai_http.aclose()
+    tracer.shutdown()
     logger.info("✅ Application shutdown complete")
 
 app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
@@ -55,6 +94,85 @@ app.add_middleware(
 # Include routers
 app.include_router(chat.router, prefix=settings.API_V1_STR)
 
+# Include prefix per router route: a matched route's path only carries its own router's prefix
+route_prefixes = {id(route): settings.API_V1_STR for route in chat.router.routes}
+
+
+def route_template(scope: dict) -> str:
+    """Matched route's path template, e.g. /api/v1/chat/audio/{filename},
+    so metric labels stay bounded. Only known once routing has run.
+    """
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    return scope.get("root_path", "") + route_prefixes.get(id(route), "") + route.path
+
+
+class RequestTracingMiddleware:
+    """Root span, latency histogram and error counter per endpoint, plus the in-flight gauge.
+
+    Plain ASGI so streaming responses (SSE, audio) count until their last body
+    chunk, and the request is finished even when the body is never sent
+    (client gone, or the server cancelled before streaming started).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        start = time.perf_counter()
+        span = tracer.start_span("http.request", method=method)
+        token = tracer.activate(span)
+        http_requests_in_flight.inc(method=method)
+        state = {"status": 500, "finished": False}
+
+        def finish(error: BaseException = None):
+            if state["finished"]:
+                return
+            state["finished"] = True
+            status = state["status"]
+            route = route_template(scope)
+            if error is not None:
+                span.record_error(error)
+            span.set_attributes(route=route, status=status)
+            span.end()
+            http_requests_in_flight.dec(method=method)
+            http_request_duration.observe(time.perf_counter() - start, method=method, route=route, status=status)
+            if status >= 500 or error is not None:
+                http_request_errors.inc(route=route)
+
+        async def send_and_track(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        error = None
+        try:
+            await self.app(scope, receive, send_and_track)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            finish(error)
+            tracer.deactivate(token)
+
+
+app.add_middleware(RequestTracingMiddleware)
+
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def metrics():
+        """Prometheus text exposition of request, node and external call metrics"""
+        return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 def root():
     logger.info("Root endpoint called")
@@ -86,6 +204,24 @@ def pool_debug():
         "connection_test": db_manager.test_connection()
     }
 
+@app.get("/debug/cache")
+def cache_debug():
+    """Debug endpoint to check cache statistics"""
+    return {
+        "schema_cache": schema_cache.get_stats(),
+        "answer_cache": answer_cache.get_stats(),
+        "sql_plan_cache": sql_plan_cache.get_stats(),
+        "sql_guard": sql_guard.get_stats(),
+        "query_log": query_log.get_stats(),
+        "patient_snapshots": patient_snapshots.get_stats(),
+        "openai_http": openai_http.get_stats(),
+        "prompt_tokens": prompt_stats.get_stats(),
+        "token_usage": token_usage_stats.get_stats(),
+        "tracing": tracer.get_stats(),
+        "audio_jobs": audio_jobs.get_stats(),
+        "tts_cache": tts_cache.get_stats()
+    }
+
 # For Cloud Run
 if __name__ == "__main__":
     import uvicorn
@@ -14,4 +14,6 @@ class ChatResponse(BaseModel):
     message: str
     formatted_response: Optional[Dict[str, Any]] = None
     audio_url: Optional[str] = None 
-    patient_id: Optional[str] = None
\ No newline at end of file
+    patient_id: Optional[str] = None
+    # Per-node LLM token usage and cost, when TOKEN_USAGE_IN_RESPONSE is on
+    debug: Optional[Dict[str, Any]] = None
\ No newline at end of file
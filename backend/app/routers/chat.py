@@ -1,81 +1,102 @@
 # backend/app/routers/chat.py - Cleaned up version
-from fastapi import APIRouter, HTTPException, BackgroundTasks, UploadFile, File
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Header, Request
+import io
 import time
 import os
 import asyncio
-import boto3
 # from google import genai
-from openai import OpenAI
+from openai import AsyncOpenAI
 from app.core.config import settings
 from app.models.chat import ChatRequest, ChatResponse
 from app.services.database_agent import DatabaseAgent
-from app.services.llm_utilities import synthesize_speech, save_audio_file, transcribe_audio
-from fastapi.responses import FileResponse
+from app.services.answer_cache import answer_cache
+from app.services.audio_jobs import audio_jobs
+from app.services.llm_utilities import atranscribe_audio
+from app.services.http_clients import openai_http
+from app.services.token_usage import TokenBudgetExceeded
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
 # from google.genai import types
 import re
 import json
+from typing import Optional
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
 # Initialize clients
 # genai_client = genai.Client(api_key=settings.GOOGLE_API_KEY)
-openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
-
-polly_client = boto3.client(
-    'polly',
-    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-    region_name=settings.AWS_REGION
-)
-
-
-# Audio utility functions
-async def wait_for_file(file_path, max_wait=5.0, check_interval=0.1):
-    """Wait for file to exist and be fully written"""
-    waited = 0
-    while waited < max_wait:
-        if os.path.exists(file_path):
-            try:
-                size = os.path.getsize(file_path)
-                if size > 0:
-                    # Wait a bit more to ensure write is complete
-                    await asyncio.sleep(0.2)
-                    # Check size again to make sure it's stable
-                    new_size = os.path.getsize(file_path)
-                    if new_size == size:
-                        return True
-            except OSError:
-                pass  # File might still be being written
-        await asyncio.sleep(check_interval)
-        waited += check_interval
-    return False
-
-async def generate_audio_response_sync(text: str, output_path: str):
-    """Generate audio synchronously and wait for completion"""
+_openai_client: Optional[AsyncOpenAI] = None
+_openai_http_client = None
+
+
+def openai_client() -> AsyncOpenAI:
+    """AsyncOpenAI client on the pool's current async client
+
+    Looked up per call: the pool hands out a fresh client once shutdown has
+    closed the old one, and a client captured at import would keep the closed one.
+    """
+    global _openai_client, _openai_http_client
+    http_client = openai_http.get_async_client()
+    if _openai_client is None or _openai_http_client is not http_client:
+        _openai_http_client = http_client
+        _openai_client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            max_retries=settings.OPENAI_MAX_RETRIES,
+            http_client=http_client,
+        )
+    return _openai_client
+
+# Room for the multipart boundary and part headers around the audio
+MULTIPART_OVERHEAD_BYTES = 16 * 1024
+
+# Per-worker cap on agent runs in flight; extra requests wait for a free slot
+agent_slots = asyncio.Semaphore(settings.AGENT_MAX_CONCURRENCY)
+
+
+def parse_formatted_response(text_response, html_response):
+    """Structured response from the agent's JSON, or a plain text fallback"""
     try:
-        print(f"Generating audio for text of length {len(text)}")
-        
-        # Generate audio synchronously
-        synthesized_audio = synthesize_speech(polly_client, text)
-        if synthesized_audio:
-            # Save the file
-            save_audio_file(synthesized_audio, output_path)
-            
-            # Wait for file to be fully written
-            if await wait_for_file(output_path):
-                print(f"Audio saved successfully to {output_path}")
-                return True
-            else:
-                print(f"Failed to confirm audio file creation: {output_path}")
-                return False
-        else:
-            print("Failed to synthesize speech - no audio data returned")
-            return False
-    except Exception as e:
-        print(f"Error generating audio: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return False
+        formatted_response = json.loads(text_response)
+        print(f"✅ Parsed JSON response: {formatted_response.get('type')}")
+    except (json.JSONDecodeError, TypeError):
+        print("❌ Not JSON, creating fallback text response")
+        formatted_response = {
+            "type": "text", 
+            "content": text_response,
+            "html": html_response
+        }
+    return formatted_response
+
+def build_debug(database_agent: Optional[DatabaseAgent]) -> Optional[dict]:
+    """debug field of ChatResponse: the request's token usage (None for cached answers)"""
+    if not settings.TOKEN_USAGE_IN_RESPONSE:
+        return None
+    return {"token_usage": database_agent.token_usage.to_dict() if database_agent else None}
+
+def audio_response(audio: bytes, range_header: Optional[str]) -> Response:
+    """Serve in-memory audio, honouring a single "Range: bytes=start-end" so players can seek"""
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": "private, max-age=3600"}
+    total = len(audio)
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (range_header or "").strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return Response(audio, media_type="audio/mp3", headers=headers)
+
+    if match.group(1):
+        start = int(match.group(1))
+        end = min(int(match.group(2)), total - 1) if match.group(2) else total - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(total - int(match.group(2)), 0)
+        end = total - 1
+    if start >= total or start > end:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{total}"})
+    headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+    return Response(audio[start:end + 1], status_code=206, media_type="audio/mp3", headers=headers)
+
+def sse_event(event: str, data: dict) -> str:
+    """One Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
 
 def prepare_text_for_audio(formatted_response, text_response, response_length):
     """Prepare appropriate text for audio generation"""
@@ -106,77 +127,72 @@ async def send_message(request: ChatRequest, background_tasks: BackgroundTasks):
     
     start_time = time.time()
     print(f"🕐 REQUEST START: {request.message[:50]}...")
+    try:
+        await asyncio.wait_for(agent_slots.acquire(), timeout=settings.AGENT_QUEUE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        print(f"🚦 No agent slot free after {settings.AGENT_QUEUE_TIMEOUT_SECONDS}s, rejecting request")
+        raise HTTPException(status_code=503, detail="Server is busy, please try again shortly")
+    print(f"🚦 Agent slot acquired in {(time.time() - start_time)*1000:.0f}ms")
     try:
         # Step 1: Setup
         setup_start = time.time()
         # patient_id = settings.DEFAULT_PATIENT_ID
         print(f"⚡ Setup completed in {(time.time() - setup_start)*1000:.0f}ms")
         
-        # Step 2: Database Agent Call
+        # Step 2: Database Agent Call (answer cache first)
         agent_start = time.time()
-        print("🔍 Starting DatabaseAgent...")
-        # database_agent = DatabaseAgent(patient_id, settings.GOOGLE_API_KEY, request.message)
-        database_agent = DatabaseAgent(patient_id, settings.OPENAI_API_KEY, request.message)
-        
-        # Get response from database agent
-        text_response, html_response = database_agent.create_agent()
+        cached_answer = (
+            await asyncio.to_thread(answer_cache.get, patient_id, request.message)
+            if settings.ANSWER_CACHE_ENABLED else None
+        )
+        database_agent = None
+        if cached_answer:
+            text_response, html_response = cached_answer
+            print(f"⚡ Answer cache hit in {(time.time() - agent_start)*1000:.0f}ms")
+        else:
+            print("🔍 Starting DatabaseAgent...")
+            # database_agent = DatabaseAgent(patient_id, settings.GOOGLE_API_KEY, request.message)
+            database_agent = DatabaseAgent(patient_id, settings.OPENAI_API_KEY, request.message)
+            
+            # Get response from database agent
+            text_response, html_response = await database_agent.acreate_agent()
+            if settings.ANSWER_CACHE_ENABLED:
+                await asyncio.to_thread(answer_cache.put, patient_id, request.message, text_response, html_response)
         agent_duration = time.time() - agent_start
         print(f"🏃 DatabaseAgent completed in {agent_duration:.2f}s")
+        if database_agent:
+            usage = database_agent.token_usage
+            print(f"🧾 LLM tokens: {usage.prompt_tokens} prompt + {usage.completion_tokens} completion")
         
         # Step 3: Response Processing
         processing_start = time.time()
         response_length = len(text_response) if text_response else 0
 
         # Parse the JSON response directly from database agent
-        try:
-            formatted_response = json.loads(text_response)
-            print(f"✅ Parsed JSON response: {formatted_response.get('type')}")
-        except json.JSONDecodeError:
-            print("❌ Not JSON, creating fallback text response")
-            formatted_response = {
-                "type": "text", 
-                "content": text_response,
-                "html": html_response
-            }
+        formatted_response = parse_formatted_response(text_response, html_response)
 
         processing_duration = time.time() - processing_start
         print(f"🛠️ Response processing completed in {processing_duration:.2f}s")
 
-        # Generate unique ID for audio file
-        session_id = str(int(time.time() * 1000000))
-        audio_filename = f"temp_audio_output_{session_id}.mp3"
-        os.makedirs("audio", exist_ok=True)
-        audio_path = f"audio/{audio_filename}"
-        print(f"Audio path: {audio_path}")
-        
         # Prepare text for audio
         text_for_audio = prepare_text_for_audio(formatted_response, text_response, response_length)
         
-        # Step 4: Audio Generation
+        # Step 4: Audio is a deferred job; the URL is valid right away and
+        # GET /audio/{filename} waits for (or starts) synthesis
         audio_start = time.time()
-        audio_success = await generate_audio_response_sync(text_for_audio, audio_path)
-        audio_duration = time.time() - audio_start  
-        
-        # Only provide audio URL if generation was successful
-        audio_url = f"/api/v1/chat/audio/{audio_filename}" if audio_success else None
-
-        # # Step 4: Audio Generation (if enabled)
-        # audio_start = time.time()
-        # audio_url = None  # Skip audio for now to test speed
-        # audio_duration = time.time() - audio_start
-        # print(f"🔊 Audio processing in {audio_duration*1000:.0f}ms (skipped)")
+        audio_filename = audio_jobs.register(text_for_audio)
+        audio_url = f"/api/v1/chat/audio/{audio_filename}"
+        audio_duration = time.time() - audio_start
 
         response = ChatResponse(
             message=text_response,
             formatted_response=formatted_response,
             audio_url=audio_url,
             patient_id=patient_id,
+            debug=build_debug(database_agent),
         )
         
-        if audio_success:
-            print(f"Returning response with audio URL: {audio_url}")
-        else:
-            print("Returning response without audio due to generation failure")
+        print(f"Returning response with audio URL: {audio_url}")
 
         total_duration = time.time() - start_time
         print(f"🏁 TOTAL REQUEST TIME: {total_duration:.2f}s")
@@ -185,65 +201,226 @@ async def send_message(request: ChatRequest, background_tasks: BackgroundTasks):
             
         return response
     
+    except TokenBudgetExceeded as e:
+        print(f"🧾 {e}")
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         print(f"Error in send_message: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        agent_slots.release()
+
+@router.post("/stream")
+async def stream_message(request: ChatRequest):
+    """Same pipeline as /send, streamed as Server-Sent Events.
+
+    Events: progress (one per graph node), route, query, rejected (the SQL guard
+    refused the query), rows (the table, as soon as the query returns),
+    summary_token, final (the full ChatResponse) and error (including a busy
+    server, since the agent slot is only taken once streaming has started).
+    """
+    patient_id = request.patient_id or settings.DEFAULT_PATIENT_ID
+    start_time = time.time()
+    print(f"🌊 STREAM START for Patient ID {patient_id}: {request.message[:50]}...")
+
+    async def event_stream():
+        first_byte_logged = False
+        # The slot is taken once the body is being sent: a response whose body is
+        # never iterated (client gone first) would otherwise never release it
+        try:
+            await asyncio.wait_for(agent_slots.acquire(), timeout=settings.AGENT_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            print(f"🚦 No agent slot free after {settings.AGENT_QUEUE_TIMEOUT_SECONDS}s, rejecting stream")
+            yield sse_event("error", {"detail": "Server is busy, please try again shortly", "status": 503})
+            return
+        try:
+            cached_answer = (
+                await asyncio.to_thread(answer_cache.get, patient_id, request.message)
+                if settings.ANSWER_CACHE_ENABLED else None
+            )
+            database_agent = None
+            if cached_answer:
+                text_response, html_response = cached_answer
+                yield sse_event("progress", {"node": "answer_cache", "label": "Cached answer", "elapsed_ms": 0})
+            else:
+                text_response, html_response = None, None
+                database_agent = DatabaseAgent(patient_id, settings.OPENAI_API_KEY, request.message)
+                async for event in database_agent.astream_events():
+                    name = event.pop("event")
+                    if name == "result":
+                        text_response, html_response = event["text_response"], event["html_response"]
+                        continue
+                    if name == "rows" and not first_byte_logged:
+                        print(f"⚡ Rows streamed after {time.time() - start_time:.2f}s")
+                        first_byte_logged = True
+                    yield sse_event(name, event)
+                if settings.ANSWER_CACHE_ENABLED:
+                    await asyncio.to_thread(answer_cache.put, patient_id, request.message, text_response, html_response)
+
+            formatted_response = parse_formatted_response(text_response, html_response)
+            text_for_audio = prepare_text_for_audio(formatted_response, text_response, len(text_response or ""))
+            response = ChatResponse(
+                message=text_response,
+                formatted_response=formatted_response,
+                audio_url=f"/api/v1/chat/audio/{audio_jobs.register(text_for_audio)}",
+                patient_id=patient_id,
+                debug=build_debug(database_agent),
+            )
+            yield sse_event("final", response.model_dump())
+            print(f"🏁 STREAM TEXT COMPLETE in {time.time() - start_time:.2f}s")
+        except Exception as e:
+            print(f"Error in stream_message: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            yield sse_event("error", {"detail": str(e)})
+        finally:
+            agent_slots.release()
+            print(f"🏁 STREAM TOTAL TIME: {time.time() - start_time:.2f}s")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # Remove the greeting detection functions - no longer needed
 
 @router.get("/audio/{filename}")
-async def get_audio(filename: str):
-    audio_path = f"audio/{filename}"
+async def get_audio(filename: str, range_header: Optional[str] = Header(default=None, alias="range")):
+    if audio_jobs.has_job(filename):
+        # Deferred audio: wait for background synthesis, or start it now; served from memory
+        wait_start = time.time()
+        audio = await audio_jobs.get_audio(filename)
+        print(f"🔊 Audio for {filename} ready after {(time.time() - wait_start)*1000:.0f}ms wait")
+        if audio is None:
+            raise HTTPException(status_code=503, detail="Audio could not be generated")
+        return audio_response(audio, range_header)
+    
+    audio_path = os.path.join(settings.AUDIO_DIR, os.path.basename(filename))
     print(f"Looking for audio file at {audio_path}")
     
     if not os.path.exists(audio_path):
         print(f"File not found: {audio_path}")
         # List available files in the directory for debugging
-        if os.path.exists("audio"):
-            files = os.listdir("audio")
+        if os.path.exists(settings.AUDIO_DIR):
+            files = os.listdir(settings.AUDIO_DIR)
             print(f"Available files in audio directory: {files}")
         raise HTTPException(status_code=404, detail="Audio file not found")
     
     print(f"Returning audio file: {audio_path}")
     return FileResponse(audio_path, media_type="audio/mp3")
 
+def upload_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Audio upload exceeds {settings.TRANSCRIBE_MAX_UPLOAD_BYTES} bytes"
+    )
+
+async def read_audio_upload(request: Request) -> dict:
+    """Read the multipart "file" part chunk by chunk into memory.
+
+    Returns {"filename", "content_type", "audio"} with audio as a BytesIO.
+    Nothing is spooled to disk, and the upload is refused with 413 as soon
+    as the bytes received pass the limit, with or without a Content-Length.
+    """
+    mime_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if mime_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=422, detail='Expected an audio upload in the "file" field')
+
+    upload = {"filename": None, "content_type": None, "audio": None}
+    part = {"headers": {}, "field": b"", "value": b"", "is_file": False}
+
+    def on_part_begin():
+        part.update(headers={}, field=b"", value=b"", is_file=False)
+
+    def on_header_field(data: bytes, start: int, end: int):
+        part["field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"] = part["value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        # Only the first "file" part is read; anything else is skipped
+        if disposition.get(b"name") == b"file" and upload["audio"] is None:
+            part["is_file"] = True
+            upload["audio"] = io.BytesIO()
+            upload["filename"] = disposition.get(b"filename", b"").decode("utf-8", "replace") or None
+            upload["content_type"] = part["headers"].get(b"content-type", b"").decode("latin-1") or None
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if part["is_file"]:
+            upload["audio"].write(data[start:end])
+            if upload["audio"].tell() > settings.TRANSCRIBE_MAX_UPLOAD_BYTES:
+                raise upload_too_large()
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+    received = 0
+    try:
+        async for chunk in request.stream():
+            # Other fields and part headers count too, so the body as a whole stays bounded
+            received += len(chunk)
+            if received > settings.TRANSCRIBE_MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES:
+                raise upload_too_large()
+            parser.write(chunk)
+        parser.finalize()
+    except MultipartParseError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid multipart upload: {e}")
+
+    if upload["audio"] is None:
+        raise HTTPException(status_code=422, detail='Expected an audio upload in the "file" field')
+    upload["audio"].seek(0)
+    return upload
+
 @router.post("/transcribe", response_model=dict)
-async def transcribe_voice(file: UploadFile = File(...)):
+async def transcribe_voice(request: Request):
+    """Transcribe the multipart "file" upload with Whisper.
+
+    The body is read here instead of through a File() parameter, so an
+    oversized upload is refused from its Content-Length, or else mid-stream,
+    and the audio never goes to a temp file.
+    """
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > settings.TRANSCRIBE_MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES:
+        raise upload_too_large()
+
     try:
-        print(f"Received audio file: {file.filename}")
-        
-        # Generate a unique filename
-        session_id = str(int(time.time() * 1000000))
-        temp_audio_path = f"audio/temp_audio_input_{session_id}.wav"
-        
-        # Ensure audio directory exists
-        os.makedirs("audio", exist_ok=True)
-        
-        # Save the uploaded file
-        with open(temp_audio_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # Transcribe using Gemini
-        print(f"Transcribing audio file at: {temp_audio_path}")
-        transcript = transcribe_audio(
-            openai_client=openai_client,
-            # gemini_client=genai_client,
-            audio_path=temp_audio_path,
-            # mime_type="audio/wav"
+        upload = await read_audio_upload(request)
+        audio = upload["audio"]
+        size = audio.getbuffer().nbytes
+        print(f"Received audio file: {upload['filename']}")
+
+        transcribe_start = time.time()
+        print(f"Transcribing {size} bytes")
+        transcript = await atranscribe_audio(
+            # Audio uploads take longer than chat calls
+            openai_client().with_options(timeout=settings.OPENAI_TRANSCRIBE_TIMEOUT_SECONDS),
+            audio,
+            filename=os.path.basename(upload["filename"] or "audio.wav"),
+            content_type=upload["content_type"] or "audio/wav",
         )
-        print(f"Transcription result: {transcript}")
-        
-        # Clean up temporary file
-        if os.path.exists(temp_audio_path):
-            os.remove(temp_audio_path)
+        print(f"Transcription result ({(time.time() - transcribe_start)*1000:.0f}ms): {transcript}")
         
         return {"transcript": transcript}
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error transcribing audio: {str(e)}")
         import traceback
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,246 @@
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.database import get_patient_data_version
+
+# Phrases rewritten to a canonical form before lookup (checked longest first)
+SYNONYMS = {
+    "most recent": "latest",
+    "last": "latest",
+    "newest": "latest",
+    "recent": "latest",
+    "meds": "medications",
+    "medication": "medications",
+    "medicines": "medications",
+    "drugs": "medications",
+    "labs": "lab results",
+    "lab result": "lab results",
+    "tests": "lab results",
+    "tx": "treatment",
+    "treatments": "treatment",
+    "hx": "history",
+    "path": "pathology",
+    "pathology reports": "pathology results",
+    "pathology report": "pathology results",
+    "pathology result": "pathology results",
+    "display": "show",
+    "list": "show",
+    "get": "show",
+    "give": "show",
+    "fetch": "show",
+    "what are": "show",
+    "what is": "show",
+    "details": "info",
+    "information": "info",
+}
+# Filler words that don't change what is being asked
+STOPWORDS = {
+    "a", "an", "the", "me", "my", "please", "pls", "for", "of", "this", "that", "patient", "patients",
+    "patient's", "can", "could", "would", "you", "i", "want", "to", "see", "all", "any", "us", "is", "are",
+}
+SYNONYM_PATTERN = re.compile(
+    r"\b(" + "|".join(re.escape(k) for k in sorted(SYNONYMS, key=len, reverse=True)) + r")\b"
+)
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s']")
+
+# Only complete data answers are worth caching
+CACHEABLE_TYPES = ("table_data", "no_data")
+
+
+def normalize_question(question: str) -> str:
+    """Canonical form of a question: case, punctuation, whitespace, synonyms and filler words"""
+    text = PUNCTUATION_PATTERN.sub(" ", question.lower())
+    text = " ".join(text.split())
+    # Second pass catches chains such as "path reports" -> "pathology reports" -> "pathology results"
+    for _ in range(2):
+        text = SYNONYM_PATTERN.sub(lambda match: SYNONYMS[match.group(1)], text)
+    return " ".join(word for word in text.split() if word not in STOPWORDS)
+
+
+def cosine_similarity(a: Counter, b: Counter) -> float:
+    """Cosine similarity of two bag-of-words vectors"""
+    dot = sum(count * b[word] for word, count in a.items())
+    norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+    return dot / norm if norm else 0.0
+
+
+def parse_patient_ttls(raw: str) -> Dict[str, int]:
+    """Parse "143:300,245:60" into {"143": 300, "245": 60}"""
+    ttls = {}
+    for item in raw.split(","):
+        if ":" in item:
+            patient_id, ttl = item.split(":", 1)
+            ttls[patient_id.strip()] = int(ttl)
+    return ttls
+
+
+class AnswerCache:
+    """LRU cache of agent answers keyed by patient and normalized question.
+
+    Each entry remembers the patient's data version (see get_patient_data_version)
+    at the time it was stored. The version is re-checked at most every
+    ANSWER_CACHE_VERSION_CHECK_SECONDS per patient and all of the patient's
+    entries are dropped when it moves.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, patient_ttls: Dict[str, int],
+                 version_check_seconds: int, similarity_threshold: float):
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._patient_ttls = patient_ttls
+        self._version_check_seconds = version_check_seconds
+        self._similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], dict]" = OrderedDict()
+        self._patient_versions: Dict[str, Tuple[str, float]] = {}
+        self._hits = 0
+        self._similar_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def ttl_for(self, patient_id: str) -> int:
+        """TTL for a patient's entries; per-patient override or the default"""
+        return self._patient_ttls.get(str(patient_id), self._ttl_seconds)
+
+    def _current_version(self, patient_id: str) -> Optional[str]:
+        """Patient data version, re-queried at most every version_check_seconds.
+
+        Call without the lock held: the version query runs outside it so cache
+        lookups never wait on a database round trip.
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._patient_versions.get(patient_id)
+        if cached and now - cached[1] < self._version_check_seconds:
+            return cached[0]
+        try:
+            version = get_patient_data_version(patient_id)
+        except Exception as e:
+            print(f"⚠️ Could not compute data version for patient {patient_id}: {e}")
+            return None
+        with self._lock:
+            latest = self._patient_versions.get(patient_id)
+            # A concurrent refresh that started later wins
+            if latest and latest[1] > now:
+                return latest[0]
+            if latest and latest[0] != version:
+                print(f"🔄 Data changed for patient {patient_id}, invalidating cached answers")
+                self._drop_patient(patient_id)
+            self._patient_versions[patient_id] = (version, now)
+        return version
+
+    def _drop_patient(self, patient_id: str):
+        for key in [key for key in self._entries if key[0] == patient_id]:
+            del self._entries[key]
+            self._invalidations += 1
+
+    def _find_similar(self, patient_id: str, normalized: str) -> Optional[Tuple[str, str]]:
+        """Closest cached question for the patient above the similarity threshold"""
+        if self._similarity_threshold <= 0:
+            return None
+        vector = Counter(normalized.split())
+        best_key, best_score = None, self._similarity_threshold
+        for key in self._entries:
+            if key[0] != patient_id:
+                continue
+            score = cosine_similarity(vector, Counter(key[1].split()))
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def get(self, patient_id: str, question: str) -> Optional[Tuple[str, Optional[str]]]:
+        """Cached (text_response, html_response) or None"""
+        patient_id = str(patient_id)
+        normalized = normalize_question(question)
+        version = self._current_version(patient_id)
+        with self._lock:
+            key = (patient_id, normalized)
+            similar = False
+            if key not in self._entries:
+                key = self._find_similar(patient_id, normalized)
+                similar = key is not None
+            entry = self._entries.get(key) if key else None
+            if entry is None:
+                self._misses += 1
+                return None
+            if time.time() - entry["stored_at"] > self.ttl_for(patient_id) or entry["version"] != version:
+                del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            if similar:
+                self._similar_hits += 1
+            return entry["text_response"], entry["html_response"]
+
+    def put(self, patient_id: str, question: str, text_response: str, html_response: Optional[str]) -> bool:
+        """Store an answer if it is a complete data answer; returns whether it was cached"""
+        try:
+            parsed = json.loads(text_response)
+            response_type = parsed.get("type")
+        except (TypeError, ValueError, AttributeError):
+            return False
+        # Failed queries come back as no_data with an error; never cache those
+        if response_type not in CACHEABLE_TYPES or "error" in parsed:
+            return False
+
+        patient_id = str(patient_id)
+        key = (patient_id, normalize_question(question))
+        version = self._current_version(patient_id)
+        if version is None:
+            return False
+        with self._lock:
+            self._entries[key] = {
+                "text_response": text_response,
+                "html_response": html_response,
+                "version": version,
+                "stored_at": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        return True
+
+    def invalidate_patient(self, patient_id: str):
+        """Drop all cached answers for a patient"""
+        with self._lock:
+            self._drop_patient(str(patient_id))
+            self._patient_versions.pop(str(patient_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._patient_versions.clear()
+
+    def get_stats(self) -> dict:
+        """Get cache hit/miss statistics"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self._max_entries,
+                "hits": self._hits,
+                "similar_hits": self._similar_hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+            }
+
+
+# Global answer cache instance
+answer_cache = AnswerCache(
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+    patient_ttls=parse_patient_ttls(settings.ANSWER_CACHE_PATIENT_TTLS),
+    version_check_seconds=settings.ANSWER_CACHE_VERSION_CHECK_SECONDS,
+    similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+)
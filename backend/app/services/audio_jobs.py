@@ -0,0 +1,214 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import boto3
+from botocore.config import Config
+
+from app.core.config import settings
+from app.services.llm_utilities import synthesize_speech
+from app.services.tts_cache import tts_cache
+
+polly_client = boto3.client(
+    'polly',
+    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+    region_name=settings.AWS_REGION,
+    # Keep-alive pool sized for concurrent synthesis, with bounded timeouts and retries
+    config=Config(
+        max_pool_connections=settings.POLLY_MAX_CONNECTIONS,
+        tcp_keepalive=True,
+        connect_timeout=settings.POLLY_TIMEOUT_SECONDS,
+        read_timeout=settings.POLLY_TIMEOUT_SECONDS,
+        retries={"max_attempts": settings.POLLY_MAX_ATTEMPTS, "mode": "standard"},
+    ),
+)
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+
+class AudioJobManager:
+    """Deferred text-to-speech jobs.
+
+    A chat answer registers its audio text and gets a URL back immediately.
+    Synthesis either starts in the background right away (eager mode) or only
+    when the audio is first requested; concurrent requests for the same audio
+    share one Polly call. Audio is kept in memory (no temp files), bounded by
+    max_bytes with the oldest finished jobs dropped first.
+    """
+
+    def __init__(self, polly, eager: bool, ttl_seconds: int, timeout_seconds: float, max_bytes: int):
+        self._polly = polly
+        self._eager = eager
+        self._ttl_seconds = ttl_seconds
+        self._timeout_seconds = timeout_seconds
+        self._max_bytes = max_bytes
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self._audio_bytes = 0
+        self._synthesized = 0
+        self._failures = 0
+        self._never_requested = 0
+        self._evicted = 0
+
+    def register(self, text: str) -> str:
+        """Register audio for an answer and return its filename"""
+        self._purge_expired()
+        audio_id = uuid.uuid4().hex
+        filename = f"{audio_id}.mp3"
+        job = {
+            "text": text,
+            "audio": None,
+            "status": STATUS_PENDING,
+            "task": None,
+            "requested": False,
+            "created_at": time.time(),
+        }
+        self._jobs[filename] = job
+        if self._eager:
+            self._start(job)
+        return filename
+
+    def has_job(self, filename: str) -> bool:
+        return filename in self._jobs
+
+    async def get_audio(self, filename: str) -> Optional[bytes]:
+        """Synthesized audio bytes, starting or waiting for synthesis as needed"""
+        job = self._jobs.get(filename)
+        if job is None:
+            return None
+        job["requested"] = True
+        if job["status"] in (STATUS_PENDING, STATUS_FAILED):
+            # Lazy mode, or a retry after a failed eager attempt
+            self._start(job)
+        try:
+            # Shielded so a client disconnect doesn't cancel synthesis shared with other requests
+            await asyncio.wait_for(asyncio.shield(job["task"]), timeout=self._timeout_seconds)
+        except asyncio.TimeoutError:
+            print(f"⏰ Audio synthesis for {filename} still running after {self._timeout_seconds}s")
+            return None
+        return job["audio"] if job["status"] == STATUS_READY else None
+
+    def _start(self, job: dict):
+        job["status"] = STATUS_RUNNING
+        job["task"] = asyncio.create_task(self._synthesize(job))
+
+    async def _synthesize(self, job: dict):
+        start = time.time()
+        try:
+            # boto3 blocks, so run it in a worker thread
+            synthesize = tts_cache.synthesize if settings.TTS_CACHE_ENABLED else synthesize_speech
+            audio = await asyncio.to_thread(synthesize, self._polly, job["text"])
+            if not audio:
+                raise RuntimeError("no audio data returned")
+            job["audio"] = audio
+            job["status"] = STATUS_READY
+            self._audio_bytes += len(audio)
+            self._synthesized += 1
+            print(f"🔊 Audio synthesized in {(time.time() - start)*1000:.0f}ms ({len(audio)} bytes)")
+            self._enforce_budget()
+        except Exception as e:
+            job["status"] = STATUS_FAILED
+            self._failures += 1
+            print(f"❌ Audio synthesis failed: {e}")
+
+    def _drop(self, filename: str):
+        job = self._jobs.pop(filename)
+        if job["audio"] is not None:
+            self._audio_bytes -= len(job["audio"])
+        if not job["requested"]:
+            self._never_requested += 1
+
+    def _purge_expired(self):
+        """Forget jobs older than the TTL"""
+        cutoff = time.time() - self._ttl_seconds
+        for filename in [name for name, job in self._jobs.items() if job["created_at"] < cutoff]:
+            if self._jobs[filename]["status"] != STATUS_RUNNING:
+                self._drop(filename)
+
+    def _enforce_budget(self):
+        """Drop the oldest finished jobs until held audio fits in max_bytes"""
+        for filename in list(self._jobs):
+            if self._audio_bytes <= self._max_bytes:
+                break
+            if self._jobs[filename]["status"] != STATUS_RUNNING:
+                self._drop(filename)
+                self._evicted += 1
+
+    def get_stats(self) -> dict:
+        """Get audio job statistics"""
+        statuses = [job["status"] for job in self._jobs.values()]
+        return {
+            "jobs": len(self._jobs),
+            "eager": self._eager,
+            "audio_bytes": self._audio_bytes,
+            "max_bytes": self._max_bytes,
+            "pending": statuses.count(STATUS_PENDING),
+            "running": statuses.count(STATUS_RUNNING),
+            "ready": statuses.count(STATUS_READY),
+            "failed": statuses.count(STATUS_FAILED),
+            "synthesized": self._synthesized,
+            "failures": self._failures,
+            "expired_unplayed": self._never_requested,
+            "evicted": self._evicted,
+        }
+
+
+def sweep_audio_dir(audio_dir: str, max_age_seconds: int, max_bytes: int) -> dict:
+    """Delete audio files older than max_age_seconds, then the oldest until under max_bytes.
+
+    Only top-level files are swept; subdirectories such as the TTS cache
+    manage their own size.
+    """
+    if not os.path.isdir(audio_dir):
+        return {"deleted": 0, "freed_bytes": 0, "remaining_bytes": 0}
+    now = time.time()
+    files = []
+    for entry in os.scandir(audio_dir):
+        if entry.is_file():
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.path, stat.st_size))
+    files.sort()
+
+    deleted, freed = 0, 0
+    total = sum(size for _, _, size in files)
+    for mtime, path, size in files:
+        if now - mtime <= max_age_seconds and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        deleted += 1
+        freed += size
+        total -= size
+    return {"deleted": deleted, "freed_bytes": freed, "remaining_bytes": total}
+
+
+async def run_audio_janitor():
+    """Background loop that keeps the audio directory bounded"""
+    while True:
+        try:
+            result = await asyncio.to_thread(
+                sweep_audio_dir, settings.AUDIO_DIR, settings.AUDIO_FILE_MAX_AGE_SECONDS, settings.AUDIO_DIR_MAX_BYTES
+            )
+            if result["deleted"]:
+                print(f"🧹 Audio janitor removed {result['deleted']} files ({result['freed_bytes']} bytes)")
+        except Exception as e:
+            print(f"⚠️ Audio janitor error: {e}")
+        await asyncio.sleep(settings.AUDIO_JANITOR_INTERVAL_SECONDS)
+
+
+# Global audio job manager instance
+audio_jobs = AudioJobManager(
+    polly_client,
+    eager=settings.AUDIO_EAGER_SYNTHESIS,
+    ttl_seconds=settings.AUDIO_JOB_TTL_SECONDS,
+    timeout_seconds=settings.AUDIO_SYNTHESIS_TIMEOUT_SECONDS,
+    max_bytes=settings.AUDIO_JOB_MAX_BYTES,
+)
@@ -1,684 +1,995 @@
-from typing import Literal, Dict, List
+from typing import Literal, Dict, List, Optional
 from langchain_openai import ChatOpenAI
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, ToolMessage
+from langgraph.config import get_config, get_stream_writer
 from langgraph.graph import END, START, MessagesState, StateGraph
-from langgraph.prebuilt import ToolNode
+from langgraph.graph.state import CompiledStateGraph
 import re
 import json
-import pandas as pd
-from tabulate import tabulate
-from datetime import datetime, date
-import ast
 import time
+import asyncio
+import threading
 from app.core.config import settings
-from app.core.database import db_manager
-
-class DatabaseAgent:
-    def __init__(self, patient_id, openai_key, question):
-        self.patient_id = patient_id
-        self.openai_key = openai_key
-        self.question = question
-
-    def get_database(self):
-        """Get shared database connection from pool"""
-        db_start = time.time()
-        db = db_manager.get_database()
-        db_duration = time.time() - db_start
-        print(f"🗄️ Database retrieved from pool in {db_duration*1000:.0f}ms")
-        return db
-
-    def create_agent(self):
-        agent_start = time.time()
-        print(f"🤖 DatabaseAgent: Starting initialization...")
-
-        # Step 1: LLM Setup
-        llm_start = time.time()
-        # call gemini model
-        # llm = ChatGoogleGenerativeAI(model='gemini-2.5-flash',
-        #                             verbose=False,  # Disable verbose
-        #                             temperature=0.2,  # Lower = faster
-        #                             # max_tokens=1000,  # Limit output
-        #                             google_api_key=self.gemini_key)
-        llm = ChatOpenAI(
-            model='gpt-4o',
-            temperature=0.2,  # Lower = faster
-            max_tokens=2000,  # Limit output
-            api_key=self.openai_key
-        )
-        db = self.get_database()
-        print(f"⚡ LLM setup in {(time.time() - llm_start)*1000:.0f}ms")
+from app.core.database import db_manager, schema_cache, PATIENT_TABLE_KEYWORDS
+from app.core.query_result import QueryResult
+from app.services.query_router import query_router
+from app.services.answer_cache import normalize_question
+from app.services.sql_plan_cache import sql_plan_cache, render_query
+from app.services.sql_guard import sql_guard
+from app.services.query_log import query_log
+from app.services.patient_snapshot import patient_snapshots
+from app.services.http_clients import openai_http
+from app.services.tracing import tracer, traced_node
+from app.services.token_usage import TokenLedger
+from app.services.prompt_budget import (
+    token_counter, node_token_budgets, prompt_stats, parse_sample_rows, select_essential_columns,
+    render_compact_schema, fit_schema_to_budget, truncate_to_budget,
+)
+from app.services.result_formatter import (
+    build_dataframe, build_preview, build_no_data_response, build_table_response, build_rows_payload,
+    extract_partial_json_string, parse_llm_json
+)
+
+# Progress labels sent to streaming clients as each graph node finishes
+NODE_LABELS = {
+    "determine_query_type": "Understanding the question",
+    "handle_greeting": "Writing a reply",
+    "list_tables": "Looking up available tables",
+    "call_get_schema": "Choosing relevant tables",
+    "get_schema": "Reading table schemas",
+    "process_schema_response": "Preparing the query",
+    "generate_query": "Generating SQL",
+    "check_query": "Checking SQL",
+    "guard_query": "Checking query safety",
+    "run_query_with_schema": "Running the query",
+    "format_query_results": "Summarizing results",
+}
+
+
+# Enhanced MessagesState to include schema info and the per-request inputs
+class AgentState(MessagesState):
+    patient_id: str
+    question: str
+    selected_tables: List[str] = []
+    table_schemas: Dict = {}
+    essential_columns: Dict = {}
+    executed_query: str = ""
+    query_intent: str = ""
+    route_confidence: float = 0.0
+    sql_plan_key: str = ""
+    sql_plan_hit: bool = False
+    query_result: Optional[QueryResult] = None
+    query_error: str = ""
+    rejection_reason: str = ""
+    estimated_rows: Optional[int] = None
+    read_target: Optional[str] = None
+
+
+def select_relevant_tables(all_tables: List[str], question: str) -> List[str]:
+    """Pick the tables relevant to a question by keyword, falling back to the first table"""
+    question_lower = question.lower()
     
-        # Step 2: Toolkit Setup
-        toolkit_start = time.time()
-        toolkit = SQLDatabaseToolkit(db=db, llm=llm)
-        # Create the agent with the tools
-        tools = toolkit.get_tools()
-        get_schema_tool = next(tool for tool in tools if tool.name == "sql_db_schema")
-        get_schema_node = ToolNode([get_schema_tool], name="get_schema")
-        run_query_tool = next(tool for tool in tools if tool.name == "sql_db_query")
-        run_query_node = ToolNode([run_query_tool], name="run_query")
-        print(f"⚡ Toolkit setup in {(time.time() - toolkit_start)*1000:.0f}ms")
+    selected_tables = []
+    for table in all_tables:
+        table_lower = table.lower()
+        if any(keyword in table_lower for keyword in PATIENT_TABLE_KEYWORDS):
+            selected_tables.append(table)
+            print(f"✅ Selected table: {table} (keyword match)")
+        elif table_lower in question_lower:
+            selected_tables.append(table)
+            print(f"✅ Selected table: {table} (mentioned in question)")
     
+    # Fallback selection
+    if not selected_tables:
+        selected_tables = all_tables[:1] if all_tables else []
+        if selected_tables:
+            print(f"⚠️ Fallback selected: {selected_tables}")
+    
+    return selected_tables
+
+
+LLM_MAX_OUTPUT_TOKENS = 2000
+
+
+def create_llm(openai_key: str) -> ChatOpenAI:
+    """Create the chat model shared by every node of the agent graph"""
+    # call gemini model
+    # llm = ChatGoogleGenerativeAI(model='gemini-2.5-flash',
+    #                             verbose=False,  # Disable verbose
+    #                             temperature=0.2,  # Lower = faster
+    #                             # max_tokens=1000,  # Limit output
+    #                             google_api_key=self.gemini_key)
+    return ChatOpenAI(
+        model=settings.OPENAI_MODEL,
+        temperature=0.2,  # Lower = faster
+        max_tokens=LLM_MAX_OUTPUT_TOKENS,  # Limit output
+        stream_usage=True,  # Usage metadata on streamed replies too, for token accounting
+        api_key=openai_key,
+        timeout=settings.OPENAI_TIMEOUT_SECONDS,
+        max_retries=settings.OPENAI_MAX_RETRIES,
+        # Process-wide keep-alive pool, shared with transcription
+        http_client=openai_http.get_client(),
+        http_async_client=openai_http.get_async_client(),
+    )
+
+
+def current_token_ledger() -> TokenLedger:
+    """Token ledger of the running request (graph config), or a throwaway one outside a request"""
+    try:
+        ledger = get_config().get("configurable", {}).get("token_ledger")
+    except RuntimeError:
+        ledger = None
+    return ledger if ledger is not None else TokenLedger()
+
+
+def budgeted_llm(runnable, node: str, prompt_tokens: int):
+    """(runnable, ledger) with the completion capped to what is left of the request's token ceiling.
+
+    Raises TokenBudgetExceeded when the prompt alone would not fit.
+    """
+    ledger = current_token_ledger()
+    max_tokens = ledger.max_completion_tokens(node, prompt_tokens)
+    if max_tokens is not None and max_tokens < LLM_MAX_OUTPUT_TOKENS:
+        runnable = runnable.bind(max_tokens=max_tokens)
+    return runnable, ledger
+
+
+async def invoke_llm(node: str, runnable, messages: List, prompt_tokens: int):
+    """Invoke the model in an llm.chat span and charge its token usage to the request"""
+    runnable, ledger = budgeted_llm(runnable, node, prompt_tokens)
+    with tracer.span("llm.chat", node=node, model=settings.OPENAI_MODEL) as span:
+        response = await runnable.ainvoke(messages)
+        span.set_attributes(**ledger.record(node, response, prompt_tokens))
+    return response
+
+
+def build_agent_graph(llm, db):
+    """Build and compile the agent graph.
+
+    Nothing request-specific is captured here: patient_id and question are read
+    from the graph state, so the compiled graph can be shared by all requests.
+    """
+    # Toolkit Setup
+    toolkit_start = time.time()
+    toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+    # Create the agent with the tools
+    tools = toolkit.get_tools()
+    run_query_tool = next(tool for tool in tools if tool.name == "sql_db_query")
+    print(f"⚡ Toolkit setup in {(time.time() - toolkit_start)*1000:.0f}ms")
+
+    # Route the query to the appropriate chain
+    async def determine_query_type(state: AgentState):
+        """Determine if the query is about patients or not."""
+        print("🚀 STEP 1: Determining query type")
+        
+        messages = state["messages"]
+        last_message = messages[-1]
+        query = last_message.content
+        
+        print(f"📝 User query: '{query}'")
+        
+        # Local fast path: rules + small model, LLM only when unsure
+        if settings.QUERY_ROUTER_ENABLED:
+            decision = query_router.classify(query)
+            print(f"⚡ Local router: {decision}")
+            if decision["confidence"] >= settings.QUERY_ROUTER_CONFIDENCE:
+                return {
+                    "messages": [AIMessage(decision["route"])],
+                    "query_intent": decision["intent"],
+                    "route_confidence": decision["confidence"],
+                }
+            print("🤔 Low router confidence, falling back to LLM")
+        
+        # Enhanced routing prompt
+        system_route_prompt = """You are a Health Informatics AI routing system. 
 
-        # Enhanced MessagesState to include schema info
-        class EnhancedMessagesState(MessagesState):
-            selected_tables: List[str] = []
-            table_schemas: Dict = {}
-            relevant_columns: Dict = {}
-            executed_query: str = ""
-
-        # Route the query to the appropriate chain
-        def determine_query_type(state: EnhancedMessagesState):
-            """Determine if the query is about patients or not."""
-            print("🚀 STEP 1: Determining query type")
-            
-            messages = state["messages"]
-            last_message = messages[-1]
-            query = last_message.content
-            
-            print(f"📝 User query: '{query}'")
-            
-            # Enhanced routing prompt
-            system_route_prompt = """You are a Health Informatics AI routing system. 
-
-            Analyze the user query and classify it into one of these categories:
-
-            1. Return "greeting" if the query is:
-            - Greetings (hello, hi, good morning, etc.)
-            - Farewells (goodbye, bye, see you later, etc.)
-            - Courtesy questions (how are you, thanks, etc.)
-            - General help requests (what can you do, who are you, help, etc.)
-
-            2. Return "list_tables" if the query is asking for:
-            - Patient treatment history, medications, or therapies
-            - Pathology results, lab results, or diagnostic reports  
-            - Patient registration details, contact info, or demographics
-            - Medical records, health data, or clinical information
-            - Specific patient data by ID or condition
-
-            3. Return "other" for any other queries that don't fit the above categories.
-
-            Query: "{query}"
-            
-            Respond with only one word: "greeting", "list_tables", or "other"
-            """
-
-            system_message = {
-                "role": "system",
-                "content": system_route_prompt,
-            }
-
-            response = llm.invoke([system_message, {"role": "user", "content": query}])
-            
-            if "list_tables" in response.content:
-                print("✅ Query classified as: PATIENT INFORMATION")
-                return {"messages": [AIMessage("list_tables")]}
-            elif "greeting" in response.content.lower():
-                print("✅ Query classified as: GREETING/GENERAL")
-                return {"messages": [AIMessage("greeting")]}
-            else:
-                print("❌ Query classified as: NON-PATIENT")
-                return {"messages": [AIMessage("other")]}
-
-
-        def route_query(state: EnhancedMessagesState) -> Literal[END, "list_tables","handle_greeting"]:
-            """Route the query to the appropriate tool based on the last message."""
-            print("🚀 STEP 2: Routing query")
-            
-            messages = state["messages"]
-            last_message = messages[-1].content
-            
-            if "list_tables" in last_message:
-                print("➡️ Routing to: list_tables")
-                return "list_tables"
-            elif "greeting" in last_message:
-                print("➡️ Routing to: handle_greeting")
-                return "handle_greeting"
-            else:
-                print("➡️ Routing to: END (non-patient query)")
-                return END
-            
-        def handle_greeting(state: EnhancedMessagesState):
-            """Handle greetings and general questions using LLM."""
-            print("🚀 STEP 3: Handling greeting/general question")
-            
-            messages = state["messages"]
-            original_query = messages[0].content if messages else self.question
-            
-            print(f"📝 Original query: '{original_query}'")
-            
-            greeting_system_prompt = f"""You are a Health Informatics AI assistant designed for healthcare professionals.
-
-            The user has sent: "{original_query}"
-
-            Your task is to respond appropriately and CONCISELY based on the type of message:
-
-            For GREETINGS (hello, hi, good morning, etc.):
-            - Greet warmly in 1-2 sentences
-            - Briefly mention you help with patient data
-            - Give 1 simple example
-            - Keep total response under 150 characters
+        Analyze the user query and classify it into one of these categories:
 
-            For FAREWELLS (goodbye, bye, etc.):
-            - Simple, friendly farewell in 1 sentence
-            - Maximum 50 characters
+        1. Return "greeting" if the query is:
+        - Greetings (hello, hi, good morning, etc.)
+        - Farewells (goodbye, bye, see you later, etc.)
+        - Courtesy questions (how are you, thanks, etc.)
+        - General help requests (what can you do, who are you, help, etc.)
 
-            For HELP/CAPABILITY questions (what can you do, who are you, etc.):
-            - Explain role in 2-3 short sentences
-            - List 2-3 main capabilities briefly
-            - Keep under 200 characters total
+        2. Return "list_tables" if the query is asking for:
+        - Patient treatment history, medications, or therapies
+        - Pathology results, lab results, or diagnostic reports  
+        - Patient registration details, contact info, or demographics
+        - Medical records, health data, or clinical information
+        - Specific patient data by ID or condition
 
-            For COURTESY (thanks, how are you, etc.):
-            - Brief appropriate response
-            - Mention availability
-            - Maximum 100 characters
+        3. Return "other" for any other queries that don't fit the above categories.
 
-            Guidelines:
-            - BE CONCISE - short responses only
-            - Use simple, direct language
-            - No bullet points or complex formatting
-            - Keep responses conversational but brief
-            - Current patient: {self.patient_id}
-
-            Examples of good responses:
-            - "Hello! I help with patient data analysis. Try asking about patient {self.patient_id}'s treatment history!"
-            - "I'm your Health Informatics AI. I can analyze patient records, treatments, and lab results. What would you like to know?"
-            - "Goodbye! Feel free to return for patient data help anytime."
-            """
-            
-            system_message = {
-                "role": "system",
-                "content": greeting_system_prompt,
-            }
-            
-            user_message = {
-                "role": "user", 
-                "content": original_query
-            }
-            
-            response = llm.invoke([system_message, user_message])
-            
-            print(f"✅ Generated greeting response: {response.content[:100]}...")
-            
-            # Format as JSON for consistency
+        Query: "{query}"
+        
+        Respond with only one word: "greeting", "list_tables", or "other"
+        """
+
+        system_message = {
+            "role": "system",
+            "content": system_route_prompt,
+        }
+
+        # The routing prompt is fixed; an overlong question is cut to fit the budget
+        user_message = {"role": "user", "content": query}
+        budget = node_token_budgets.get("determine_query_type")
+        trimmed = False
+        if budget:
+            question_budget = budget - token_counter.count_messages([system_message, {"role": "user", "content": ""}])
+            # A budget below the fixed prompt can't be met; routing an empty question would be worse
+            if question_budget > 0:
+                user_message["content"] = truncate_to_budget(query, question_budget, token_counter)
+                trimmed = user_message["content"] != query
+        prompt = [system_message, user_message]
+        prompt_tokens = prompt_stats.measure("determine_query_type", prompt, trimmed=trimmed)
+        response = await invoke_llm("determine_query_type", llm, prompt, prompt_tokens)
+        
+        if "list_tables" in response.content:
+            print("✅ Query classified as: PATIENT INFORMATION")
+            return {"messages": [AIMessage("list_tables")]}
+        elif "greeting" in response.content.lower():
+            print("✅ Query classified as: GREETING/GENERAL")
+            return {"messages": [AIMessage("greeting")]}
+        else:
+            print("❌ Query classified as: NON-PATIENT")
+            return {"messages": [AIMessage("other")]}
+
+
+    def route_query(state: AgentState) -> Literal[END, "list_tables","handle_greeting"]:
+        """Route the query to the appropriate tool based on the last message."""
+        print("🚀 STEP 2: Routing query")
+        
+        messages = state["messages"]
+        last_message = messages[-1].content
+        
+        if "list_tables" in last_message:
+            print("➡️ Routing to: list_tables")
+            return "list_tables"
+        elif "greeting" in last_message:
+            print("➡️ Routing to: handle_greeting")
+            return "handle_greeting"
+        else:
+            print("➡️ Routing to: END (non-patient query)")
+            return END
+        
+    async def handle_greeting(state: AgentState):
+        """Handle greetings and general questions using LLM."""
+        print("🚀 STEP 3: Handling greeting/general question")
+        
+        messages = state["messages"]
+        patient_id = state["patient_id"]
+        original_query = state.get("question") or messages[0].content
+        
+        print(f"📝 Original query: '{original_query}'")
+        
+        # Small talk recognised locally gets a templated reply, no LLM call
+        canned_reply = query_router.canned_reply(state.get("query_intent") or "", patient_id)
+        if canned_reply:
+            print(f"⚡ Canned {state['query_intent']} reply")
             formatted_result = json.dumps({
                 "type": "text",
-                "content": response.content,
+                "content": canned_reply,
                 "context": "greeting_response"
             })
-            
-            new_message = AIMessage(content=formatted_result)
-            return {"messages": [new_message]}
+            return {"messages": [AIMessage(content=formatted_result)]}
+        
+        greeting_system_prompt = f"""You are a Health Informatics AI assistant designed for healthcare professionals.
+
+        The user has sent: "{original_query}"
+
+        Your task is to respond appropriately and CONCISELY based on the type of message:
+
+        For GREETINGS (hello, hi, good morning, etc.):
+        - Greet warmly in 1-2 sentences
+        - Briefly mention you help with patient data
+        - Give 1 simple example
+        - Keep total response under 150 characters
+
+        For FAREWELLS (goodbye, bye, etc.):
+        - Simple, friendly farewell in 1 sentence
+        - Maximum 50 characters
+
+        For HELP/CAPABILITY questions (what can you do, who are you, etc.):
+        - Explain role in 2-3 short sentences
+        - List 2-3 main capabilities briefly
+        - Keep under 200 characters total
+
+        For COURTESY (thanks, how are you, etc.):
+        - Brief appropriate response
+        - Mention availability
+        - Maximum 100 characters
+
+        Guidelines:
+        - BE CONCISE - short responses only
+        - Use simple, direct language
+        - No bullet points or complex formatting
+        - Keep responses conversational but brief
+        - Current patient: {patient_id}
+
+        Examples of good responses:
+        - "Hello! I help with patient data analysis. Try asking about patient {patient_id}'s treatment history!"
+        - "I'm your Health Informatics AI. I can analyze patient records, treatments, and lab results. What would you like to know?"
+        - "Goodbye! Feel free to return for patient data help anytime."
+        """
+        
+        system_message = {
+            "role": "system",
+            "content": greeting_system_prompt,
+        }
+        
+        user_message = {
+            "role": "user", 
+            "content": original_query
+        }
+        
+        prompt_tokens = prompt_stats.measure("handle_greeting", [system_message, user_message])
+        response = await invoke_llm("handle_greeting", llm, [system_message, user_message], prompt_tokens)
+        
+        print(f"✅ Generated greeting response: {response.content[:100]}...")
+        
+        # Format as JSON for consistency
+        formatted_result = json.dumps({
+            "type": "text",
+            "content": response.content,
+            "context": "greeting_response"
+        })
+        
+        new_message = AIMessage(content=formatted_result)
+        return {"messages": [new_message]}
 
-        def list_tables(state: EnhancedMessagesState):
-            """List the tables in the database."""
-            print("🚀 STEP 3: Listing database tables")
-            
+    async def list_tables(state: AgentState):
+        """List the tables in the database."""
+        print("🚀 STEP 3: Listing database tables")
+        
+        tool_call = {
+            "name": "sql_db_list_tables",
+            "args": {},
+            "id": "abc123",
+            "type": "tool_call",
+        }
+        tool_call_message = AIMessage(content="", tool_calls=[tool_call])
+
+        # Served from the process-wide schema cache instead of the toolkit
+        table_names = ", ".join(await asyncio.to_thread(schema_cache.get_table_names))
+        tool_message = ToolMessage(content=table_names, name="sql_db_list_tables", tool_call_id=tool_call["id"])
+        response = AIMessage(f"Available tables: {tool_message.content}")
+
+        print(f"📊 Available tables: {tool_message.content}")
+        
+        return {"messages": [tool_call_message, tool_message, response]}
+
+    async def call_get_schema(state: AgentState):
+        """Pick the tables to describe locally instead of asking the LLM"""
+        print("🚀 STEP 4: Getting database schema")
+        
+        question = state.get("question") or state["messages"][0].content
+        table_names = select_relevant_tables(await asyncio.to_thread(schema_cache.get_table_names), question)
+        
+        tool_call = {
+            "name": "sql_db_schema",
+            "args": {"table_names": ", ".join(table_names)},
+            "id": "schema_lookup",
+            "type": "tool_call",
+        }
+        response = AIMessage(content="", tool_calls=[tool_call])
+        
+        print(f"📋 Schema requested for tables: {table_names}")
+        
+        return {"messages": state["messages"] + [response]}
+    
+    async def get_schema(state: AgentState):
+        """Answer the sql_db_schema tool call from the schema cache"""
+        tool_call = state["messages"][-1].tool_calls[0]
+        table_names = [name.strip() for name in tool_call["args"]["table_names"].split(",") if name.strip()]
+        
+        try:
+            content = await asyncio.to_thread(schema_cache.get_table_info, table_names)
+        except Exception as e:
+            content = f"Error: {e}"
+        
+        return {"messages": [ToolMessage(content=content, name="sql_db_schema", tool_call_id=tool_call["id"])]}
+    
+    async def process_schema_response(state: AgentState):
+        """Compact the schema dump to one line per selected table, keeping every column"""
+        print("🚀 STEP 4b: Compacting schema")
+        
+        messages = state["messages"]
+        schema_message = next(
+            (msg for msg in reversed(messages) if isinstance(msg, ToolMessage) and msg.name == "sql_db_schema"), None
+        )
+        schema_content = str(schema_message.content) if schema_message is not None else ""
+        
+        create_matches = re.findall(r'CREATE TABLE\s+`?(\w+)`?', schema_content, re.IGNORECASE)
+        all_tables = list(dict.fromkeys(create_matches))
+        
+        # Select relevant tables based on user question
+        original_question = state.get("question") or state["messages"][0].content
+        selected_tables = select_relevant_tables(all_tables, original_question)
+        
+        # Column names and types come from the schema cache; the dump only adds sample values
+        samples = parse_sample_rows(schema_content)
+        table_schemas = {}
+        essential_columns = {}
+        for table_name in selected_tables:
+            columns = await asyncio.to_thread(schema_cache.get_table_columns, table_name)
+            table_samples = samples.get(table_name, {})
+            table_schemas[table_name] = [
+                {**column, "sample": table_samples.get(column["name"])} for column in columns
+            ]
+            # Only trimmed later if the schema doesn't fit the generate_query budget
+            essential_columns[table_name] = select_essential_columns(columns, original_question)
+        
+        compact_schema = render_compact_schema(table_schemas)
+        raw_tokens = token_counter.count(schema_content)
+        compact_tokens = token_counter.count(compact_schema)
+        print(f"🎯 Final selected tables: {selected_tables}")
+        print(f"🗜️ Schema compacted: {raw_tokens} -> {compact_tokens} tokens")
+        
+        update = {
+            "selected_tables": selected_tables,
+            "table_schemas": table_schemas,
+            "essential_columns": essential_columns,
+        }
+        if schema_message is not None:
+            # Same id: replaces the raw dump in the message history
+            update["messages"] = [ToolMessage(
+                content=compact_schema, name="sql_db_schema",
+                tool_call_id=schema_message.tool_call_id, id=schema_message.id,
+            )]
+        return update
+
+    async def generate_query(state: AgentState):
+        print("🚀 STEP 5: Generating SQL query")
+        
+        patient_id = state["patient_id"]
+        selected_tables = state.get("selected_tables", [])
+        
+        # Parameterized plan cache: same question intent for any patient skips the LLM
+        plan_key = normalize_question(state.get("question") or state["messages"][0].content)
+        plan = sql_plan_cache.get(plan_key) if settings.SQL_PLAN_CACHE_ENABLED else None
+        if plan:
+            query = render_query(plan["template"], patient_id, plan["quote"])
+            print(f"⚡ SQL plan cache hit: {plan['template']}")
             tool_call = {
-                "name": "sql_db_list_tables",
-                "args": {},
-                "id": "abc123",
+                "name": "sql_db_query",
+                "args": {"query": query},
+                "id": "sql_plan_cache",
                 "type": "tool_call",
             }
-            tool_call_message = AIMessage(content="", tool_calls=[tool_call])
-
-            list_tables_tool = next(tool for tool in tools if tool.name == "sql_db_list_tables")
-            tool_message = list_tables_tool.invoke(tool_call)
-            response = AIMessage(f"Available tables: {tool_message.content}")
-
-            print(f"📊 Available tables: {tool_message.content}")
-            
-            return {"messages": [tool_call_message, tool_message, response]}
-
-        def call_get_schema(state: EnhancedMessagesState):
-            """Get schema and store in state"""
-            print("🚀 STEP 4: Getting database schema")
-            
-            llm_with_tools = llm.bind_tools([get_schema_tool], tool_choice="any")
-            response = llm_with_tools.invoke(state["messages"])
-            
-            print(f"📋 Schema response has tool_calls: {hasattr(response, 'tool_calls') and bool(response.tool_calls)}")
-            
-            return {"messages": state["messages"] + [response]}
-        
-        def process_schema_response(state: EnhancedMessagesState):
-            """Process schema response - minimal processing, let LLM handle details"""
-            print("🚀 STEP 4b: Processing schema response (minimal)")
-            
-            messages = state["messages"]
-            
-            # Find the tool message with schema info
-            schema_content = ""
-            for msg in reversed(messages):
-                if hasattr(msg, 'content') and 'CREATE TABLE' in str(msg.content):
-                    schema_content = msg.content
-                    break
-            
-            print(f"📋 Schema content length: {len(schema_content)}")
-            print(f"📋 Schema preview: {schema_content[:200]}...")
-            
-            # Simple table extraction - no complex column parsing
-            create_matches = re.findall(r'CREATE TABLE\s+`?(\w+)`?', schema_content, re.IGNORECASE)
-            all_tables = list(set(create_matches))
-            
-            print(f"📊 Found tables: {all_tables}")
-            
-            # Select relevant tables based on user question
-            original_question = state["messages"][0].content if state["messages"] else self.question
-            question_lower = original_question.lower()
-            
-            selected_tables = []
-            for table in all_tables:
-                table_lower = table.lower()
-                if any(keyword in table_lower for keyword in ['patient', 'registration', 'treatment', 'pathology']):
-                    selected_tables.append(table)
-                    print(f"✅ Selected table: {table} (keyword match)")
-                elif table_lower in question_lower:
-                    selected_tables.append(table)
-                    print(f"✅ Selected table: {table} (mentioned in question)")
-            
-            # Fallback selection
-            if not selected_tables:
-                selected_tables = all_tables[:1] if all_tables else []
-                if selected_tables:
-                    print(f"⚠️ Fallback selected: {selected_tables}")
-            
-            print(f"🎯 Final selected tables: {selected_tables}")
-            print(f"💡 LLM will handle detailed schema parsing in generate_query")
-            
             return {
-                "messages": messages,
-                "selected_tables": selected_tables,
-                "table_schemas": {},  # Empty - LLM will parse from raw content
-                "relevant_columns": {}  # Empty - LLM will parse from raw content
-            }
-
-        def generate_query(state: EnhancedMessagesState):
-            print("🚀 STEP 5: Generating SQL query")
-            
-            selected_tables = state.get("selected_tables", [])
-            
-            print(f"🎯 Using tables: {selected_tables}")
-            print(f"� LLM will extract column info from schema messages")
-            
-            # Simplified prompt - let LLM read schema from message history
-            generate_query_system_prompt = f"""
-                You are an agent designed to interact with a SQL database.
-                Given an input question about patient patient_id={self.patient_id}, create a syntactically correct {db.dialect} query to run.
-                
-                Guidelines:
-                - Focus on the most relevant tables: {', '.join(selected_tables) if selected_tables else 'patient-related tables'}
-                - Look at the schema information in the previous messages to understand available columns
-                - Only select columns that are needed to answer the question
-                - Always include patient_id filter where applicable (use id column for patient_id)
-                - Limit results to 100 unless user specifies otherwise
-                - DO NOT make any DML statements (INSERT, UPDATE, DELETE, DROP etc.)
-                
-                You must generate a SQL query using the sql_db_query tool. The query will be validated and executed in the next step.
-                Return only the SQL query via the tool call - do not execute it yet.
-            """
-            
-            system_message = {
-                "role": "system",
-                "content": generate_query_system_prompt,
+                "messages": [AIMessage(content="", tool_calls=[tool_call])],
+                "sql_plan_key": plan_key,
+                "sql_plan_hit": True,
             }
+        
+        print(f"🎯 Using tables: {selected_tables}")
+        
+        def build_prompt(schema_text: str) -> str:
+            return f"""
+            You are an agent designed to interact with a SQL database.
+            Given an input question about patient patient_id={patient_id}, create a syntactically correct {db.dialect} query to run.
             
-            llm_with_tools = llm.bind_tools([run_query_tool], tool_choice="any")
-            response = llm_with_tools.invoke([system_message] + state["messages"])
-            
-            # Extract query from response for logging
-            if hasattr(response, 'tool_calls') and response.tool_calls:
-                query = response.tool_calls[0]["args"]["query"]
-                print(f"🔍 Generated query: {query}")
-            else:
-                print("❌ No tool calls generated!")
+            Schema (table(column TYPE e.g. sample value); "+N more" marks columns left out to fit the prompt):
+            {schema_text}
             
-            return {"messages": [response]}
+            Guidelines:
+            - Focus on the most relevant tables: {', '.join(selected_tables) if selected_tables else 'patient-related tables'}
+            - Only use tables and columns listed in the schema above
+            - Only select columns that are needed to answer the question
+            - Always include patient_id filter where applicable (use id column for patient_id)
+            - Limit results to 100 unless user specifies otherwise
+            - DO NOT make any DML statements (INSERT, UPDATE, DELETE, DROP etc.)
+            
+            You must generate a SQL query using the sql_db_query tool. The query will be validated and executed in the next step.
+            Return only the SQL query via the tool call - do not execute it yet.
+        """
+        
+        # Only the compact schema and the question go to the model, not the whole tool-call history
+        table_schemas = state.get("table_schemas") or {}
+        essential_columns = state.get("essential_columns") or {}
+        user_message = {"role": "user", "content": state.get("question") or state["messages"][0].content}
+        schema_text = render_compact_schema(table_schemas)
+        budget = node_token_budgets.get("generate_query")
+        trimmed = False
+        if budget:
+            fixed_tokens = token_counter.count_messages([{"role": "system", "content": build_prompt("")}, user_message])
+            fitted_text, _ = fit_schema_to_budget(table_schemas, essential_columns, budget - fixed_tokens, token_counter)
+            trimmed = fitted_text != schema_text
+            schema_text = fitted_text
+        
+        system_message = {
+            "role": "system",
+            "content": build_prompt(schema_text),
+        }
+        prompt = [system_message, user_message]
+        # Savings against the old prompt: system message plus the whole message history
+        history_tokens = token_counter.count_messages([system_message] + state["messages"])
+        saved_tokens = max(history_tokens - token_counter.count_messages(prompt), 0)
+        prompt_tokens = prompt_stats.measure("generate_query", prompt, trimmed=trimmed, saved_tokens=saved_tokens)
+        
+        llm_with_tools = llm.bind_tools([run_query_tool], tool_choice="any")
+        response = await invoke_llm("generate_query", llm_with_tools, prompt, prompt_tokens)
+        
+        # Extract query from response for logging
+        if hasattr(response, 'tool_calls') and response.tool_calls:
+            query = response.tool_calls[0]["args"]["query"]
+            print(f"🔍 Generated query: {query}")
+        else:
+            print("❌ No tool calls generated!")
+        
+        return {"messages": [response], "sql_plan_key": plan_key, "sql_plan_hit": False}
 
-        def check_query(state: EnhancedMessagesState):
-            """Check the query generated by the model."""
-            print("🚀 STEP 6: Validating SQL query")
-            
-            check_query_system_prompt = f"""
-                You are a SQL expert with a strong attention to detail.
-                Double check the {db.dialect} query for common mistakes, including:
-                - Using NOT IN with NULL values
-                - Using UNION when UNION ALL should have been used
-                - Using BETWEEN for exclusive ranges
-                - Data type mismatch in predicates
-                - Properly quoting identifiers
-                - Using the correct number of arguments for functions
-                - Casting to the correct data type
-                - Using the proper columns for joins
-
-                If there are any mistakes, rewrite the query. If there are no mistakes,
-                just reproduce the original query.
-
-                You will call the appropriate tool to execute the query after running this check.
-            """
-            system_message = {
-                "role": "system",
-                "content": check_query_system_prompt,
+    async def check_query(state: AgentState):
+        """Check the query generated by the model."""
+        print("🚀 STEP 6: Validating SQL query")
+        
+        check_query_system_prompt = f"""
+            You are a SQL expert with a strong attention to detail.
+            Double check the {db.dialect} query for common mistakes, including:
+            - Using NOT IN with NULL values
+            - Using UNION when UNION ALL should have been used
+            - Using BETWEEN for exclusive ranges
+            - Data type mismatch in predicates
+            - Properly quoting identifiers
+            - Using the correct number of arguments for functions
+            - Casting to the correct data type
+            - Using the proper columns for joins
+
+            If there are any mistakes, rewrite the query. If there are no mistakes,
+            just reproduce the original query.
+
+            You will call the appropriate tool to execute the query after running this check.
+        """
+        system_message = {
+            "role": "system",
+            "content": check_query_system_prompt,
+        }
+
+        tool_call = state["messages"][-1].tool_calls[0]
+        user_message = {"role": "user", "content": tool_call["args"]["query"]}
+        
+        print(f"✅ Validating query: {tool_call['args']['query']}")
+        
+        prompt_tokens = prompt_stats.measure("check_query", [system_message, user_message])
+        llm_with_tools = llm.bind_tools([run_query_tool], tool_choice="any")
+        response = await invoke_llm("check_query", llm_with_tools, [system_message, user_message], prompt_tokens)
+        response.id = state["messages"][-1].id
+        
+        return {"messages": [response]}
+
+    async def guard_query(state: AgentState):
+        """Admit, rewrite (LIMIT, execution time) or reject the generated SQL before it runs"""
+        print("🚀 STEP 6: Guarding SQL query")
+
+        last_message = state["messages"][-1]
+        if not settings.SQL_GUARD_ENABLED or state.get("sql_plan_hit") or not getattr(last_message, "tool_calls", None):
+            # Cached plans were admitted when first generated
+            return {"rejection_reason": "", "estimated_rows": None, "read_target": None}
+
+        tool_call = last_message.tool_calls[0]
+        query = tool_call["args"]["query"]
+        decision = await asyncio.to_thread(sql_guard.check, query, state["patient_id"])
+
+        if not decision["allowed"]:
+            print(f"🛑 Query rejected: {decision['reason']}")
+            return {
+                "executed_query": query,
+                "query_result": None,
+                "query_error": f"Query rejected: {decision['reason']}",
+                "rejection_reason": decision["reason"],
             }
 
-            tool_call = state["messages"][-1].tool_calls[0]
-            user_message = {"role": "user", "content": tool_call["args"]["query"]}
-            
-            print(f"✅ Validating query: {tool_call['args']['query']}")
-            
-            llm_with_tools = llm.bind_tools([run_query_tool], tool_choice="any")
-            response = llm_with_tools.invoke([system_message, user_message])
-            response.id = state["messages"][-1].id
-            
-            return {"messages": [response]}
+        estimated_rows = decision["explain"]["estimated_rows"] if decision["explain"] else None
+        if estimated_rows is not None:
+            print(f"📐 EXPLAIN estimate: {estimated_rows} rows")
+        if not decision["rewrites"]:
+            return {"rejection_reason": "", "estimated_rows": estimated_rows, "read_target": decision["read_target"]}
+
+        print(f"✏️ Query rewritten ({'; '.join(decision['rewrites'])}): {decision['query']}")
+        guarded_call = {**tool_call, "args": {**tool_call["args"], "query": decision["query"]}}
+        # Same id, so the rewritten call replaces the generated one in the message history
+        response = AIMessage(content=last_message.content, tool_calls=[guarded_call], id=last_message.id)
+        return {"messages": [response], "rejection_reason": "", "estimated_rows": estimated_rows,
+                "read_target": decision["read_target"]}
+
+    def route_after_guard(state: AgentState) -> Literal["run_query_with_schema", "format_query_results"]:
+        """Rejected queries skip execution and get a local explanation"""
+        if state.get("rejection_reason"):
+            return "format_query_results"
+        return "run_query_with_schema"
 
-        def run_query_with_schema(state: EnhancedMessagesState):
-            """Custom run_query that preserves schema info"""
-            print("🚀 STEP 7: Executing SQL query")
-            
-            messages = state["messages"]
-            last_message = messages[-1]
+    async def run_query_with_schema(state: AgentState):
+        """Custom run_query that preserves schema info and the column-aware result"""
+        print("🚀 STEP 7: Executing SQL query")
+        
+        messages = state["messages"]
+        last_message = messages[-1]
+        
+        if hasattr(last_message, 'tool_calls') and last_message.tool_calls:
+            query = last_message.tool_calls[0]["args"]["query"]
+            tool_call_id = last_message.tool_calls[0].get("id", "query_exec")
+            plan_key = state.get("sql_plan_key", "")
+            print(f"🔍 Executing: {query}")
+            source = "plan_cache" if state.get("sql_plan_hit") else "llm"
+            query_start = time.time()
             
-            if hasattr(last_message, 'tool_calls') and last_message.tool_calls:
-                query = last_message.tool_calls[0]["args"]["query"]
-                print(f"🔍 Executing: {query}")
+            try:
+                with tracer.span("db.query", estimated_rows=state.get("estimated_rows")) as span:
+                    query_result = None
+                    if settings.PATIENT_SNAPSHOT_ENABLED:
+                        # Follow-up questions about the same patient run on the in-memory snapshot
+                        query_result = await asyncio.to_thread(patient_snapshots.execute, query, state["patient_id"])
+                    if query_result is not None:
+                        if source == "llm" and settings.SQL_PLAN_CACHE_ENABLED and plan_key:
+                            sql_plan_cache.store(plan_key, query, state["patient_id"])
+                        source = "snapshot"
+                    elif state.get("sql_plan_hit"):
+                        # Cached template with patient_id bound as a driver parameter
+                        plan = sql_plan_cache.peek(plan_key)
+                        if plan is None:
+                            raise ValueError("cached SQL plan was evicted")
+                        query_result = await asyncio.to_thread(sql_plan_cache.execute, plan_key, plan, state["patient_id"])
+                    else:
+                        # On the server the guard's EXPLAIN admitted it on
+                        query_result = await asyncio.to_thread(
+                            db_manager.execute_query, query, read_only=True, target=state.get("read_target"),
+                        )
+                        if settings.SQL_PLAN_CACHE_ENABLED and plan_key:
+                            sql_plan_cache.store(plan_key, query, state["patient_id"])
+                    span.set_attributes(
+                        source=source, rows=query_result.row_count, columns=len(query_result.columns),
+                        bytes=query_result.estimated_bytes, truncated=query_result.truncated,
+                    )
+                latency_ms = (time.time() - query_start) * 1000
+                await asyncio.to_thread(
+                    query_log.record, query, state["patient_id"], latency_ms, query_result.row_count,
+                    rows_examined=state.get("estimated_rows"), source=source, truncated=query_result.truncated,
+                )
                 
-                # Create a proper tool call dict for the run_query_tool
-                tool_call = {
-                    "name": "sql_db_query",
-                    "args": {"query": query},
-                    "id": last_message.tool_calls[0].get("id", "query_exec"),
-                    "type": "tool_call",
-                }
+                result = ToolMessage(
+                    content=build_preview(query_result, settings.RESULT_PREVIEW_ROWS),
+                    name="sql_db_query",
+                    tool_call_id=tool_call_id,
+                )
+                print(f"📊 Query returned {query_result.row_count} rows x {len(query_result.columns)} columns")
+                print(f"📊 Result preview: {str(result.content)[:200]}...")
                 
-                try:
-                    result = run_query_tool.invoke(tool_call)
-                    print(f"📊 Query result type: {type(result)}")
-                    print(f"📊 Query result length: {len(str(result))}")
-                    print(f"📊 Result preview: {str(result)[:200]}...")
-                    
-                    return {
-                        "messages": messages + [result],
-                        "selected_tables": state.get("selected_tables", []),
-                        "table_schemas": state.get("table_schemas", {}),
-                        "relevant_columns": state.get("relevant_columns", {}),
-                        "executed_query": query
-                    }
-                except Exception as e:
-                    print(f"❌ Error executing query: {e}")
-                    error_message = f"Error executing query: {str(e)}"
-                    error_result = AIMessage(content=error_message)
-                    return {
-                        "messages": messages + [error_result],
-                        "selected_tables": state.get("selected_tables", []),
-                        "table_schemas": state.get("table_schemas", {}),
-                        "relevant_columns": state.get("relevant_columns", {}),
-                        "executed_query": query
-                    }
+                return {
+                    "messages": messages + [result],
+                    "selected_tables": state.get("selected_tables", []),
+                    "table_schemas": state.get("table_schemas", {}),
+                    "essential_columns": state.get("essential_columns", {}),
+                    "executed_query": query,
+                    "query_result": query_result,
+                    "query_error": "",
+                }
+            except Exception as e:
+                print(f"❌ Error executing query: {e}")
+                await asyncio.to_thread(
+                    query_log.record, query, state["patient_id"], (time.time() - query_start) * 1000, 0,
+                    rows_examined=state.get("estimated_rows"), source=source, error=str(e),
+                )
+                error_message = f"Error executing query: {str(e)}"
+                error_result = AIMessage(content=error_message)
+                return {
+                    "messages": messages + [error_result],
+                    "selected_tables": state.get("selected_tables", []),
+                    "table_schemas": state.get("table_schemas", {}),
+                    "essential_columns": state.get("essential_columns", {}),
+                    "executed_query": query,
+                    "query_result": None,
+                    "query_error": str(e),
+                }
+        
+        return {"messages": messages}
+
+    # def should_continue(state: AgentState) -> Literal["check_query", "run_query_with_schema"]:
+    #     messages = state["messages"]
+    #     last_message = messages[-1]
+    #     if not last_message.tool_calls:
+    #         return "run_query_with_schema"
+    #     else:
+    #         return "check_query"
+    def should_continue(state: AgentState) -> Literal["check_query", "guard_query"]:
+        # Skip the LLM validation step; the rule-based guard always runs
+        return "guard_query"
+
+    def should_continue_after_query(state: AgentState) -> Literal["format_query_results"]:
+        """Always format results, whether empty or not"""
+        print("🚀 STEP 8: Always proceeding to format results")
+        return "format_query_results"
+
+    async def format_query_results(state: AgentState):
+        """Render data and table_html locally; the LLM only writes the narrative"""
+        print("🚀 STEP 9: Formatting query results (local table, LLM summary)")
+        
+        messages = state["messages"]
+        patient_id = state["patient_id"]
+        selected_tables = state.get("selected_tables", [])
+        executed_query = state.get("executed_query", "")
+        original_question = state.get("question") or state["messages"][0].content
+        query_result = state.get("query_result") or QueryResult.empty()
+        query_error = state.get("query_error") or ""
+        
+        print(f"🎯 Selected tables: {selected_tables}")
+        print(f"🔍 Executed query: {executed_query}")
+        print(f"❓ Original question: {original_question}")
+        
+        # Empty or failed results need no LLM call at all
+        if query_error or not query_result.row_count:
+            print("✅ No data - built response locally")
+            formatted = build_no_data_response(
+                patient_id, selected_tables, executed_query, query_error or None,
+                rejection_reason=state.get("rejection_reason") or None,
+            )
+            return {"messages": messages[:-1] + [AIMessage(content=json.dumps(formatted))]}
+        
+        render_start = time.time()
+        df = build_dataframe(query_result)
+        print(f"⚡ Rendered {len(df)} rows locally in {(time.time() - render_start)*1000:.0f}ms")
+        
+        narrative = {}
+        try:
+            format_system_prompt = f"""
+            You are a health informatics assistant helping doctors analyze patient data. You have received query results from a database.
+            
+            Patient ID: {patient_id}
+            Original Question: {original_question}
+            Query executed: {executed_query}
+            Tables queried: {', '.join(selected_tables)}
+            Record count: {query_result.row_count}{" (result cut off by the query budget; mention that more records may exist)" if query_result.truncated else ""}
+            
+            The full table is rendered separately for the user. Write only the narrative.
+            
+            Return a JSON object with this structure:
+            {{
+                "summary": "Brief, conversational summary of findings (2-3 sentences)",
+                "key_insights": ["2-3 bullet points of key findings"],
+                "explanation": "Brief medical context or interpretation if relevant"
+            }}
             
-            return {"messages": messages}
-
-        # def should_continue(state: EnhancedMessagesState) -> Literal["check_query", "run_query_with_schema"]:
-        #     messages = state["messages"]
-        #     last_message = messages[-1]
-        #     if not last_message.tool_calls:
-        #         return "run_query_with_schema"
-        #     else:
-        #         return "check_query"
-        def should_continue(state: EnhancedMessagesState) -> Literal["check_query", "run_query_with_schema"]:
-            # Skip validation step entirely
-            return "run_query_with_schema"
-
-        def should_continue_after_query(state: EnhancedMessagesState) -> Literal["format_query_results"]:
-            """Always format results, whether empty or not"""
-            print("🚀 STEP 8: Always proceeding to format results")
-            return "format_query_results"
-
-        def format_query_results(state: EnhancedMessagesState):
-            """Let LLM format query results with summary-first approach"""
-            print("🚀 STEP 9: LLM formatting query results with summary")
+            Guidelines:
+            - For data results, provide meaningful medical insights
+            - Use conversational, doctor-friendly language
+            - Refer to dates in readable format (YYYY-MM-DD)
+            - Handle None/null values appropriately
             
-            messages = state["messages"]
-            last_message = messages[-1]
-            selected_tables = state.get("selected_tables", [])
-            executed_query = state.get("executed_query", "")
-            original_question = state["messages"][0].content if state["messages"] else self.question
+            IMPORTANT: Return ONLY the JSON object, no markdown formatting, no code blocks, no extra text.
+            """
             
-            print(f"🎯 Selected tables: {selected_tables}")
-            print(f"🔍 Executed query: {executed_query}")
-            print(f"❓ Original question: {original_question}")
+            system_message = {
+                "role": "system", 
+                "content": format_system_prompt
+            }
             
-            try:
-                content = last_message.content.strip()
-                print(f"📊 Raw query result: {content[:200]}...")
-                
-                # Enhanced LLM prompt to handle both data and empty results
-                format_system_prompt = f"""
-                You are a health informatics assistant helping doctors analyze patient data. You have received raw query results from a database.
-                
-                Patient ID: {self.patient_id}
-                Original Question: {original_question}
-                Raw query result: {content}
-                Query executed: {executed_query}
-                Tables queried: {', '.join(selected_tables)}
-                
-                IMPORTANT: Check if the query result is empty or contains no data (empty list [], no tuples, etc.)
-                
-                If NO DATA is found:
-                - Create a helpful "no data found" message
-                - Explain which tables were searched
-                - Suggest possible reasons (patient has no records, wrong patient ID, etc.)
-                - Set type to "no_data"
-                
-                If DATA is found:
-                - Create a user-friendly response with summary and detailed data
-                - Set type to "table_data"
-                
-                Return a JSON object with this structure:
-                
-                For NO DATA FOUND:
-                {{
-                    "type": "no_data",
-                    "summary": "I searched the [table names] for patient {self.patient_id} but found no matching records.",
-                    "data_source": "Tables searched: [table names]",
-                    "record_count": 0,
-                    "key_insights": [
-                        "No records found for patient ID {self.patient_id}",
-                        "This could mean the patient has no data in these tables",
-                        "Try searching in other areas or verify the patient ID"
-                    ],
-                    "data": [],
-                    "table_html": "<p>No data found in the searched tables.</p>",
-                    "explanation": "The search query found no matching records in the specified table(s).",
-                    "schema_info": {{
-                        "tables": {selected_tables},
-                        "query": "{executed_query}"
-                    }}
-                }}
-                
-                For DATA FOUND:
-                {{
-                    "type": "table_data",
-                    "summary": "Brief, conversational summary of findings (2-3 sentences)",
-                    "data_source": "Which table(s) and what type of data was found",
-                    "record_count": "Number of records found",
-                    "key_insights": ["2-3 bullet points of key findings"],
-                    "data": [array of objects with column names as keys],
-                    "table_html": "HTML table representation",
-                    "explanation": "Brief medical context or interpretation if relevant",
-                    "schema_info": {{
-                        "tables": {selected_tables},
-                        "query": "{executed_query}"
-                    }}
-                }}
-                
-                Guidelines:
-                - Always be helpful and informative
-                - For empty results, be clear about what was searched
-                - For data results, provide meaningful medical insights
-                - Use conversational, doctor-friendly language
-                - Convert dates to readable format (YYYY-MM-DD)
-                - Handle None/null values appropriately
-                
-                IMPORTANT: Return ONLY the JSON object, no markdown formatting, no code blocks, no extra text.
-                """
-                
-                system_message = {
-                    "role": "system", 
-                    "content": format_system_prompt
-                }
-                
+            # Fewer preview rows until the prompt fits the node's token budget
+            preview_rows = settings.RESULT_PREVIEW_ROWS
+            budget = node_token_budgets.get("format_query_results")
+            while True:
                 user_message = {
                     "role": "user",
-                    "content": f"Please analyze and format this patient data: {content}"
+                    "content": f"Please summarize this patient data:\n{build_preview(query_result, preview_rows)}"
                 }
-                
-                response = llm.invoke([system_message, user_message])
-                
-                print(f"📋 LLM formatting response: {response.content[:200]}...")
-                
-                # Clean the response - remove markdown code blocks if present
-                cleaned_response = response.content.strip()
-                
-                # Remove markdown code blocks
-                if cleaned_response.startswith('```json'):
-                    cleaned_response = cleaned_response[7:]  # Remove ```json
-                elif cleaned_response.startswith('```'):
-                    cleaned_response = cleaned_response[3:]   # Remove ```
-                
-                if cleaned_response.endswith('```'):
-                    cleaned_response = cleaned_response[:-3]  # Remove ending ```
-                
-                cleaned_response = cleaned_response.strip()
-                
-                print(f"🧹 Cleaned response: {cleaned_response[:200]}...")
-                
-                # Validate that it's valid JSON
-                try:
-                    parsed_json = json.loads(cleaned_response)
-                    print("✅ LLM returned valid JSON")
-                    
-                    # Ensure required fields exist
-                    if "type" not in parsed_json:
-                        parsed_json["type"] = "table_data"
-                    if "data" not in parsed_json:
-                        parsed_json["data"] = []
-                    if "summary" not in parsed_json:
-                        if parsed_json.get("type") == "no_data":
-                            parsed_json["summary"] = f"No data found for patient {self.patient_id} in {', '.join(selected_tables)} table(s)"
-                        else:
-                            parsed_json["summary"] = f"Found data in {', '.join(selected_tables)} table(s)"
-                    if "schema_info" not in parsed_json:
-                        parsed_json["schema_info"] = {
-                            "tables": selected_tables,
-                            "query": executed_query
-                        }
-                    
-                    # Create HTML table if not provided and data exists
-                    if "table_html" not in parsed_json:
-                        if parsed_json["data"]:
-                            df = pd.DataFrame(parsed_json["data"])
-                            parsed_json["table_html"] = df.to_html(classes="table table-striped", index=False)
-                            parsed_json["html"] = parsed_json["table_html"]  # For frontend compatibility
-                        else:
-                            parsed_json["table_html"] = "<p>No data found in the searched tables.</p>"
-                            parsed_json["html"] = parsed_json["table_html"]
-                    
-                    # Add record count if not provided
-                    if "record_count" not in parsed_json:
-                        parsed_json["record_count"] = len(parsed_json["data"]) if parsed_json["data"] else 0
-                    
-                    formatted_result = json.dumps(parsed_json)
-                    print("✅ Successfully formatted with LLM (handles both data and no-data cases)")
-                    
-                except json.JSONDecodeError as e:
-                    print(f"⚠️ LLM response was not valid JSON: {str(e)}")
-                    print(f"🔍 Problematic content: {cleaned_response[:500]}...")
-                    # Fallback structure
-                    formatted_result = json.dumps({
-                        "type": "no_data",
-                        "summary": f"I searched the {', '.join(selected_tables)} table(s) for patient {self.patient_id} but encountered an issue processing the results.",
-                        "data_source": f"Tables: {', '.join(selected_tables)}",
-                        "record_count": 0,
-                        "content": cleaned_response,
-                        "original_query": executed_query,
-                        "tables": selected_tables,
-                        "parse_error": str(e)
-                    })
-                
-                new_message = AIMessage(content=formatted_result)
-                return {"messages": messages[:-1] + [new_message]}
-                
-            except Exception as e:
-                print(f"❌ Error in LLM formatting: {str(e)}")
-                # Simple fallback with no-data message
-                formatted_result = json.dumps({
-                    "type": "no_data", 
-                    "summary": f"I searched the {', '.join(selected_tables)} table(s) for patient {self.patient_id} but encountered an error.",
-                    "data_source": f"Tables: {', '.join(selected_tables)}",
-                    "content": f"Query result: {content}",
-                    "error": f"Formatting error: {str(e)}"
-                })
-                new_message = AIMessage(content=formatted_result)
-                return {"messages": messages[:-1] + [new_message]}
-            
-            return {"messages": messages}
-
-        # Build the graph with enhanced state
-        builder = StateGraph(EnhancedMessagesState)
-        
-        # Add all nodes
-        builder.add_node("determine_query_type", determine_query_type)
-        builder.add_node("handle_greeting", handle_greeting)  # New greeting node
-        builder.add_node("list_tables", list_tables)
-        builder.add_node("call_get_schema", call_get_schema)
-        builder.add_node("get_schema", get_schema_node)
-        builder.add_node("process_schema_response", process_schema_response)
-        builder.add_node("generate_query", generate_query)
-        builder.add_node("check_query", check_query)
-        builder.add_node("run_query_with_schema", run_query_with_schema)
-        builder.add_node("format_query_results", format_query_results)
-        
-        # Add edges - ENHANCED STRUCTURE
-        builder.add_edge(START, "determine_query_type")
-        builder.add_conditional_edges("determine_query_type", route_query)
-        builder.add_edge("handle_greeting", END)  # Greeting goes straight to end
-        builder.add_edge("list_tables", "call_get_schema")
-        builder.add_edge("call_get_schema", "get_schema")
-        builder.add_edge("get_schema", "process_schema_response")
-        builder.add_edge("process_schema_response", "generate_query")
-        builder.add_conditional_edges("generate_query", should_continue)
-        builder.add_edge("check_query", "run_query_with_schema")
-        builder.add_conditional_edges("run_query_with_schema", should_continue_after_query)
-        builder.add_edge("format_query_results", END)
-
-        print("🏗️ Building agent graph...")
-        graph_start = time.time()
-        agent = builder.compile()
-        print(f"⚡ Graph built in {(time.time() - graph_start)*1000:.0f}ms")
-    
+                if not budget or preview_rows <= 1 or token_counter.count_messages([system_message, user_message]) <= budget:
+                    break
+                preview_rows //= 2
+            prompt_tokens = prompt_stats.measure("format_query_results", [system_message, user_message],
+                                                 trimmed=preview_rows < settings.RESULT_PREVIEW_ROWS)
+            # Over the request's token ceiling this raises and the generic summary below is used
+            summary_llm, ledger = budgeted_llm(llm, "format_query_results", prompt_tokens)
+            
+            # Stream the reply so the summary can be forwarded to SSE clients as it is written
+            writer = get_stream_writer()
+            content = ""
+            streamed_summary = ""
+            with tracer.span("llm.chat", node="format_query_results", model=settings.OPENAI_MODEL,
+                             preview_rows=preview_rows, streamed=True) as span:
+                reply = None
+                async for chunk in summary_llm.astream([system_message, user_message]):
+                    reply = chunk if reply is None else reply + chunk
+                    content += chunk.content if isinstance(chunk.content, str) else ""
+                    summary = extract_partial_json_string(content, "summary")
+                    if len(summary) > len(streamed_summary):
+                        writer({"event": "summary_token", "text": summary[len(streamed_summary):]})
+                        streamed_summary = summary
+                # Chunks add up to the full message, usage metadata included
+                reply = reply if reply is not None else AIMessage(content="")
+                span.set_attributes(**ledger.record("format_query_results", reply, prompt_tokens))
+            print(f"📋 LLM summary response: {content[:200]}...")
+            narrative = parse_llm_json(content)
+            print("✅ LLM returned valid JSON")
+        except Exception as e:
+            # The table is already rendered, so fall back to a generic summary
+            print(f"⚠️ LLM summary failed, using default summary: {str(e)}")
         
+        formatted = build_table_response(
+            df, narrative, patient_id, selected_tables, executed_query, query_result.truncation_reason
+        )
+        new_message = AIMessage(content=json.dumps(formatted))
+        return {"messages": messages[:-1] + [new_message]}
+
+    # Build the graph with enhanced state
+    builder = StateGraph(AgentState)
+    
+    # Add all nodes
+    builder.add_node("determine_query_type", traced_node("determine_query_type", determine_query_type))
+    builder.add_node("handle_greeting", traced_node("handle_greeting", handle_greeting))  # New greeting node
+    builder.add_node("list_tables", traced_node("list_tables", list_tables))
+    builder.add_node("call_get_schema", traced_node("call_get_schema", call_get_schema))
+    builder.add_node("get_schema", traced_node("get_schema", get_schema))
+    builder.add_node("process_schema_response", traced_node("process_schema_response", process_schema_response))
+    builder.add_node("generate_query", traced_node("generate_query", generate_query))
+    builder.add_node("check_query", traced_node("check_query", check_query))
+    builder.add_node("guard_query", traced_node("guard_query", guard_query))
+    builder.add_node("run_query_with_schema", traced_node("run_query_with_schema", run_query_with_schema))
+    builder.add_node("format_query_results", traced_node("format_query_results", format_query_results))
+    
+    # Add edges - ENHANCED STRUCTURE
+    builder.add_edge(START, "determine_query_type")
+    builder.add_conditional_edges("determine_query_type", route_query)
+    builder.add_edge("handle_greeting", END)  # Greeting goes straight to end
+    builder.add_edge("list_tables", "call_get_schema")
+    builder.add_edge("call_get_schema", "get_schema")
+    builder.add_edge("get_schema", "process_schema_response")
+    builder.add_edge("process_schema_response", "generate_query")
+    builder.add_conditional_edges("generate_query", should_continue)
+    builder.add_edge("check_query", "guard_query")
+    builder.add_conditional_edges("guard_query", route_after_guard)
+    builder.add_conditional_edges("run_query_with_schema", should_continue_after_query)
+    builder.add_edge("format_query_results", END)
+
+    print("🏗️ Building agent graph...")
+    graph_start = time.time()
+    agent = builder.compile()
+    print(f"⚡ Graph built in {(time.time() - graph_start)*1000:.0f}ms")
+    return agent
+
+
+class AgentGraphFactory:
+    """Singleton that compiles the agent graph once per process and reuses it"""
+    _instance: Optional['AgentGraphFactory'] = None
+    _graphs: Dict[str, CompiledStateGraph] = {}
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def get_graph(self, openai_key: Optional[str] = None) -> CompiledStateGraph:
+        """Get the compiled graph for an API key, building it on first use"""
+        openai_key = openai_key or settings.OPENAI_API_KEY
+        graph = self._graphs.get(openai_key)
+        if graph is not None:
+            return graph
+
+        with self._lock:
+            graph = self._graphs.get(openai_key)
+            if graph is None:
+                build_start = time.time()
+                print("🏗️ Compiling agent graph (once per process)...")
+                graph = build_agent_graph(create_llm(openai_key), db_manager.get_database())
+                self._graphs[openai_key] = graph
+                print(f"✅ Agent graph ready in {(time.time() - build_start)*1000:.0f}ms")
+        return graph
+
+    def reset(self):
+        """Drop compiled graphs, e.g. after the database connection was replaced"""
+        with self._lock:
+            self._graphs.clear()
+
+
+# Global agent graph factory instance
+agent_graph_factory = AgentGraphFactory()
+
+
+class DatabaseAgent:
+    def __init__(self, patient_id, openai_key, question):
+        self.patient_id = patient_id
+        self.openai_key = openai_key
+        self.question = question
+        # LLM tokens of this request, per node; nodes find it in the graph config
+        self.token_usage = TokenLedger(settings.LLM_MAX_TOKENS_PER_REQUEST)
+
+    def graph_config(self) -> dict:
+        return {"configurable": {"token_ledger": self.token_usage}}
+
+    def get_database(self):
+        """Get shared database connection from pool"""
+        db_start = time.time()
+        db = db_manager.get_database()
+        db_duration = time.time() - db_start
+        print(f"🗄️ Database retrieved from pool in {db_duration*1000:.0f}ms")
+        return db
+
+    async def acreate_agent(self):
+        """Run the agent graph on the event loop and return (text_response, html_response)"""
+        agent_start = time.time()
+        print(f"🤖 DatabaseAgent: Starting execution...")
+
+        agent = agent_graph_factory.get_graph(self.openai_key)
+        print(f"⚡ Compiled graph fetched in {(time.time() - agent_start)*1000:.0f}ms")
+    
         print("🚀 Starting agent execution...")
         execution_start = time.time()
         final_state = None
         step_count = 0
 
-        for step in agent.stream(
-            {"messages": [{"role": "user", "content": self.question}]},
-            stream_mode="values",
-        ):
-            step_count += 1
-            final_state = step
-            print(f"📝 Step {step_count}: {step['messages'][-1].__class__.__name__}")
-            # Remove the pretty_print for speed
-            # step["messages"][-1].pretty_print()
+        with tracer.span("agent.run") as span:
+            try:
+                async for step in agent.astream(
+                    {
+                        "messages": [{"role": "user", "content": self.question}],
+                        "patient_id": self.patient_id,
+                        "question": self.question,
+                    },
+                    self.graph_config(),
+                    stream_mode="values",
+                ):
+                    step_count += 1
+                    final_state = step
+                    print(f"📝 Step {step_count}: {step['messages'][-1].__class__.__name__}")
+            finally:
+                self.token_usage.close()
+            span.set_attributes(steps=step_count, total_tokens=self.token_usage.total_tokens)
 
         execution_duration = time.time() - execution_start
         total_duration = time.time() - agent_start
         print(f"🏃 Agent execution in {execution_duration:.2f}s ({step_count} steps)")
         print(f"🏁 Total DatabaseAgent time: {total_duration:.2f}s")
 
+        return self.extract_response(final_state)
+
+    async def astream_events(self):
+        """Run the agent graph and yield progress events as nodes finish.
+
+        Yields dicts with an "event" key: progress, route, query, rejected, rows,
+        summary_token and finally result with the (text_response, html_response) pair.
+        """
+        agent = agent_graph_factory.get_graph(self.openai_key)
+        execution_start = time.time()
+        last_message = None
+
+        try:
+            async for mode, chunk in agent.astream(
+                {
+                    "messages": [{"role": "user", "content": self.question}],
+                    "patient_id": self.patient_id,
+                    "question": self.question,
+                },
+                self.graph_config(),
+                stream_mode=["updates", "custom"],
+            ):
+                if mode == "custom":
+                    yield chunk
+                    continue
+                for node, update in chunk.items():
+                    update = update or {}
+                    if update.get("messages"):
+                        last_message = update["messages"][-1]
+                    elapsed_ms = round((time.time() - execution_start) * 1000)
+                    yield {"event": "progress", "node": node, "label": NODE_LABELS.get(node, node), "elapsed_ms": elapsed_ms}
+                    if node == "determine_query_type" and last_message is not None:
+                        yield {"event": "route", "route": last_message.content, "intent": update.get("query_intent", "")}
+                    elif node in ("generate_query", "guard_query") and update.get("messages") and getattr(last_message, "tool_calls", None):
+                        # The guard re-sends the query only when it rewrote it
+                        yield {"event": "query", "query": last_message.tool_calls[0]["args"].get("query", "")}
+                    elif node == "guard_query" and update.get("rejection_reason"):
+                        yield {"event": "rejected", "reason": update["rejection_reason"]}
+                    elif node == "run_query_with_schema" and update.get("query_result") is not None:
+                        # Rows go out before the LLM starts on the summary
+                        yield {"event": "rows", **build_rows_payload(update["query_result"])}
+        finally:
+            self.token_usage.close()
+
+        print(f"🏃 Streamed agent execution in {time.time() - execution_start:.2f}s")
+        text_response, html_response = self.extract_response({"messages": [last_message]})
+        yield {"event": "result", "text_response": text_response, "html_response": html_response}
+
+    @staticmethod
+    def extract_response(final_state):
+        """(text_response, html_response) from the final graph state"""
         # Return formatted result based on type
         final_message = final_state["messages"][-1]
         if hasattr(final_message, 'content'):
@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+import httpx
+
+from app.core.config import settings
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class ConnectionMetrics:
+    """Request and connection counters fed by httpcore trace events.
+
+    Every request that didn't open a TCP connection reused a pooled one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._connections = 0
+        self._tls_handshakes = 0
+        self._connect_seconds = 0.0
+        self._errors = 0
+        self._http_versions = Counter()
+
+    def on_trace(self, name: str, info: dict, started: dict):
+        if name == "connection.connect_tcp.started":
+            started["connect"] = time.perf_counter()
+        elif name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            elapsed = time.perf_counter() - started.get("connect", time.perf_counter())
+            with self._lock:
+                if name == "connection.connect_tcp.complete":
+                    self._connections += 1
+                else:
+                    self._tls_handshakes += 1
+                # TCP connect plus TLS handshake make up the connection setup time
+                self._connect_seconds += elapsed
+            started["connect"] = time.perf_counter()
+
+    def on_request(self):
+        with self._lock:
+            self._requests += 1
+
+    def on_response(self, http_version: str, failed: bool):
+        with self._lock:
+            self._http_versions[http_version] += 1
+            if failed:
+                self._errors += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            reused = max(self._requests - self._connections, 0)
+            return {
+                "requests": self._requests,
+                "new_connections": self._connections,
+                "reused_connections": reused,
+                "reuse_rate": round(reused / self._requests, 3) if self._requests else 0.0,
+                "tls_handshakes": self._tls_handshakes,
+                "avg_connect_ms": round(self._connect_seconds / self._connections * 1000, 1) if self._connections else 0.0,
+                "error_responses": self._errors,
+                "http_versions": dict(self._http_versions),
+            }
+
+
+class HttpClientPool:
+    """Process-wide keep-alive HTTP clients for OpenAI calls.
+
+    One sync and one async httpx client, created on first use and shared by the
+    chat model, transcription and any other OpenAI SDK client, so connections
+    (and their TLS sessions) are reused across requests. HTTP/2 is used when
+    enabled and the h2 package is installed. Transport retries cover connection
+    failures; the SDKs retry failed requests on top (OPENAI_MAX_RETRIES).
+    """
+
+    def __init__(self, max_connections: int, max_keepalive_connections: int, keepalive_expiry: float,
+                 connect_timeout: float, timeout: float, transport_retries: int, http2: bool):
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._transport_retries = transport_retries
+        self._http2 = http2 and HTTP2_AVAILABLE
+        if http2 and not HTTP2_AVAILABLE:
+            print("⚠️ HTTP/2 requested but the h2 package is not installed; using HTTP/1.1")
+        self._lock = threading.Lock()
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self.metrics = ConnectionMetrics()
+
+    def _on_request(self, request: httpx.Request):
+        self.metrics.on_request()
+        started = {}
+        request.extensions["trace"] = lambda name, info: self.metrics.on_trace(name, info, started)
+
+    async def _aon_request(self, request: httpx.Request):
+        self.metrics.on_request()
+        started = {}
+
+        async def trace(name, info):
+            self.metrics.on_trace(name, info, started)
+        request.extensions["trace"] = trace
+
+    def _on_response(self, response: httpx.Response):
+        self.metrics.on_response(response.http_version, response.status_code >= 400)
+
+    async def _aon_response(self, response: httpx.Response):
+        self._on_response(response)
+
+    def get_client(self) -> httpx.Client:
+        """Shared sync client"""
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(
+                    timeout=self._timeout,
+                    transport=httpx.HTTPTransport(http2=self._http2, limits=self._limits, retries=self._transport_retries),
+                    event_hooks={"request": [self._on_request], "response": [self._on_response]},
+                )
+            return self._client
+
+    def get_async_client(self) -> httpx.AsyncClient:
+        """Shared async client; use it from the server's event loop"""
+        with self._lock:
+            if self._async_client is None:
+                self._async_client = httpx.AsyncClient(
+                    timeout=self._timeout,
+                    transport=httpx.AsyncHTTPTransport(http2=self._http2, limits=self._limits, retries=self._transport_retries),
+                    event_hooks={"request": [self._aon_request], "response": [self._aon_response]},
+                )
+            return self._async_client
+
+    async def aclose(self):
+        """Close both clients and their pooled connections"""
+        with self._lock:
+            client, async_client = self._client, self._async_client
+            self._client = self._async_client = None
+        if client is not None:
+            client.close()
+        if async_client is not None:
+            await async_client.aclose()
+
+    def get_stats(self) -> dict:
+        """Get connection reuse statistics"""
+        return {
+            "http2": self._http2,
+            "max_connections": self._limits.max_connections,
+            "max_keepalive_connections": self._limits.max_keepalive_connections,
+            "keepalive_expiry": self._limits.keepalive_expiry,
+            **self.metrics.snapshot(),
+        }
+
+
+# Global HTTP client pool for OpenAI
+openai_http = HttpClientPool(
+    max_connections=settings.OPENAI_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+    connect_timeout=settings.OPENAI_CONNECT_TIMEOUT_SECONDS,
+    timeout=settings.OPENAI_TIMEOUT_SECONDS,
+    transport_retries=settings.OPENAI_CONNECT_RETRIES,
+    http2=settings.OPENAI_HTTP2,
+)
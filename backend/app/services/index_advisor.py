@@ -0,0 +1,253 @@
+"""Offline index advisor for agent-generated SQL.
+
+Reads the structured query log, groups queries by normalized shape, ranks the
+shapes by frequency x p95 latency, runs EXPLAIN on a representative of each
+(MySQL), and proposes composite indexes: equality columns first (patient id
+leading), then one range or ORDER BY column.
+
+    cd backend
+    python -m app.services.index_advisor --log logs/query_log.jsonl --top 10
+"""
+import argparse
+import json
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import inspect
+
+from app.core.config import settings
+from app.core.database import db_manager, PATIENT_ID_COLUMNS
+from app.services.query_log import read_query_log
+from app.services.sql_guard import tokenize_sql, table_references, Token
+from app.services.sql_plan_cache import render_query
+
+EQUALITY_OPERATORS = ("=", "IN")
+RANGE_OPERATORS = ("<", ">", "<=", ">=", "BETWEEN", "LIKE")
+MAX_INDEX_COLUMNS = 4
+
+
+def summarize_shapes(entries: List[dict]) -> List[dict]:
+    """Per-shape frequency and latency, highest frequency x p95 first"""
+    groups: Dict[str, List[dict]] = defaultdict(list)
+    for entry in entries:
+        if entry.get("status") == "ok" and entry.get("latency_ms") is not None:
+            groups[entry["fingerprint"]].append(entry)
+
+    shapes = []
+    for fingerprint, group in groups.items():
+        latencies = np.array([entry["latency_ms"] for entry in group], dtype=np.float64)
+        examined = [entry["rows_examined"] for entry in group if entry.get("rows_examined") is not None]
+        representative = next((entry for entry in reversed(group) if entry.get("template")), group[-1])
+        p95 = float(np.percentile(latencies, 95))
+        shapes.append({
+            "fingerprint": fingerprint,
+            "shape": group[-1]["shape"],
+            "tables": group[-1].get("tables", []),
+            "count": len(group),
+            "mean_ms": round(float(latencies.mean()), 2),
+            "p95_ms": round(p95, 2),
+            "rows_examined": int(np.mean(examined)) if examined else None,
+            "score": round(len(group) * p95, 2),
+            "template": representative.get("template"),
+            "quote": representative.get("quote") or "",
+        })
+    return sorted(shapes, key=lambda shape: shape["score"], reverse=True)
+
+
+def predicate_columns(tokens: List[Token], aliases: Dict[str, str]) -> dict:
+    """Columns compared against literals (equality / range) and ORDER BY columns, as (table, column)"""
+    single_table = next(iter(set(aliases.values()))) if len(set(aliases.values())) == 1 else None
+
+    def column_at(index: int) -> Optional[tuple]:
+        """(table, column) for a column reference ending at tokens[index]"""
+        token = tokens[index]
+        if token.kind not in ("word", "identifier"):
+            return None
+        if index >= 2 and tokens[index - 1].value == ".":
+            table = aliases.get(tokens[index - 2].name)
+        else:
+            table = single_table
+        return (table, token.name.lower())
+
+    def is_value(token: Token) -> bool:
+        return token.kind in ("number", "string", "bind") or token.value in ("?", "(")
+
+    equality, ranges, order_by = [], [], []
+    for index, token in enumerate(tokens[:-1]):
+        operator = tokens[index + 1]
+        operator_name = operator.upper or operator.value
+        if index + 2 >= len(tokens) or not is_value(tokens[index + 2]):
+            continue
+        column = column_at(index)
+        if column is None:
+            continue
+        if operator_name in EQUALITY_OPERATORS and column not in equality:
+            equality.append(column)
+        elif operator_name in RANGE_OPERATORS and column not in ranges:
+            ranges.append(column)
+
+    for index, token in enumerate(tokens[:-1]):
+        if token.upper != "ORDER" or tokens[index + 1].upper != "BY":
+            continue
+        for position in range(index + 2, len(tokens)):
+            current = tokens[position]
+            if current.depth != token.depth or current.upper == "LIMIT":
+                break
+            following = tokens[position + 1] if position + 1 < len(tokens) else None
+            if current.upper in ("ASC", "DESC") or (following is not None and following.value == "."):
+                continue
+            column = column_at(position)
+            if column and column not in order_by:
+                order_by.append(column)
+    return {"equality": equality, "range": ranges, "order_by": order_by}
+
+
+def propose_indexes(shape: dict, table_columns: Optional[Dict[str, set]] = None) -> List[dict]:
+    """Composite index candidates for one query shape, one per table.
+
+    table_columns ({table: {column, ...}}) resolves unqualified columns in joins.
+    """
+    tokens = tokenize_sql(shape["shape"])
+    aliases = {}
+    for table, alias in table_references(tokens):
+        aliases[alias] = table
+        aliases[table] = table
+    columns = predicate_columns(tokens, aliases)
+    if table_columns:
+        for kind, items in columns.items():
+            resolved = []
+            for owner, column in items:
+                if owner is None:
+                    owner = next((table for table in dict.fromkeys(aliases.values()) if column in table_columns.get(table, ())), None)
+                resolved.append((owner, column))
+            columns[kind] = resolved
+
+    proposals = []
+    for table in dict.fromkeys(aliases.values()):
+        def on_table(items):
+            return [column for owner, column in items if owner == table]
+        equality = sorted(on_table(columns["equality"]), key=lambda column: column not in PATIENT_ID_COLUMNS)
+        trailing = (on_table(columns["range"]) or on_table(columns["order_by"]))[:1]
+        index_columns = list(dict.fromkeys(equality + trailing))[:MAX_INDEX_COLUMNS]
+        if index_columns:
+            proposals.append({"table": table, "columns": index_columns})
+    return proposals
+
+
+def inspect_table(table: str) -> dict:
+    """Lower-cased column names and index column lists (primary key included)"""
+    inspector = inspect(db_manager.get_engine())
+    columns = {column["name"].lower() for column in inspector.get_columns(table)}
+    indexes = [[column.lower() for column in index["column_names"] if column] for index in inspector.get_indexes(table)]
+    primary_key = inspector.get_pk_constraint(table).get("constrained_columns") or []
+    if primary_key:
+        indexes.append([column.lower() for column in primary_key])
+    return {"columns": columns, "indexes": indexes}
+
+
+def is_covered(columns: List[str], indexes: List[List[str]]) -> bool:
+    """An existing index already starts with the proposed columns"""
+    return any(index[:len(columns)] == columns for index in indexes)
+
+
+def explain_shape(shape: dict, patient_id: str) -> Optional[dict]:
+    """EXPLAIN estimate for the shape's logged template, bound to a sample patient"""
+    if not shape["template"]:
+        return None
+    try:
+        return db_manager.explain_query(render_query(shape["template"], patient_id, shape["quote"]))
+    except Exception as e:
+        return {"error": str(e)[:200]}
+
+
+def advise(log_path: str, top: int, patient_id: str, explain: bool = True) -> dict:
+    """Ranked shapes and index proposals, ordered by the p95 time they could save"""
+    entries = list(read_query_log(log_path))
+    shapes = summarize_shapes(entries)[:top]
+
+    tables: Dict[str, dict] = {}
+    for table in {table for shape in shapes for table in shape["tables"]}:
+        try:
+            tables[table.lower()] = inspect_table(table)
+        except Exception as e:
+            print(f"⚠️ Could not inspect table {table}: {e}")
+    table_columns = {table: info["columns"] for table, info in tables.items()}
+
+    proposals: Dict[tuple, dict] = {}
+    for shape in shapes:
+        if explain:
+            shape["explain"] = explain_shape(shape, patient_id)
+        for proposal in propose_indexes(shape, table_columns):
+            table = proposal["table"]
+            if is_covered(proposal["columns"], tables.get(table, {}).get("indexes", [])):
+                continue
+            key = (table, tuple(proposal["columns"]))
+            merged = proposals.setdefault(key, {
+                "table": table,
+                "columns": proposal["columns"],
+                "ddl": f"CREATE INDEX idx_{table}_{'_'.join(proposal['columns'])} ON {table} ({', '.join(proposal['columns'])});",
+                "shapes": [],
+                "queries": 0,
+                "score": 0.0,
+            })
+            merged["shapes"].append(shape["fingerprint"])
+            merged["queries"] += shape["count"]
+            merged["score"] = round(merged["score"] + shape["score"], 2)
+
+    # An index on (a, b) also serves queries that only need (a)
+    for key, proposal in list(proposals.items()):
+        wider = next((other for other_key, other in proposals.items() if other_key != key and other_key[0] == key[0]
+                      and list(other_key[1][:len(key[1])]) == proposal["columns"]), None)
+        if wider is not None:
+            wider["shapes"].extend(proposal["shapes"])
+            wider["queries"] += proposal["queries"]
+            wider["score"] = round(wider["score"] + proposal["score"], 2)
+            del proposals[key]
+
+    return {
+        "log": log_path,
+        "queries": len(entries),
+        "shapes": shapes,
+        "proposals": sorted(proposals.values(), key=lambda proposal: proposal["score"], reverse=True),
+    }
+
+
+def print_report(report: dict):
+    print(f"📊 {report['queries']} logged queries from {report['log']}")
+    print("\nTop query shapes (frequency x p95):")
+    for rank, shape in enumerate(report["shapes"], 1):
+        print(f"{rank:>3}. count={shape['count']} p95={shape['p95_ms']}ms mean={shape['mean_ms']}ms "
+              f"rows_examined~{shape['rows_examined']} score={shape['score']}")
+        print(f"     {shape['shape']}")
+        explain = shape.get("explain")
+        if explain and "error" in explain:
+            print(f"     EXPLAIN failed: {explain['error']}")
+        elif explain:
+            scans = f", full scan of {', '.join(explain['full_scans'])}" if explain["full_scans"] else ""
+            print(f"     EXPLAIN: ~{explain['estimated_rows']} rows examined{scans}")
+    print("\nIndex proposals:")
+    if not report["proposals"]:
+        print("  none - existing indexes already cover the logged predicates")
+    for proposal in report["proposals"]:
+        print(f"  {proposal['ddl']}  -- {len(proposal['shapes'])} shape(s), {proposal['queries']} queries, score={proposal['score']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--log", default=settings.QUERY_LOG_PATH, help="query log path")
+    parser.add_argument("--top", type=int, default=20, help="number of shapes to analyze")
+    parser.add_argument("--patient-id", default=settings.DEFAULT_PATIENT_ID, help="sample patient for EXPLAIN")
+    parser.add_argument("--no-explain", action="store_true", help="skip EXPLAIN against the database")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = advise(args.log, args.top, args.patient_id, explain=not args.no_explain)
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
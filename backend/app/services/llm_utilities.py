@@ -1,5 +1,6 @@
 import openai
 from typing import Optional
+from app.services.tracing import tracer
 
 # OpenAI Client for audio transcription
 def transcribe_audio(openai_client, audio_path: str, model: str = "whisper-1", show_debug: bool = False):
@@ -32,6 +33,42 @@ def transcribe_audio(openai_client, audio_path: str, model: str = "whisper-1", s
         print(f"Error transcribing audio with OpenAI: {str(e)}")
         return "Error: Could not transcribe audio"
 
+async def atranscribe_audio(async_openai_client, audio_file, filename: str, content_type: str = "audio/wav",
+                            model: str = "whisper-1", show_debug: bool = False):
+    """
+    Transcribe in-memory audio to text using OpenAI Whisper, without a temp file.
+    
+    Parameters:
+    - async_openai_client: AsyncOpenAI client instance
+    - audio_file: File-like object (e.g. BytesIO) holding the audio
+    - filename: Original filename; Whisper uses its extension to detect the format
+    - content_type: MIME type of the upload
+    - model: Whisper model to use (default: "whisper-1")
+    - show_debug: Whether to show debug information
+    
+    Returns:
+    - Transcribed text
+    """
+    audio_bytes = audio_file.getbuffer().nbytes if hasattr(audio_file, "getbuffer") else None
+    with tracer.span("whisper.transcribe", model=model, content_type=content_type, bytes=audio_bytes) as span:
+        try:
+            transcript = await async_openai_client.audio.transcriptions.create(
+                model=model,
+                file=(filename, audio_file, content_type),
+                response_format="text"
+            )
+            
+            if show_debug:
+                print(f"Transcription result: {transcript}")
+            
+            span.set_attribute("transcript_chars", len(transcript))
+            return transcript
+        
+        except Exception as e:
+            span.record_error(e)
+            print(f"Error transcribing audio with OpenAI: {str(e)}")
+            return "Error: Could not transcribe audio"
+
 def synthesize_speech(polly_client, text, voice_id="Ruth", engine="neural", output_format="mp3", text_type="text"):
     """
     Synthesize speech using Amazon Polly and return the audio stream.
@@ -46,18 +83,22 @@ def synthesize_speech(polly_client, text, voice_id="Ruth", engine="neural", outp
     Returns:
     - Audio stream
     """
-    try:
-        response = polly_client.synthesize_speech(
-            Text=text,
-            VoiceId=voice_id,
-            Engine=engine,
-            OutputFormat=output_format,
-            TextType=text_type
-        )
-        return response['AudioStream'].read()
-    except Exception as e:
-        print(f"Error synthesizing speech: {str(e)}")
-        return None
+    with tracer.span("polly.synthesize", voice=voice_id, engine=engine, chars=len(text)) as span:
+        try:
+            response = polly_client.synthesize_speech(
+                Text=text,
+                VoiceId=voice_id,
+                Engine=engine,
+                OutputFormat=output_format,
+                TextType=text_type
+            )
+            audio = response['AudioStream'].read()
+            span.set_attribute("bytes", len(audio))
+            return audio
+        except Exception as e:
+            span.record_error(e)
+            print(f"Error synthesizing speech: {str(e)}")
+            return None
 
 def save_audio_file(audio_data, file_path):
     """
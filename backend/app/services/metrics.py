@@ -0,0 +1,154 @@
+import abc
+import bisect
+import threading
+from typing import Dict, List, Tuple
+
+# Latency buckets in seconds, from cache hits to slow LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def escape_label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(abc.ABC):
+    """Labelled metric family rendered in the Prometheus text format"""
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """Sample lines for every label set"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+                    for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (non-cumulative, last is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = f'le="{format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(round(total, 6))}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metric families exposed together on /metrics"""
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+# Global registry and the application's metrics
+metrics_registry = MetricsRegistry()
+
+http_request_duration = metrics_registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency, until the response body is sent",
+    ("method", "route", "status"),
+))
+http_requests_in_flight = metrics_registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests being served", ("method",),
+))
+http_request_errors = metrics_registry.register(Counter(
+    "http_request_errors_total", "HTTP requests that failed with a 5xx status or an exception", ("route",),
+))
+span_duration = metrics_registry.register(Histogram(
+    "span_duration_seconds", "Duration of traced operations (graph nodes, LLM, DB, Polly, Whisper)", ("span",),
+))
+spans_in_flight = metrics_registry.register(Gauge(
+    "spans_in_flight", "Traced operations currently running", ("span",),
+))
+span_errors = metrics_registry.register(Counter(
+    "span_errors_total", "Traced operations that raised an exception", ("span",),
+))
@@ -0,0 +1,334 @@
+import datetime
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import db_manager, schema_cache, get_patient_data_version
+from app.core.query_result import (
+    QueryResult, TYPE_BOOLEAN, TYPE_DATE, TYPE_DATETIME, TYPE_DECIMAL, TYPE_FLOAT, TYPE_INTEGER,
+)
+from app.services.sql_guard import SqlGuard, tokenize_sql, referenced_tables
+
+# Declared column types for the snapshot tables; the two date types are converted back on read.
+# Text compares case-insensitively, like MySQL's default collation.
+SNAPSHOT_COLUMN_TYPES = {
+    TYPE_INTEGER: "INTEGER",
+    TYPE_BOOLEAN: "INTEGER",
+    TYPE_FLOAT: "REAL",
+    TYPE_DECIMAL: "REAL",
+    TYPE_DATE: "SNAPSHOT_DATE",
+    TYPE_DATETIME: "SNAPSHOT_DATETIME",
+}
+sqlite3.register_converter("SNAPSHOT_DATE", lambda value: datetime.date.fromisoformat(value.decode()))
+sqlite3.register_converter("SNAPSHOT_DATETIME", lambda value: datetime.datetime.fromisoformat(value.decode()))
+
+# MySQL DATE_FORMAT specifiers that differ from strftime
+MYSQL_DATE_FORMAT = {"%i": "%M", "%s": "%S", "%M": "%B", "%W": "%A", "%h": "%I", "%e": "%-d", "%c": "%-m", "%T": "%H:%M:%S"}
+
+
+def to_sqlite_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    return str(value)
+
+
+def parse_temporal(value) -> Optional[datetime.datetime]:
+    if value is None:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def mysql_date_format(value, fmt):
+    moment = parse_temporal(value)
+    if moment is None or fmt is None:
+        return None
+    for mysql_code, strftime_code in MYSQL_DATE_FORMAT.items():
+        fmt = fmt.replace(mysql_code, strftime_code)
+    return moment.strftime(fmt)
+
+
+def mysql_datediff(first, second):
+    first, second = parse_temporal(first), parse_temporal(second)
+    if first is None or second is None:
+        return None
+    return (first.date() - second.date()).days
+
+
+def register_mysql_functions(connection: sqlite3.Connection):
+    """Common MySQL functions the LLM writes, so its SQL runs unchanged on the snapshot"""
+    def date_part(part):
+        def extract(value):
+            moment = parse_temporal(value)
+            return getattr(moment, part) if moment else None
+        return extract
+
+    functions = {
+        "CONCAT": (-1, lambda *args: None if None in args else "".join(str(arg) for arg in args)),
+        "CONCAT_WS": (-1, lambda separator, *args: str(separator).join(str(arg) for arg in args if arg is not None)),
+        "IF": (3, lambda condition, when_true, when_false: when_true if condition else when_false),
+        "YEAR": (1, date_part("year")),
+        "MONTH": (1, date_part("month")),
+        "DAY": (1, date_part("day")),
+        "DATEDIFF": (2, mysql_datediff),
+        "DATE_FORMAT": (2, mysql_date_format),
+        "CURDATE": (0, lambda: datetime.date.today().isoformat()),
+        "NOW": (0, lambda: datetime.datetime.now().isoformat(sep=" ", timespec="seconds")),
+    }
+    for name, (arg_count, function) in functions.items():
+        connection.create_function(name, arg_count, function, deterministic=name not in ("CURDATE", "NOW"))
+
+
+class PatientSnapshot:
+    """One patient's rows from every patient table, in a private in-memory SQLite database"""
+
+    def __init__(self, patient_id: str, version: str, tables: Dict[str, QueryResult]):
+        self.patient_id = patient_id
+        self.version = version
+        self.checked_at = time.time()
+        self.row_count = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(":memory:", check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        register_mysql_functions(self._connection)
+        for table_name, result in tables.items():
+            self._load_table(table_name, result)
+        page_count = self._connection.execute("PRAGMA page_count").fetchone()[0]
+        page_size = self._connection.execute("PRAGMA page_size").fetchone()[0]
+        self.nbytes = page_count * page_size
+
+    def _load_table(self, table_name: str, result: QueryResult):
+        def quote(name):
+            return '"' + name.replace('"', '""') + '"'
+        column_sql = ", ".join(
+            f"{quote(name)} {SNAPSHOT_COLUMN_TYPES.get(column_type, 'TEXT COLLATE NOCASE')}"
+            for name, column_type in zip(result.columns, result.column_types)
+        )
+        self._connection.execute(f"CREATE TABLE {quote(table_name)} ({column_sql})")
+        if result.row_count:
+            placeholders = ", ".join("?" for _ in result.columns)
+            rows = ([to_sqlite_value(value) for value in row] for row in result.iter_rows())
+            self._connection.executemany(f"INSERT INTO {quote(table_name)} VALUES ({placeholders})", rows)
+        self.row_count += result.row_count
+
+    def execute(self, query: str, max_rows: int) -> QueryResult:
+        """Run a read query against the snapshot; raises sqlite3.Error on SQL it can't run"""
+        with self._lock:
+            cursor = self._connection.execute(query)
+            try:
+                columns = [description[0] for description in cursor.description or []]
+                rows = cursor.fetchmany(max_rows + 1)
+            finally:
+                cursor.close()
+        truncated = len(rows) > max_rows
+        query_result = QueryResult.from_rows(columns, rows[:max_rows])
+        if truncated:
+            query_result.truncated = True
+            query_result.truncation_reason = f"row limit of {max_rows} reached"
+        return query_result
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class PatientSnapshotStore:
+    """Per-patient snapshots for follow-up questions, LRU-evicted by memory budget.
+
+    A patient's snapshot is loaded on the first query that only touches patient
+    tables and filters on that patient. Later queries run in-process instead of
+    on MySQL. The data version (see get_patient_data_version) is re-checked at
+    most every version_check_seconds and the snapshot is reloaded when it moves.
+    SQL the snapshot can't run (MySQL-only syntax) falls back to the database;
+    SQL it runs differently (integer division) is why the mode is opt-in.
+    """
+
+    def __init__(self, max_bytes: int, max_rows: int, version_check_seconds: int):
+        self._max_bytes = max_bytes
+        self._max_rows = max_rows
+        self._version_check_seconds = version_check_seconds
+        self._lock = threading.Lock()
+        # patient_id -> [load lock, requests holding or waiting for it]; dropped when unused
+        self._load_locks: Dict[str, list] = {}
+        self._snapshots: "OrderedDict[str, PatientSnapshot]" = OrderedDict()
+        self._bytes = 0
+        # Patients too large to snapshot: (data version that was too large, checked_at); guarded by _lock
+        self._oversized: Dict[str, tuple] = {}
+        self._hits = 0
+        self._fallbacks = 0
+        self._bypassed = 0
+        self._loads = 0
+        self._load_seconds = 0.0
+        self._invalidations = 0
+        self._evictions = 0
+
+    def execute(self, query: str, patient_id: str) -> Optional[QueryResult]:
+        """Result from the patient's snapshot, or None when the query must go to the database"""
+        patient_id = str(patient_id)
+        tokens = tokenize_sql(query)
+        patient_tables = {table.lower() for table in schema_cache.get_patient_tables()}
+        tables = referenced_tables(tokens)
+        # The snapshot only holds this patient's rows, so anything else must see the real tables
+        if not tables or any(table.lower() not in patient_tables for table in tables) \
+                or SqlGuard.check_patient_filter(tokens, patient_id):
+            with self._lock:
+                self._bypassed += 1
+            return None
+
+        snapshot = self._get_snapshot(patient_id)
+        if snapshot is None:
+            return None
+        try:
+            query_result = snapshot.execute(query, settings.QUERY_MAX_ROWS)
+        except sqlite3.Error as e:
+            print(f"↪️ Snapshot can't run query ({e}), using the database")
+            with self._lock:
+                self._fallbacks += 1
+            return None
+        with self._lock:
+            self._hits += 1
+        return query_result
+
+    @contextmanager
+    def _load_lock(self, patient_id: str):
+        """One load (or version check) per patient at a time; the lock lives only while in use"""
+        with self._lock:
+            entry = self._load_locks.setdefault(patient_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._load_locks[patient_id]
+
+    def _mark_oversized(self, patient_id: str, version: str):
+        with self._lock:
+            self._oversized[patient_id] = (version, time.time())
+
+    def _get_snapshot(self, patient_id: str) -> Optional[PatientSnapshot]:
+        with self._lock:
+            snapshot = self._snapshots.get(patient_id)
+            if snapshot is not None:
+                self._snapshots.move_to_end(patient_id)
+            oversized = self._oversized.get(patient_id)
+
+        if snapshot is not None and time.time() - snapshot.checked_at < self._version_check_seconds:
+            return snapshot
+        if snapshot is None and oversized and time.time() - oversized[1] < self._version_check_seconds:
+            return None
+
+        # Other requests for the same patient wait for this load
+        with self._load_lock(patient_id):
+            with self._lock:
+                current = self._snapshots.get(patient_id)
+            if current is not None and current is not snapshot:
+                return current
+            try:
+                version = get_patient_data_version(patient_id)
+            except Exception as e:
+                print(f"⚠️ Could not compute data version for patient {patient_id}: {e}")
+                return None
+            if snapshot is not None:
+                if snapshot.version == version:
+                    snapshot.checked_at = time.time()
+                    return snapshot
+                print(f"🔄 Data changed for patient {patient_id}, reloading snapshot")
+                self.invalidate(patient_id)
+                with self._lock:
+                    self._invalidations += 1
+            if oversized and oversized[0] == version:
+                self._mark_oversized(patient_id, version)
+                return None
+            return self._load(patient_id, version)
+
+    def _load(self, patient_id: str, version: str) -> Optional[PatientSnapshot]:
+        start = time.time()
+        engine = db_manager.get_engine()
+        preparer = engine.dialect.identifier_preparer
+        tables: Dict[str, QueryResult] = {}
+        row_count = 0
+        try:
+            for table_name, patient_column in schema_cache.get_patient_tables().items():
+                query = text(f"SELECT * FROM {preparer.quote(table_name)} WHERE {preparer.quote(patient_column)} = :patient_id")
+                # Primary, not a replica: the rows must match the version just computed there
+                result = db_manager.execute_query(query, {"patient_id": patient_id}, max_rows=self._max_rows + 1)
+                row_count += result.row_count
+                if result.truncated or row_count > self._max_rows:
+                    print(f"⚠️ Patient {patient_id} has over {self._max_rows} rows, not snapshotting")
+                    self._mark_oversized(patient_id, version)
+                    return None
+                tables[table_name] = result
+            snapshot = PatientSnapshot(patient_id, version, tables)
+        except Exception as e:
+            print(f"❌ Could not load snapshot for patient {patient_id}: {e}")
+            return None
+
+        if snapshot.nbytes > self._max_bytes:
+            snapshot.close()
+            self._mark_oversized(patient_id, version)
+            return None
+
+        elapsed = time.time() - start
+        with self._lock:
+            self._snapshots[patient_id] = snapshot
+            self._bytes += snapshot.nbytes
+            self._loads += 1
+            self._load_seconds += elapsed
+            self._oversized.pop(patient_id, None)
+            while self._bytes > self._max_bytes and len(self._snapshots) > 1:
+                _, evicted = self._snapshots.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self._evictions += 1
+                evicted.close()
+        print(f"📸 Loaded snapshot for patient {patient_id}: {snapshot.row_count} rows, "
+              f"{snapshot.nbytes} bytes in {elapsed*1000:.0f}ms")
+        return snapshot
+
+    def invalidate(self, patient_id: Optional[str] = None):
+        """Drop one patient's snapshot, or all of them"""
+        with self._lock:
+            patient_ids = [str(patient_id)] if patient_id is not None else list(self._snapshots)
+            for key in patient_ids:
+                snapshot = self._snapshots.pop(key, None)
+                if snapshot is not None:
+                    self._bytes -= snapshot.nbytes
+                    snapshot.close()
+
+    def get_stats(self) -> dict:
+        """Get snapshot hit/fallback statistics"""
+        with self._lock:
+            return {
+                "snapshots": len(self._snapshots),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+                "hits": self._hits,
+                "fallbacks": self._fallbacks,
+                "bypassed": self._bypassed,
+                "loads": self._loads,
+                "avg_load_ms": round(self._load_seconds / self._loads * 1000, 1) if self._loads else 0.0,
+                "invalidations": self._invalidations,
+                "evictions": self._evictions,
+                "oversized_patients": len(self._oversized),
+            }
+
+
+# Global patient snapshot store
+patient_snapshots = PatientSnapshotStore(
+    max_bytes=settings.PATIENT_SNAPSHOT_MAX_BYTES,
+    max_rows=settings.PATIENT_SNAPSHOT_MAX_ROWS,
+    version_check_seconds=settings.PATIENT_SNAPSHOT_VERSION_CHECK_SECONDS,
+)
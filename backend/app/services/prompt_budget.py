@@ -0,0 +1,215 @@
+import re
+import threading
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.core.database import PATIENT_ID_COLUMNS
+
+# Chat format overhead per message (role and separators), as in OpenAI's token counting guide
+TOKENS_PER_MESSAGE = 4
+# Fallback estimate when no tokenizer is available
+CHARS_PER_TOKEN = 4
+MAX_SAMPLE_VALUE_LENGTH = 30
+# Columns a budget trim never drops: keys and dates, and the clinical findings answers are built from
+KEY_COLUMN_PATTERN = re.compile(r"(^id$|_id$|date|time|_at$|status|type|name)", re.IGNORECASE)
+CLINICAL_COLUMN_PATTERN = re.compile(
+    r"(diagnos|stage|grade|specimen|result|finding|dosage|dose|drug|medication|procedure)", re.IGNORECASE
+)
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class TokenCounter:
+    """Token counts with tiktoken, falling back to a character estimate.
+
+    The encoding is loaded once on first use; tiktoken fetches it from the
+    network the first time, so offline hosts use the estimate instead (or set
+    use_tiktoken=False to never try).
+    """
+
+    def __init__(self, model: str, use_tiktoken: bool = True):
+        self._model = model
+        self._lock = threading.Lock()
+        self._encoding = None
+        self._loaded = not use_tiktoken
+
+    def _get_encoding(self):
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                try:
+                    import tiktoken
+                    try:
+                        self._encoding = tiktoken.encoding_for_model(self._model)
+                    except KeyError:
+                        self._encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    print(f"⚠️ tiktoken unavailable ({type(e).__name__}), estimating tokens from length")
+            return self._encoding
+
+    @property
+    def exact(self) -> bool:
+        return self._get_encoding() is not None
+
+    @property
+    def encoding(self):
+        """tiktoken encoding, or None when estimating from length"""
+        return self._get_encoding()
+
+    def count(self, text: str) -> int:
+        encoding = self._get_encoding()
+        if encoding is None:
+            return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def count_messages(self, messages: List) -> int:
+        """Prompt tokens for chat messages (dicts or LangChain messages)"""
+        total = 3  # every reply is primed with <|start|>assistant<|message|>
+        for message in messages:
+            content = message["content"] if isinstance(message, dict) else message.content
+            total += TOKENS_PER_MESSAGE + self.count(content if isinstance(content, str) else str(content))
+        return total
+
+
+def parse_node_budgets(raw: str) -> Dict[str, int]:
+    """Parse "generate_query:2500,format_query_results:4000" into {node: tokens}"""
+    budgets = {}
+    for item in raw.split(","):
+        if ":" in item:
+            node, tokens = item.split(":", 1)
+            budgets[node.strip()] = int(tokens)
+    return budgets
+
+
+def parse_sample_rows(table_info: str) -> Dict[str, Dict[str, str]]:
+    """First sample value per column from the "/* 3 rows from t table: ... */" blocks of table_info"""
+    samples: Dict[str, Dict[str, str]] = {}
+    for match in re.finditer(r"/\*\s*\n\s*\d+ rows from (\S+) table:\n(.*?)\*/", table_info, re.DOTALL):
+        table_name = match.group(1)
+        lines = [line for line in match.group(2).splitlines() if line.strip()]
+        if len(lines) < 2:
+            continue
+        header = lines[0].split("\t")
+        values: Dict[str, str] = {}
+        for line in lines[1:]:
+            for column, value in zip(header, line.split("\t")):
+                if column not in values and value not in ("", "None"):
+                    values[column] = value[:MAX_SAMPLE_VALUE_LENGTH]
+        samples[table_name] = values
+    return samples
+
+
+def select_essential_columns(columns: List[dict], question: str) -> List[str]:
+    """Columns a budget trim must keep: keys, dates, clinical findings and any the question mentions"""
+    words = set(WORD_PATTERN.findall(question.lower()))
+    # Singular forms too, so "treatments" matches a "treatment" column
+    words |= {word[:-1] for word in words if word.endswith("s")}
+    return [
+        column["name"] for column in columns
+        if column["name"].lower() in PATIENT_ID_COLUMNS
+        or KEY_COLUMN_PATTERN.search(column["name"])
+        or CLINICAL_COLUMN_PATTERN.search(column["name"])
+        or words & set(WORD_PATTERN.findall(column["name"].lower().replace("_", " ")))
+    ]
+
+
+def render_compact_schema(table_schemas: Dict[str, List[dict]], kept_columns: Optional[Dict[str, List[str]]] = None,
+                          include_samples: bool = True) -> str:
+    """One line per table: name(column TYPE e.g. 'value', ...); every column unless kept_columns narrows it"""
+    lines = []
+    for table_name, columns in table_schemas.items():
+        keep = (kept_columns or {}).get(table_name)
+        parts = []
+        for column in columns:
+            if keep is not None and column["name"] not in keep:
+                continue
+            part = f"{column['name']} {column['type'].split('(')[0].upper()}"
+            sample = column.get("sample")
+            if include_samples and sample is not None:
+                part += f" e.g. {sample!r}"
+            parts.append(part)
+        omitted = len(columns) - len(parts)
+        suffix = f", +{omitted} more" if omitted else ""
+        lines.append(f"{table_name}({', '.join(parts)}{suffix})")
+    return "\n".join(lines)
+
+
+def fit_schema_to_budget(table_schemas: Dict[str, List[dict]], essential_columns: Dict[str, List[str]],
+                         budget: int, counter: TokenCounter) -> tuple:
+    """Compact schema text within budget tokens.
+
+    Every column is kept while the schema fits. Over budget, sample values go
+    first, then the last non-essential columns of the widest tables; essential
+    columns are never dropped, so the text can stay over budget.
+    Returns (schema_text, columns kept per table).
+    """
+    kept_columns = {table: [column["name"] for column in columns] for table, columns in table_schemas.items()}
+    schema_text = render_compact_schema(table_schemas)
+    if counter.count(schema_text) <= budget:
+        return schema_text, kept_columns
+    schema_text = render_compact_schema(table_schemas, include_samples=False)
+    while counter.count(schema_text) > budget:
+        trimmable = {
+            table: [column for column in columns if column not in essential_columns.get(table, ())]
+            for table, columns in kept_columns.items()
+        }
+        widest = max(trimmable, key=lambda table: len(trimmable[table]), default=None)
+        if widest is None or not trimmable[widest]:
+            break
+        kept_columns[widest].remove(trimmable[widest][-1])
+        schema_text = render_compact_schema(table_schemas, kept_columns, include_samples=False)
+    return schema_text, kept_columns
+
+
+def truncate_to_budget(text: str, budget: int, counter: TokenCounter) -> str:
+    """Text cut to at most budget tokens (the head is kept)"""
+    if budget <= 0:
+        return ""
+    if counter.count(text) <= budget:
+        return text
+    encoding = counter.encoding
+    if encoding is None:
+        return text[:budget * CHARS_PER_TOKEN]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:budget])
+
+
+class PromptStats:
+    """Measured prompt tokens per graph node"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nodes: Dict[str, dict] = {}
+
+    def measure(self, node: str, messages: List, trimmed: bool = False, saved_tokens: int = 0) -> int:
+        """Count, log and record the prompt a node is about to send"""
+        tokens = token_counter.count_messages(messages)
+        self.record(node, tokens, node_token_budgets.get(node), trimmed, saved_tokens)
+        return tokens
+
+    def record(self, node: str, tokens: int, budget: Optional[int], trimmed: bool, saved_tokens: int = 0):
+        with self._lock:
+            stats = self._nodes.setdefault(node, {"calls": 0, "tokens": 0, "max_tokens": 0, "trimmed": 0, "saved_tokens": 0})
+            stats["calls"] += 1
+            stats["tokens"] += tokens
+            stats["max_tokens"] = max(stats["max_tokens"], tokens)
+            stats["trimmed"] += int(trimmed)
+            stats["saved_tokens"] += saved_tokens
+        over = f" over budget {budget}" if budget and tokens > budget else ""
+        print(f"🧮 {node} prompt: {tokens} tokens{f' (budget {budget})' if budget else ''}{over}"
+              f"{f', saved {saved_tokens}' if saved_tokens else ''}")
+
+    def get_stats(self) -> dict:
+        """Average and max prompt tokens per node"""
+        with self._lock:
+            return {
+                "exact_counts": token_counter.exact,
+                "nodes": {
+                    node: {**stats, "avg_tokens": round(stats["tokens"] / stats["calls"]) if stats["calls"] else 0}
+                    for node, stats in self._nodes.items()
+                },
+            }
+
+
+# Global token counter, node budgets and prompt statistics
+token_counter = TokenCounter(settings.OPENAI_MODEL, use_tiktoken=settings.TIKTOKEN_ENABLED)
+node_token_budgets = parse_node_budgets(settings.PROMPT_TOKEN_BUDGETS)
+prompt_stats = PromptStats()
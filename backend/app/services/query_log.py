@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Iterator, List, Optional
+
+from app.core.config import settings
+from app.services.sql_guard import tokenize_sql, referenced_tables
+from app.services.sql_plan_cache import parameterize_query
+
+LITERAL_KINDS = ("number", "string", "bind")
+
+
+def normalize_query_shape(query: str) -> str:
+    """Query with literals replaced by ? and IN lists collapsed, so equivalent queries group together.
+
+    Comments (including optimizer hints) and whitespace differences are dropped.
+    """
+    parts: List[str] = []
+    tokens = tokenize_sql(query.strip().rstrip(";"))
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if token.kind in LITERAL_KINDS:
+            parts.append("?")
+        elif token.upper == "IN" and index + 1 < len(tokens) and tokens[index + 1].value == "(":
+            # IN (1, 2, 3) and IN (4) are the same shape
+            close = index + 2
+            while close < len(tokens) and tokens[close].depth > token.depth:
+                close += 1
+            inner = tokens[index + 2:close]
+            if inner and all(t.kind in LITERAL_KINDS or t.value == "," for t in inner):
+                parts.append("in (?)")
+                index = close + 1
+                continue
+            parts.append("in")
+        elif token.kind == "word":
+            parts.append(token.value.lower())
+        else:
+            parts.append(token.name.lower() if token.kind == "identifier" else token.value)
+        index += 1
+    return " ".join(parts).replace(" . ", ".").replace("( ", "(").replace(" )", ")").replace(" ,", ",")
+
+
+def query_fingerprint(shape: str) -> str:
+    return hashlib.sha1(shape.encode("utf-8")).hexdigest()[:16]
+
+
+class QueryLog:
+    """Append-only JSON Lines log of executed agent SQL.
+
+    Each line holds the normalized shape, a patient-free template (the patient
+    id bound as :patient_id, as in the SQL plan cache), latency, rows returned
+    and the guard's EXPLAIN estimate of rows examined. The file rotates to
+    <path>.1 at max_bytes. Read offline by app.services.index_advisor.
+    """
+
+    def __init__(self, path: Optional[str], max_bytes: int):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._written = 0
+        self._write_errors = 0
+        self._rotations = 0
+        self._shape_counts = Counter()
+
+    def record(self, query: str, patient_id: str, latency_ms: float, rows_returned: int,
+               rows_examined: Optional[int] = None, source: str = "llm", error: Optional[str] = None,
+               truncated: bool = False):
+        """Write one executed query to the log"""
+        if not self._path:
+            return
+        shape = normalize_query_shape(query)
+        plan = parameterize_query(query, patient_id)
+        entry = {
+            "ts": round(time.time(), 3),
+            "fingerprint": query_fingerprint(shape),
+            "shape": shape,
+            "template": plan["template"] if plan else None,
+            "quote": plan["quote"] if plan else None,
+            "tables": sorted(set(referenced_tables(tokenize_sql(query)))),
+            "latency_ms": round(latency_ms, 2),
+            "rows_returned": rows_returned,
+            "rows_examined": rows_examined,
+            "truncated": truncated,
+            "source": source,
+            "status": "error" if error else "ok",
+            "error": error[:300] if error else None,
+        }
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock:
+            try:
+                directory = os.path.dirname(self._path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                if self._max_bytes and os.path.exists(self._path) and os.path.getsize(self._path) >= self._max_bytes:
+                    os.replace(self._path, f"{self._path}.1")
+                    self._rotations += 1
+                with open(self._path, "a", encoding="utf-8") as file:
+                    file.write(line)
+            except OSError as e:
+                self._write_errors += 1
+                print(f"⚠️ Could not write query log {self._path}: {e}")
+                return
+            self._written += 1
+            self._shape_counts[entry["fingerprint"]] += 1
+
+    def get_stats(self) -> dict:
+        """Get query log statistics"""
+        with self._lock:
+            return {
+                "path": self._path,
+                "written": self._written,
+                "write_errors": self._write_errors,
+                "rotations": self._rotations,
+                "distinct_shapes": len(self._shape_counts),
+            }
+
+
+def read_query_log(path: str) -> Iterator[dict]:
+    """Entries from a query log and its rotated predecessor, oldest first; bad lines are skipped"""
+    for candidate in (f"{path}.1", path):
+        if not os.path.exists(candidate):
+            continue
+        with open(candidate, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+# Global query log instance
+query_log = QueryLog(
+    path=settings.QUERY_LOG_PATH if settings.QUERY_LOG_ENABLED else None,
+    max_bytes=settings.QUERY_LOG_MAX_BYTES,
+)
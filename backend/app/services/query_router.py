@@ -0,0 +1,203 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+# Routes understood by the agent graph
+ROUTE_GREETING = "greeting"
+ROUTE_PATIENT_DATA = "list_tables"
+ROUTE_OTHER = "other"
+
+# Small-talk intents that get a canned reply instead of an LLM call
+CANNED_REPLIES = {
+    "greeting": "Hello! I help with patient data analysis. Try asking about patient {patient_id}'s treatment history!",
+    "farewell": "Goodbye! Feel free to return for patient data help anytime.",
+    "thanks": "You're welcome! I'm here whenever you need patient data.",
+    "wellbeing": "I'm doing well, thanks! Ready to help with patient {patient_id}'s records.",
+    "help": "I'm your Health Informatics AI. I can analyze patient records, treatments, and lab results. What would you like to know?",
+}
+
+# Keyword/regex rules, checked in order. Patient data wins over small talk ("hi, show treatments").
+# Whole clinical words and stems only: these leave little doubt the question is about patient data
+PATIENT_DATA_PATTERN = re.compile(
+    r"\b(patients?|treatments?|treated|medications?|medicines?|meds|drugs?|therap(y|ies)|chemo\w*|radiotherapy|"
+    r"surger(y|ies)|surgical|pathology|labs?|biops(y|ies)|diagnos(is|es|ed)|tumou?rs?|cancers?|carcinomas?|"
+    r"oncology|prescri(bed|ptions?)|allerg(y|ies|ic)|dos(e|es|age|ages)|symptoms?|specimens?|vitals|"
+    r"admissions?|admitted|discharged?|dob|date of birth|demographics?)\b",
+    re.IGNORECASE,
+)
+# Words that also turn up outside health records ("history of rome", "age of the universe"):
+# not enough on their own, the model has to agree
+AMBIGUOUS_DATA_PATTERN = re.compile(
+    r"\b(reports?|results?|records?|history|stage|grade|age|gender|sex|birth|registrations?|registered|"
+    r"contact|address|phone|email|visits?|conditions?|clinical|medical|health)\b",
+    re.IGNORECASE,
+)
+# Below any sensible QUERY_ROUTER_CONFIDENCE, so the LLM makes the call
+AMBIGUOUS_CONFIDENCE = 0.5
+SMALL_TALK_PATTERNS = [
+    ("farewell", re.compile(r"^(good\s?bye|bye|see you|see ya|good night|take care|later|cya)\b", re.IGNORECASE)),
+    ("greeting", re.compile(r"^(hi|hello|hey|hiya|howdy|greetings|good (morning|afternoon|evening|day))\b", re.IGNORECASE)),
+    ("thanks", re.compile(r"^(thanks|thank you|thx|ty|much appreciated|appreciate it|cheers)\b", re.IGNORECASE)),
+    ("wellbeing", re.compile(r"^how (are|r) (you|u)|^how'?s it going|^what'?s up", re.IGNORECASE)),
+    ("help", re.compile(r"^(help|what can you do|who are you|what are you|what do you do|how do (i|you) use)\b", re.IGNORECASE)),
+]
+# Small talk only counts as such when the message is short
+SMALL_TALK_MAX_WORDS = 8
+
+# Seed examples for the naive Bayes fallback, labelled by intent
+TRAINING_EXAMPLES = {
+    "greeting": [
+        "hello", "hi there", "hey", "good morning", "good afternoon", "good evening",
+        "hello assistant", "hi how is it going", "greetings", "hey there doc",
+    ],
+    "farewell": [
+        "goodbye", "bye", "see you later", "talk to you later", "good night",
+        "that is all for now", "i am done", "bye for now", "catch you later", "have a nice day",
+    ],
+    "thanks": [
+        "thanks", "thank you", "thank you so much", "appreciate it", "great thanks",
+        "perfect thanks", "awesome thank you", "that helps thanks", "nice work", "cheers",
+    ],
+    "wellbeing": [
+        "how are you", "how are you doing", "how is your day", "are you ok",
+        "how have you been", "how are things", "you doing well",
+    ],
+    "help": [
+        "what can you do", "who are you", "help", "how do i use this", "what are your capabilities",
+        "what kind of questions can i ask", "what do you know", "how does this work",
+        "what features do you have", "can you help me",
+    ],
+    "patient_data": [
+        "show me the treatment history", "what are the pathology results", "get patient registration details",
+        "what medications is the patient taking", "show recent lab results", "list all treatments",
+        "when was the last chemotherapy", "what is the diagnosis", "show the contact information",
+        "what is the patient's date of birth", "latest pathology report", "how many treatments did the patient have",
+        "show the tumour grade and stage", "which drugs were prescribed", "when did treatment start",
+        "summarize the patient's records", "what surgeries has the patient had", "give me the registration date",
+    ],
+    "other": [
+        "what is the weather today", "tell me a joke", "write a poem", "what is the capital of france",
+        "who won the game last night", "translate this to spanish", "what is the stock price",
+        "recommend a movie", "what time is it", "how do i cook pasta", "explain quantum physics",
+        "book a flight to toronto",
+    ],
+}
+
+INTENT_TO_ROUTE = {
+    "greeting": ROUTE_GREETING,
+    "farewell": ROUTE_GREETING,
+    "thanks": ROUTE_GREETING,
+    "wellbeing": ROUTE_GREETING,
+    "help": ROUTE_GREETING,
+    "patient_data": ROUTE_PATIENT_DATA,
+    "other": ROUTE_OTHER,
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z']+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class NaiveBayesIntentModel:
+    """Multinomial naive Bayes over word unigrams and bigrams; trains in well under a millisecond"""
+
+    def __init__(self, examples: Dict[str, List[str]], alpha: float = 0.5):
+        self.alpha = alpha
+        self.labels = list(examples)
+        self.vocabulary = set()
+        self.word_counts: Dict[str, Counter] = {}
+        self.total_counts: Dict[str, int] = {}
+        total_examples = sum(len(texts) for texts in examples.values())
+        self.log_priors = {}
+        for label, texts in examples.items():
+            counts = Counter()
+            for text in texts:
+                counts.update(self._features(text))
+            self.word_counts[label] = counts
+            self.total_counts[label] = sum(counts.values())
+            self.vocabulary.update(counts)
+            self.log_priors[label] = math.log(len(texts) / total_examples)
+
+    @staticmethod
+    def _features(text: str) -> List[str]:
+        tokens = tokenize(text)
+        return tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+
+    def predict(self, text: str) -> Dict[str, float]:
+        """Posterior probability per label"""
+        features = [f for f in self._features(text) if f in self.vocabulary]
+        vocabulary_size = len(self.vocabulary)
+        scores = {}
+        for label in self.labels:
+            denominator = self.total_counts[label] + self.alpha * vocabulary_size
+            counts = self.word_counts[label]
+            scores[label] = self.log_priors[label] + sum(
+                math.log((counts[f] + self.alpha) / denominator) for f in features
+            )
+        best = max(scores.values())
+        exp_scores = {label: math.exp(score - best) for label, score in scores.items()}
+        total = sum(exp_scores.values())
+        return {label: value / total for label, value in exp_scores.items()}
+
+
+class QueryRouter:
+    """Local classifier for the determine_query_type step.
+
+    Keyword/regex rules catch the common cases; a tiny naive Bayes model scores
+    the rest, and words that only might mean patient data are left to it.
+    Callers fall back to the LLM when the confidence is low.
+    """
+
+    def __init__(self):
+        self.model = NaiveBayesIntentModel(TRAINING_EXAMPLES)
+
+    def classify(self, query: str) -> dict:
+        """Return route, intent, confidence and which stage decided"""
+        text = query.strip()
+        word_count = len(tokenize(text))
+
+        if PATIENT_DATA_PATTERN.search(text):
+            # Clinical words in an otherwise off-topic question ("history of medicine") are mixed signals
+            probabilities = self.model.predict(text)
+            if max(probabilities, key=probabilities.get) == "other":
+                return self._decision("patient_data", AMBIGUOUS_CONFIDENCE, "rules")
+            return self._decision("patient_data", 0.95, "rules")
+
+        if word_count <= SMALL_TALK_MAX_WORDS:
+            for intent, pattern in SMALL_TALK_PATTERNS:
+                if pattern.search(text):
+                    return self._decision(intent, 0.95, "rules")
+
+        if not word_count:
+            return self._decision("help", 0.5, "rules")
+
+        probabilities = self.model.predict(text)
+        intent = max(probabilities, key=probabilities.get)
+        confidence = probabilities[intent]
+        # The SQL path needs at least an ambiguous data word; without one the LLM decides
+        if intent == "patient_data" and not AMBIGUOUS_DATA_PATTERN.search(text):
+            confidence = min(confidence, AMBIGUOUS_CONFIDENCE)
+        return self._decision(intent, confidence, "model")
+
+    @staticmethod
+    def _decision(intent: str, confidence: float, source: str) -> dict:
+        return {
+            "route": INTENT_TO_ROUTE[intent],
+            "intent": intent,
+            "confidence": round(confidence, 3),
+            "source": source,
+        }
+
+    @staticmethod
+    def canned_reply(intent: str, patient_id: str) -> Optional[str]:
+        """Templated reply for small talk; None when the intent needs the LLM"""
+        template = CANNED_REPLIES.get(intent)
+        return template.format(patient_id=patient_id) if template else None
+
+
+# Global query router instance
+query_router = QueryRouter()
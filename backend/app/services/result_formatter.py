@@ -0,0 +1,212 @@
+import json
+import re
+import datetime
+import decimal
+from typing import Any, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.core.query_result import QueryResult, TYPE_DATE, TYPE_DATETIME, TYPE_INTEGER, TYPE_OBJECT
+
+# Matches SQLDatabase's truncation of long values in tool output
+MAX_PREVIEW_STRING_LENGTH = 100
+TABLE_HTML_CLASSES = "table table-striped"
+NO_DATA_HTML = "<p>No data found in the searched tables.</p>"
+
+
+def build_dataframe(result: QueryResult) -> pd.DataFrame:
+    """DataFrame with JSON-friendly columns: dates as YYYY-MM-DD, decimals as floats, NULL as None.
+
+    Works column-at-a-time on the typed arrays of the result.
+    """
+    data = {}
+    for name, column_type, array, mask in zip(result.columns, result.column_types, result.arrays, result.null_masks):
+        if column_type == TYPE_DATE:
+            formatted = pd.Series(array).dt.strftime("%Y-%m-%d").to_numpy(dtype=object)
+        elif column_type == TYPE_DATETIME:
+            values = pd.Series(array)
+            present = values[~mask]
+            has_time = bool((present.dt.normalize() != present).any())
+            formatted = values.dt.strftime("%Y-%m-%d %H:%M:%S" if has_time else "%Y-%m-%d").to_numpy(dtype=object)
+        elif column_type == TYPE_INTEGER and array.dtype != np.int64:
+            # Integer column with NULLs was stored as float64; give the ints back
+            formatted = array.astype(object)
+            formatted[~mask] = array[~mask].astype(np.int64).tolist()
+        elif column_type == TYPE_OBJECT:
+            formatted = np.array([to_json_value(value) for value in array], dtype=object)
+        else:
+            formatted = array.astype(object) if mask.any() else array
+        if mask.any():
+            formatted[mask] = None
+        data[name] = formatted
+    # Object dtype throughout, so pandas keeps None instead of inferring NaN-backed dtypes
+    return pd.DataFrame({name: pd.Series(values, dtype=object) for name, values in data.items()}, columns=result.columns)
+
+
+def to_json_value(value: Any) -> Any:
+    """JSON-friendly form of values that have no column type of their own (bytes, time, ...)"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", "replace")
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def dataframe_to_records(df: pd.DataFrame) -> List[dict]:
+    """Row records with native Python scalars"""
+    records = df.to_dict(orient="records")
+    return [
+        {key: value.item() if isinstance(value, np.generic) else value for key, value in record.items()}
+        for record in records
+    ]
+
+
+def render_table_html(df: pd.DataFrame) -> str:
+    """Escaped HTML table for the frontend"""
+    if df.empty:
+        return NO_DATA_HTML
+    display = df.astype(object).where(df.notna(), "")
+    return display.to_html(classes=TABLE_HTML_CLASSES, index=False, escape=True, border=0)
+
+
+def build_preview(result: QueryResult, max_rows: int) -> str:
+    """Compact text view of a result for prompts and message history"""
+    def truncate(value):
+        if isinstance(value, str) and len(value) > MAX_PREVIEW_STRING_LENGTH:
+            return value[:MAX_PREVIEW_STRING_LENGTH] + "..."
+        return to_json_value(value)
+
+    preview_rows = [tuple(truncate(value) for value in row) for row in result.iter_rows(limit=max_rows)]
+    preview = f"Columns: {result.schema_summary()}\nRows ({result.row_count} total): {preview_rows}"
+    if result.row_count > max_rows:
+        preview += f"\n... {result.row_count - max_rows} more rows not shown"
+    if result.truncated:
+        preview += f"\nResult was cut off at {result.row_count} rows ({result.truncation_reason})"
+    return preview
+
+
+def parse_llm_json(content: str) -> dict:
+    """Parse a JSON object from an LLM reply, tolerating markdown code fences"""
+    cleaned = content.strip()
+    if cleaned.startswith('```json'):
+        cleaned = cleaned[7:]
+    elif cleaned.startswith('```'):
+        cleaned = cleaned[3:]
+    if cleaned.endswith('```'):
+        cleaned = cleaned[:-3]
+    return json.loads(cleaned.strip())
+
+
+def extract_partial_json_string(buffer: str, key: str) -> str:
+    """Decoded value of a string field from a JSON object that is still being streamed.
+
+    Returns what has arrived so far, dropping an escape sequence cut off at the end.
+    """
+    match = re.search(rf'"{re.escape(key)}"\s*:\s*"', buffer)
+    if not match:
+        return ""
+    raw = buffer[match.end():]
+    escape_start = None
+    index = 0
+    while index < len(raw):
+        char = raw[index]
+        if char == "\\":
+            escape_start = index
+            index += 6 if raw[index + 1:index + 2] == "u" else 2
+            continue
+        if char == '"':
+            raw = raw[:index]
+            break
+        index += 1
+    else:
+        if index > len(raw) and escape_start is not None:
+            raw = raw[:escape_start]
+    try:
+        return json.loads(f'"{raw}"')
+    except ValueError:
+        return ""
+
+
+def build_rows_payload(result: QueryResult) -> dict:
+    """Table rows and HTML sent to streaming clients as soon as the query returns"""
+    df = build_dataframe(result)
+    return {
+        "columns": result.columns,
+        "column_types": result.column_types,
+        "record_count": result.row_count,
+        "data": dataframe_to_records(df),
+        "table_html": render_table_html(df),
+        "truncated": result.truncated,
+    }
+
+
+def build_no_data_response(patient_id: str, selected_tables: List[str], executed_query: str,
+                           error: Optional[str] = None, rejection_reason: Optional[str] = None) -> dict:
+    """Deterministic response for empty, failed or rejected queries; needs no LLM call"""
+    tables = ', '.join(selected_tables) if selected_tables else 'patient'
+    if rejection_reason:
+        summary = f"I could not search the {tables} table(s) for patient {patient_id} because the generated query was not safe to run."
+        explanation = f"The query was rejected before execution: {rejection_reason}."
+    elif error:
+        summary = f"I searched the {tables} table(s) for patient {patient_id} but the query could not be completed."
+        explanation = "The generated query failed to run, so no records could be retrieved."
+    else:
+        summary = f"I searched the {tables} table(s) for patient {patient_id} but found no matching records."
+        explanation = "The search query found no matching records in the specified table(s)."
+    response = {
+        "type": "no_data",
+        "summary": summary,
+        "data_source": f"Tables searched: {tables}",
+        "record_count": 0,
+        "key_insights": [
+            f"No records found for patient ID {patient_id}",
+            "This could mean the patient has no data in these tables",
+            "Try searching in other areas or verify the patient ID"
+        ],
+        "data": [],
+        "table_html": NO_DATA_HTML,
+        "html": NO_DATA_HTML,
+        "explanation": explanation,
+        "schema_info": {
+            "tables": selected_tables,
+            "query": executed_query
+        }
+    }
+    if error:
+        response["error"] = error
+    if rejection_reason:
+        response["rejected"] = True
+        response["rejection_reason"] = rejection_reason
+    return response
+
+
+def build_table_response(df: pd.DataFrame, narrative: dict, patient_id: str, selected_tables: List[str],
+                         executed_query: str, truncation_reason: Optional[str] = None) -> dict:
+    """Response with locally rendered data and table_html plus the LLM-written narrative"""
+    table_html = render_table_html(df)
+    record_count = len(df)
+    tables = ', '.join(selected_tables)
+    response = {
+        "type": "table_data",
+        "summary": narrative.get("summary") or f"Found {record_count} record(s) for patient {patient_id} in {tables} table(s)",
+        "data_source": f"Tables: {tables}",
+        "record_count": record_count,
+        "key_insights": narrative.get("key_insights") or [],
+        "data": dataframe_to_records(df),
+        "table_html": table_html,
+        "html": table_html,  # For frontend compatibility
+        "explanation": narrative.get("explanation", ""),
+        "schema_info": {
+            "tables": selected_tables,
+            "query": executed_query
+        }
+    }
+    if truncation_reason:
+        response["truncated"] = True
+        response["truncation_notice"] = f"Only the first {record_count} rows are shown: {truncation_reason}."
+    return response
@@ -0,0 +1,686 @@
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.database import db_manager, schema_cache, PATIENT_ID_COLUMNS, FAILOVER_ERRORS
+
+TOKEN_PATTERN = re.compile(
+    r"""
+      (?P<executable>/\*!.*?\*/)
+    | (?P<hint>/\*\+.*?\*/)
+    | (?P<comment>--(?=\s|$)[^\n]*|\#[^\n]*|/\*.*?\*/)
+    | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+    | (?P<identifier>`(?:[^`]|``)*`)
+    | (?P<number>\d+(?:\.\d+)?)
+    | (?P<bind>:\w+)
+    | (?P<word>[A-Za-z_][\w$]*)
+    | (?P<op><=|>=|<>|!=|[=<>(),.;*+\-/%])
+    | (?P<space>\s+)
+    | (?P<other>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+# The only optimizer hint a query may carry: the one _add_execution_time_hint writes
+GUARD_HINT_PATTERN = re.compile(r"/\*\+\s*MAX_EXECUTION_TIME\((\d+)\)\s*\*/", re.IGNORECASE)
+
+# Keywords that never belong in a read-only query (REPLACE is allowed as a function)
+FORBIDDEN_KEYWORDS = {
+    "INSERT", "UPDATE", "DELETE", "DROP", "ALTER", "CREATE", "TRUNCATE", "REPLACE", "GRANT", "REVOKE",
+    "CALL", "LOAD", "HANDLER", "LOCK", "UNLOCK", "RENAME", "INTO", "OUTFILE", "DUMPFILE", "SLEEP", "BENCHMARK",
+}
+FUNCTION_KEYWORDS = {"REPLACE"}
+# Words that end a table reference in FROM/JOIN (so they aren't taken as aliases)
+CLAUSE_KEYWORDS = {
+    "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "OUTER", "CROSS", "NATURAL", "ON", "USING", "GROUP", "ORDER",
+    "HAVING", "LIMIT", "UNION", "WINDOW", "STRAIGHT_JOIN", "FOR",
+}
+JOIN_KEYWORDS = {"JOIN", "INNER", "LEFT", "RIGHT", "OUTER", "CROSS", "NATURAL", "STRAIGHT_JOIN"}
+# Words that end a SELECT block's FROM/WHERE part
+BLOCK_END_KEYWORDS = {"GROUP", "ORDER", "HAVING", "LIMIT", "WINDOW", "FOR", "UNION", "INTERSECT", "EXCEPT"}
+SET_OPERATORS = {"UNION", "INTERSECT", "EXCEPT"}
+# Anything but = and IN on a patient column could select other patients
+NON_EQUALITY_OPERATORS = {"<>", "!=", "<", ">", "<=", ">="}
+NON_EQUALITY_KEYWORDS = {"NOT", "LIKE", "BETWEEN", "REGEXP", "RLIKE", "IS", "SOUNDS"}
+DISJUNCTIONS = {"OR", "XOR"}
+
+
+class Token:
+    __slots__ = ("kind", "value", "start", "end", "depth")
+
+    def __init__(self, kind: str, value: str, start: int, end: int, depth: int):
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+        self.depth = depth
+
+    @property
+    def upper(self) -> str:
+        return self.value.upper() if self.kind == "word" else ""
+
+    @property
+    def name(self) -> str:
+        """Identifier text without backticks"""
+        return self.value.strip("`") if self.kind == "identifier" else self.value
+
+
+def tokenize_sql(query: str) -> List[Token]:
+    """Significant tokens (no whitespace, comments or optimizer hints) with their parenthesis depth.
+
+    MySQL runs the body of /*! ... */ comments, so they stay as "executable"
+    tokens for the checks to reject. "--" only starts a comment when
+    whitespace follows, as in MySQL.
+    """
+    tokens = []
+    depth = 0
+    for match in TOKEN_PATTERN.finditer(query):
+        kind = match.lastgroup
+        if kind in ("space", "comment", "hint"):
+            continue
+        value = match.group()
+        if value == ")":
+            depth -= 1
+        tokens.append(Token(kind, value, match.start(), match.end(), depth))
+        if value == "(":
+            depth += 1
+    return tokens
+
+
+def table_references(tokens: List[Token]) -> List[tuple]:
+    """(table, alias) pairs that follow FROM/JOIN, including comma-separated FROM lists"""
+    references = []
+    index = 0
+    while index < len(tokens):
+        if tokens[index].upper not in ("FROM", "JOIN"):
+            index += 1
+            continue
+        index += 1
+        while index < len(tokens) and tokens[index].kind in ("word", "identifier"):
+            name = tokens[index].name
+            index += 1
+            # schema.table
+            if index + 1 < len(tokens) and tokens[index].value == "." and tokens[index + 1].kind in ("word", "identifier"):
+                name = tokens[index + 1].name
+                index += 2
+            alias = name
+            # Optional alias
+            if index < len(tokens) and tokens[index].upper == "AS":
+                index += 1
+            if index < len(tokens) and tokens[index].kind in ("word", "identifier") and tokens[index].upper not in CLAUSE_KEYWORDS:
+                alias = tokens[index].name
+                index += 1
+            references.append((name, alias))
+            if index < len(tokens) and tokens[index].value == ",":
+                index += 1
+                continue
+            break
+    return references
+
+
+def optimizer_hints(query: str) -> List[str]:
+    """/*+ ... */ optimizer hints in the query"""
+    return [match.group() for match in TOKEN_PATTERN.finditer(query) if match.lastgroup == "hint"]
+
+
+def referenced_tables(tokens: List[Token]) -> List[str]:
+    """Table names that follow FROM/JOIN"""
+    return [table for table, _ in table_references(tokens)]
+
+
+def literal_value(token: Token) -> Optional[str]:
+    """Plain value of a number or string literal"""
+    if token.kind == "number":
+        return token.value
+    if token.kind == "string":
+        return token.value[1:-1]
+    return None
+
+
+def closing_paren(tokens: List[Token], index: int) -> int:
+    """Index of the ) matching the ( at index"""
+    depth = tokens[index].depth
+    for close in range(index + 1, len(tokens)):
+        if tokens[close].value == ")" and tokens[close].depth == depth:
+            return close
+    return len(tokens) - 1
+
+
+def select_blocks(tokens: List[Token]) -> List[Tuple[int, int]]:
+    """(start, end) token ranges of every SELECT block, nested ones included"""
+    blocks = []
+    for start, token in enumerate(tokens):
+        if token.upper != "SELECT":
+            continue
+        end = start + 1
+        while end < len(tokens) and tokens[end].depth >= token.depth:
+            if tokens[end].depth == token.depth and tokens[end].upper in SET_OPERATORS:
+                break
+            end += 1
+        blocks.append((start, end))
+    return blocks
+
+
+class SelectBlock:
+    """Table references and filter conditions of one SELECT block (its own depth only).
+
+    references: [{"table", "alias", "index", "join"}], join being inner, left,
+    right or natural for how the table was joined in.
+    conditions: [(kind, join, alias, start, end)], kind "where", "on" or
+    "using"; for "on"/"using" alias is the table the condition joins in.
+    """
+
+    def __init__(self, tokens: List[Token], start: int, end: int):
+        self.tokens = tokens
+        self.depth = tokens[start].depth
+        self.references: List[dict] = []
+        self.conditions: List[tuple] = []
+        self._parse(start + 1, end)
+
+    def _shallow(self, index: int, end: int) -> int:
+        """Next index at the block's own depth"""
+        while index < end and self.tokens[index].depth != self.depth:
+            index += 1
+        return index
+
+    def _condition_end(self, index: int, end: int, stop_at_joins: bool) -> int:
+        while index < end:
+            token = self.tokens[index]
+            if token.depth == self.depth and (
+                token.upper in BLOCK_END_KEYWORDS or token.upper == "WHERE"
+                or (stop_at_joins and (token.upper in JOIN_KEYWORDS or token.value == ","))
+            ):
+                return index
+            index += 1
+        return end
+
+    def _parse(self, index: int, end: int):
+        tokens = self.tokens
+        index = self._shallow(index, end)
+        while index < end and tokens[index].upper != "FROM":
+            if tokens[index].upper in BLOCK_END_KEYWORDS:
+                return
+            index = self._shallow(index + 1, end)
+        join = "inner"
+        index += 1
+        while index < end:
+            token = tokens[index]
+            if token.value == "(":
+                # Derived table or parenthesized join; derived tables are blocks of their own
+                index = closing_paren(tokens, index) + 1
+                if index < end and tokens[index].upper == "AS":
+                    index += 1
+                if index < end and tokens[index].kind in ("word", "identifier") and tokens[index].upper not in CLAUSE_KEYWORDS:
+                    index += 1
+            elif token.kind in ("word", "identifier") and token.upper not in CLAUSE_KEYWORDS | BLOCK_END_KEYWORDS:
+                reference_index = index
+                name = token.name
+                index += 1
+                if index + 1 < end and tokens[index].value == "." and tokens[index + 1].kind in ("word", "identifier"):
+                    name = tokens[index + 1].name
+                    reference_index = index + 1
+                    index += 2
+                alias = name
+                if index < end and tokens[index].upper == "AS":
+                    index += 1
+                if index < end and tokens[index].kind in ("word", "identifier") and tokens[index].upper not in CLAUSE_KEYWORDS | BLOCK_END_KEYWORDS:
+                    alias = tokens[index].name
+                    index += 1
+                self.references.append({"table": name, "alias": alias, "index": reference_index, "join": join})
+            else:
+                index += 1
+                continue
+
+            index = self._shallow(index, end)
+            if index >= end:
+                return
+            token = tokens[index]
+            if token.upper == "ON":
+                close = self._condition_end(index + 1, end, stop_at_joins=True)
+                self.conditions.append(("on", join, self.references[-1]["alias"] if self.references else None, index + 1, close))
+                index = close
+            elif token.upper == "USING" and index + 1 < end and tokens[index + 1].value == "(":
+                close = closing_paren(tokens, index + 1)
+                self.conditions.append(("using", join, self.references[-1]["alias"] if self.references else None, index + 2, close))
+                index = self._shallow(close + 1, end)
+            if index >= end:
+                return
+            token = tokens[index]
+            if token.value == ",":
+                join = "inner"
+                index += 1
+            elif token.upper in JOIN_KEYWORDS:
+                words = set()
+                while index < end and tokens[index].upper in JOIN_KEYWORDS:
+                    words.add(tokens[index].upper)
+                    index += 1
+                    if tokens[index - 1].upper in ("JOIN", "STRAIGHT_JOIN"):
+                        break
+                join = next((kind.lower() for kind in ("LEFT", "RIGHT", "NATURAL") if kind in words), "inner")
+            elif token.upper == "WHERE":
+                close = self._condition_end(index + 1, end, stop_at_joins=False)
+                self.conditions.append(("where", "inner", None, index + 1, close))
+                return
+            else:
+                return
+
+
+def split_conjuncts(tokens: List[Token], start: int, end: int) -> Tuple[List[Tuple[int, int]], bool]:
+    """AND-separated terms of a condition at its own depth, and whether an OR is at that level.
+
+    A term that is wholly in parentheses is split further when it has no OR of
+    its own; a parenthesized disjunction stays one (opaque) term.
+    """
+    if start >= end:
+        return [], False
+    depth = tokens[start].depth
+    terms, term_start, in_between, has_disjunction = [], start, False, False
+    for index in range(start, end):
+        token = tokens[index]
+        if token.depth != depth:
+            continue
+        if token.upper == "BETWEEN":
+            in_between = True
+        elif token.upper == "AND":
+            if in_between:
+                in_between = False
+                continue
+            terms.append((term_start, index))
+            term_start = index + 1
+        elif token.upper in DISJUNCTIONS or token.value == "|":
+            has_disjunction = True
+    terms.append((term_start, end))
+
+    flattened = []
+    for term_start, term_end in terms:
+        wrapped = (
+            term_end - term_start >= 2 and tokens[term_start].value == "("
+            and closing_paren(tokens, term_start) == term_end - 1
+        )
+        if wrapped:
+            inner, inner_disjunction = split_conjuncts(tokens, term_start + 1, term_end - 1)
+            if not inner_disjunction:
+                flattened.extend(inner)
+                continue
+        flattened.append((term_start, term_end))
+    return flattened, has_disjunction
+
+
+def column_reference(tokens: List[Token], index: int, end: int) -> Optional[Tuple[Optional[str], str, int]]:
+    """(qualifier, column, next index) for [alias.]column at index"""
+    if index >= end or tokens[index].kind not in ("word", "identifier"):
+        return None
+    if index + 2 < end and tokens[index + 1].value == "." and tokens[index + 2].kind in ("word", "identifier"):
+        return tokens[index].name, tokens[index + 2].name, index + 3
+    return None, tokens[index].name, index + 1
+
+
+def patient_column_resolver(block: SelectBlock, patient_tables: Dict[str, str]):
+    """(columns, resolve) for a block: alias -> patient column of its patient tables, and
+    resolve(qualifier, column) -> the alias whose patient column that is, or None"""
+    columns = {reference["alias"].lower(): patient_tables[reference["table"].lower()]
+               for reference in block.references if reference["table"].lower() in patient_tables}
+
+    def resolve(qualifier: Optional[str], column: str) -> Optional[str]:
+        column = column.lower()
+        if qualifier is not None:
+            alias = qualifier.lower()
+            return alias if columns.get(alias) == column else None
+        # Unqualified: only unambiguous when one patient alias has that column
+        candidates = [alias for alias, patient_column in columns.items() if patient_column == column]
+        return candidates[0] if len(candidates) == 1 else None
+
+    return columns, resolve
+
+
+def compared_column(tokens: List[Token], index: int) -> Optional[Tuple[Optional[str], str]]:
+    """(qualifier, column) the literal at index is compared with by = or IN, if any"""
+    if index >= 2 and tokens[index - 1].value == "=":
+        if index >= 4 and tokens[index - 3].value == ".":
+            return tokens[index - 4].name, tokens[index - 2].name
+        return (None, tokens[index - 2].name) if tokens[index - 2].kind in ("word", "identifier") else None
+    if index + 2 < len(tokens) and tokens[index + 1].value == "=":
+        reference = column_reference(tokens, index + 2, len(tokens))
+        return reference[:2] if reference is not None else None
+    # Inside an IN (...) list: walk back over the other values to the parenthesis
+    open_paren = index - 1
+    while open_paren >= 0 and (tokens[open_paren].value == "," or tokens[open_paren].kind in ("number", "string", "bind")):
+        open_paren -= 1
+    if open_paren >= 2 and tokens[open_paren].value == "(" and tokens[open_paren - 1].upper == "IN":
+        if open_paren >= 4 and tokens[open_paren - 3].value == ".":
+            return tokens[open_paren - 4].name, tokens[open_paren - 2].name
+        return (None, tokens[open_paren - 2].name) if tokens[open_paren - 2].kind in ("word", "identifier") else None
+    return None
+
+
+def patient_id_literals(tokens: List[Token], patient_id: str) -> Optional[List[Token]]:
+    """Literals equal to patient_id that are compared (= / IN) with a patient column.
+
+    Resolved per SELECT block like the patient filter check, so "status = 1"
+    for patient 1 is left alone. None when a literal is compared with a
+    patient column name that could belong to more than one table.
+    """
+    try:
+        patient_tables = {table.lower(): column.lower() for table, column in schema_cache.get_patient_tables().items()}
+    except Exception as e:
+        print(f"⚠️ Could not load patient tables for SQL guard: {e}")
+        return None
+    blocks = [(start, end, SelectBlock(tokens, start, end)) for start, end in select_blocks(tokens)]
+    literals = []
+    for index, token in enumerate(tokens):
+        if token.kind not in ("number", "string") or literal_value(token) != patient_id:
+            continue
+        column = compared_column(tokens, index)
+        containing = [block for start, end, block in blocks if start <= index < end]
+        if column is None or not containing:
+            continue
+        # Innermost block: select_blocks lists outer blocks first
+        columns, resolve = patient_column_resolver(containing[-1], patient_tables)
+        qualifier, name = column
+        if resolve(qualifier, name) is not None:
+            literals.append(token)
+        elif qualifier is None and sum(patient_column == name.lower() for patient_column in columns.values()) > 1:
+            return None
+    return literals
+
+
+class SqlGuard:
+    """Admission control for LLM-generated SQL before it reaches the database.
+
+    Checks, in order: a single read-only statement; a patient filter for the
+    current patient on queries that touch patient tables; a top-level LIMIT
+    (added or clamped); a MySQL MAX_EXECUTION_TIME hint; and an EXPLAIN row
+    estimate under the configured threshold. Returns the possibly rewritten
+    query or a rejection reason.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._rewritten = 0
+        self._rejections = Counter()
+
+    def check(self, query: str, patient_id: str) -> dict:
+        """Return {"allowed", "query", "reason", "code", "rewrites", "explain", "read_target"}.
+
+        read_target is the server the EXPLAIN ran on; execute the query there.
+        """
+        decision = self._check(query.strip(), str(patient_id))
+        with self._lock:
+            self._checked += 1
+            if not decision["allowed"]:
+                self._rejections[decision["code"]] += 1
+            elif decision["rewrites"]:
+                self._rewritten += 1
+        return decision
+
+    def _check(self, query: str, patient_id: str) -> dict:
+        decision = {"allowed": False, "query": query, "reason": "", "code": "", "rewrites": [], "explain": None,
+                    "read_target": None}
+
+        def reject(code: str, reason: str) -> dict:
+            decision["code"] = code
+            decision["reason"] = reason
+            return decision
+
+        tokens = tokenize_sql(query)
+        if tokens and tokens[-1].value == ";":
+            query = query[:tokens[-1].start].rstrip()
+            tokens = tokens[:-1]
+        if not tokens:
+            return reject("empty", "empty query")
+        if any(token.kind == "executable" for token in tokens):
+            return reject("comment", "executable comments (/*! ... */) are not allowed")
+        for hint in optimizer_hints(query):
+            allowed = GUARD_HINT_PATTERN.fullmatch(hint)
+            if not allowed or int(allowed.group(1)) > settings.SQL_GUARD_MAX_EXECUTION_MS:
+                return reject("comment", f"optimizer hint not allowed: {hint[:100]}")
+        if any(token.value == ";" for token in tokens):
+            return reject("multiple_statements", "multiple statements are not allowed")
+        if tokens[0].upper not in ("SELECT", "WITH"):
+            return reject("not_select", f"only SELECT queries are allowed (got {tokens[0].value.upper()})")
+        if any(token.depth < 0 for token in tokens) or tokens[-1].depth != 0:
+            return reject("syntax", "unbalanced parentheses")
+        for index, token in enumerate(tokens):
+            if token.upper in FORBIDDEN_KEYWORDS:
+                is_function_call = index + 1 < len(tokens) and tokens[index + 1].value == "("
+                if not (token.upper in FUNCTION_KEYWORDS and is_function_call):
+                    return reject("forbidden_keyword", f"forbidden keyword: {token.upper}")
+
+        reason = self.check_patient_filter(tokens, patient_id)
+        if reason:
+            return reject("patient_filter", reason)
+
+        query = self._enforce_limit(query, tokens, decision["rewrites"])
+        query = self._add_execution_time_hint(query, decision["rewrites"])
+        decision["query"] = query
+
+        if settings.SQL_GUARD_EXPLAIN_ENABLED:
+            # Admission and execution must see the same server (replicas may lag)
+            decision["read_target"] = db_manager.choose_read_target()
+            try:
+                explain = db_manager.explain_query(query, target=decision["read_target"])
+            except FAILOVER_ERRORS as e:
+                # Database unreachable: don't block on the estimate, the run will report it
+                print(f"⚠️ EXPLAIN skipped: {e}")
+                explain = None
+            except Exception as e:
+                return reject("explain_failed", f"query could not be planned: {str(e)[:200]}")
+            decision["explain"] = explain
+            if explain and explain["estimated_rows"] > settings.SQL_GUARD_MAX_EXAMINED_ROWS:
+                scans = f" (full scan of {', '.join(explain['full_scans'])})" if explain["full_scans"] else ""
+                return reject("cost", (
+                    f"estimated cost too high: ~{explain['estimated_rows']} rows examined, "
+                    f"limit {settings.SQL_GUARD_MAX_EXAMINED_ROWS}{scans}"
+                ))
+
+        decision["allowed"] = True
+        return decision
+
+    @staticmethod
+    def check_patient_filter(tokens: List[Token], patient_id: str) -> Optional[str]:
+        """Every patient table a query reads must be filtered on the current patient, and no other.
+
+        Checked per SELECT block: each alias of a patient table needs patient_col =
+        <current> (or IN of only the current patient, or a bind parameter) ANDed
+        at the top level of the block's WHERE or of an inner join's ON (its own
+        ON for a LEFT JOIN), or an equi-join on the patient column to an alias
+        that has one. OR at that level and any comparison other than = / IN on
+        a patient column are rejected, and so is any executable comment, whose
+        body the check can't see.
+        """
+        if any(token.kind == "executable" for token in tokens):
+            return "could not verify the patient filter: executable comments (/*! ... */) are not allowed"
+        try:
+            patient_tables = {table.lower(): column.lower() for table, column in schema_cache.get_patient_tables().items()}
+        except Exception as e:
+            print(f"⚠️ Could not load patient tables for SQL guard: {e}")
+            patient_tables = {}
+        if not any(token.name.lower() in patient_tables for token in tokens if token.kind in ("word", "identifier")):
+            return None
+
+        # "id" only identifies a patient in master tables, so a different id value isn't proof of a leak
+        strict_columns = set(PATIENT_ID_COLUMNS) | {column for column in patient_tables.values() if column != "id"}
+        for index, token in enumerate(tokens):
+            # Qualified columns (alias.patient_id) match here too: the alias is a separate token
+            if token.kind not in ("word", "identifier") or token.name.lower() not in strict_columns:
+                continue
+            previous = index - 3 if index >= 2 and tokens[index - 1].value == "." else index - 1
+            for operator in (tokens[previous] if previous >= 0 else None, tokens[index + 1] if index + 1 < len(tokens) else None):
+                if operator is not None and (operator.value in NON_EQUALITY_OPERATORS or operator.upper in NON_EQUALITY_KEYWORDS):
+                    return f"only = or IN comparisons are allowed on {token.name} (got {operator.value.upper()})"
+            following = tokens[index + 1:index + 3]
+            if len(following) < 2:
+                continue
+            operator, operand = following
+            values = []
+            if operator.value == "=":
+                values = [operand]
+            elif operator.upper == "IN" and operand.value == "(":
+                values = [t for t in tokens[index + 3:] if t.depth == operand.depth + 1 and t.kind in ("number", "string", "bind")]
+                values = values[:50]
+            for value in values:
+                if literal_value(value) not in (None, patient_id):
+                    return f"query filters on a different patient ({token.name} = {literal_value(value)})"
+
+        checked = set()
+        for start, end in select_blocks(tokens):
+            block = SelectBlock(tokens, start, end)
+            reason = SqlGuard._check_block(block, patient_tables, patient_id)
+            checked.update(reference["index"] for reference in block.references)
+            if reason:
+                return reason
+
+        # Patient tables used anywhere the block parser couldn't follow (e.g. parenthesized joins)
+        for index, token in enumerate(tokens):
+            if token.kind not in ("word", "identifier") or token.name.lower() not in patient_tables or index in checked:
+                continue
+            qualifier = index + 1 < len(tokens) and tokens[index + 1].value == "."
+            if not qualifier:
+                return f"could not verify the patient filter on {token.name}"
+        return None
+
+    @staticmethod
+    def _check_block(block: SelectBlock, patient_tables: Dict[str, str], patient_id: str) -> Optional[str]:
+        tokens = block.tokens
+        columns, resolve = patient_column_resolver(block, patient_tables)
+        if not columns:
+            return None
+        tables = {reference["alias"].lower(): reference["table"] for reference in block.references}
+
+        filtered = set()
+        links = []  # (from_alias, to_alias): to is filtered once from is
+        for kind, join, own_alias, start, end in block.conditions:
+            own_alias = own_alias.lower() if own_alias else None
+            if kind == "using":
+                if join not in ("inner", "left") or own_alias not in columns:
+                    continue
+                using = {tokens[index].name.lower() for index in range(start, end) if tokens[index].kind in ("word", "identifier")}
+                if columns[own_alias] in using:
+                    for alias in columns:
+                        if alias != own_alias and columns[alias] == columns[own_alias]:
+                            links.append((alias, own_alias))
+                            if join == "inner":
+                                links.append((own_alias, alias))
+                continue
+
+            terms, has_disjunction = split_conjuncts(tokens, start, end)
+            if has_disjunction:
+                return f"OR is not allowed at the top level of a {kind.upper()} condition on patient tables"
+            if kind == "on" and join not in ("inner", "left"):
+                continue
+            for term_start, term_end in terms:
+                predicate = SqlGuard._patient_predicate(tokens, term_start, term_end, patient_id, resolve)
+                if predicate is None:
+                    continue
+                left, right = predicate
+                if kind == "on" and join == "left":
+                    # A LEFT JOIN's ON only restricts the table it joins in
+                    if right is None and left == own_alias:
+                        filtered.add(left)
+                    elif right is not None and own_alias in (left, right):
+                        links.append((right if left == own_alias else left, own_alias))
+                elif right is None:
+                    filtered.add(left)
+                else:
+                    links.extend([(left, right), (right, left)])
+
+        changed = True
+        while changed:
+            changed = False
+            for source, target in links:
+                if source in filtered and target not in filtered:
+                    filtered.add(target)
+                    changed = True
+
+        missing = sorted(f"{tables[alias]} {alias}" if tables[alias].lower() != alias else tables[alias]
+                         for alias in columns if alias not in filtered)
+        if missing:
+            return f"missing patient filter for patient {patient_id} on table(s): {', '.join(missing)}"
+        return None
+
+    @staticmethod
+    def _patient_predicate(tokens: List[Token], start: int, end: int, patient_id: str, resolve):
+        """(alias, None) for alias.col = <patient> / IN (<patient>), (alias, other) for an
+        equi-join on patient columns, None for anything else"""
+        left = column_reference(tokens, start, end)
+        if left is not None and left[2] < end:
+            alias = resolve(left[0], left[1])
+            operator = left[2]
+            if alias is not None and tokens[operator].value == "=":
+                if operator + 2 == end and tokens[operator + 1].kind in ("number", "string", "bind"):
+                    value = tokens[operator + 1]
+                    return (alias, None) if value.kind == "bind" or literal_value(value) == patient_id else None
+                right = column_reference(tokens, operator + 1, end)
+                if right is not None and right[2] == end:
+                    other = resolve(right[0], right[1])
+                    return (alias, other) if other is not None and other != alias else None
+                return None
+            if alias is not None and tokens[operator].upper == "IN" and operator + 1 < end \
+                    and tokens[operator + 1].value == "(" and closing_paren(tokens, operator + 1) == end - 1:
+                values = tokens[operator + 2:end - 1]
+                literals = [value for value in values if value.value != ","]
+                if literals and all(value.kind == "bind" or (value.kind in ("number", "string") and literal_value(value) == patient_id)
+                                    for value in literals):
+                    return alias, None
+                return None
+        # <patient> = alias.col
+        if end - start >= 3 and tokens[start].kind in ("number", "string", "bind") and tokens[start + 1].value == "=":
+            right = column_reference(tokens, start + 2, end)
+            if right is not None and right[2] == end:
+                alias = resolve(right[0], right[1])
+                value = tokens[start]
+                if alias is not None and (value.kind == "bind" or literal_value(value) == patient_id):
+                    return alias, None
+        return None
+
+    @staticmethod
+    def _enforce_limit(query: str, tokens: List[Token], rewrites: List[str]) -> str:
+        """Add a top-level LIMIT, or clamp one above the maximum"""
+        max_limit = settings.SQL_GUARD_MAX_LIMIT
+        for index, token in enumerate(tokens):
+            if token.depth != 0 or token.upper != "LIMIT":
+                continue
+            numbers = tokens[index + 1:index + 4]
+            # LIMIT count | LIMIT offset, count | LIMIT count OFFSET offset
+            if len(numbers) >= 3 and numbers[1].value == ",":
+                count = numbers[2]
+            else:
+                count = numbers[0] if numbers else None
+            if count is None or count.kind != "number":
+                return query
+            if int(float(count.value)) > max_limit:
+                rewrites.append(f"LIMIT {count.value} clamped to {max_limit}")
+                return query[:count.start] + str(max_limit) + query[count.end:]
+            return query
+        rewrites.append(f"LIMIT {settings.SQL_GUARD_DEFAULT_LIMIT} added")
+        # After the last real token, so a trailing "-- comment" can't swallow it
+        end = tokens[-1].end
+        return f"{query[:end]} LIMIT {settings.SQL_GUARD_DEFAULT_LIMIT}{query[end:]}"
+
+    @staticmethod
+    def _add_execution_time_hint(query: str, rewrites: List[str]) -> str:
+        """MySQL optimizer hint that aborts the statement after SQL_GUARD_MAX_EXECUTION_MS"""
+        if db_manager.get_engine().dialect.name != "mysql" or "MAX_EXECUTION_TIME" in query.upper():
+            return query
+        # The hint belongs right after the outermost SELECT (after any WITH clauses)
+        for token in tokenize_sql(query):
+            if token.depth == 0 and token.upper == "SELECT":
+                rewrites.append(f"MAX_EXECUTION_TIME({settings.SQL_GUARD_MAX_EXECUTION_MS}) added")
+                return f"{query[:token.end]} /*+ MAX_EXECUTION_TIME({settings.SQL_GUARD_MAX_EXECUTION_MS}) */{query[token.end:]}"
+        return query
+
+    def get_stats(self) -> dict:
+        """Get guard decision statistics"""
+        with self._lock:
+            return {
+                "checked": self._checked,
+                "rewritten": self._rewritten,
+                "rejected": sum(self._rejections.values()),
+                "rejections_by_reason": dict(self._rejections),
+            }
+
+
+# Global SQL guard instance
+sql_guard = SqlGuard()
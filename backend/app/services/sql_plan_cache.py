@@ -0,0 +1,151 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import db_manager
+from app.services.sql_guard import tokenize_sql, patient_id_literals
+
+PATIENT_PARAM = "patient_id"
+# Only read queries are ever cached
+READ_QUERY_PATTERN = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+# Bind-like tokens other than ours would be misread by text()
+FOREIGN_BIND_PATTERN = re.compile(r"(?<![:\w\\]):(?!" + PATIENT_PARAM + r"\b)\w+")
+
+
+def parameterize_query(query: str, patient_id: str) -> Optional[dict]:
+    """Turn SQL with the patient id inlined into a template bound by :patient_id.
+
+    Only literals compared with a patient id column (``t.patient_id = 143``,
+    ``patient_id IN ('143')``) are replaced; the same value elsewhere
+    (``status = 143``) stays as written. Returns None when the query is not a
+    single read statement or has no patient filter to bind.
+    """
+    query = query.strip().rstrip(";").strip()
+    if not READ_QUERY_PATTERN.match(query) or ";" in query:
+        return None
+
+    literals = patient_id_literals(tokenize_sql(query), str(patient_id))
+    if not literals:
+        return None
+    quoted = {token.value[0] if token.kind == "string" else "" for token in literals}
+
+    template = query
+    for token in reversed(literals):
+        template = f"{template[:token.start]}:{PATIENT_PARAM}{template[token.end:]}"
+    if FOREIGN_BIND_PATTERN.search(template):
+        return None
+    return {"template": template, "quote": quoted.pop()}
+
+
+def render_query(template: str, patient_id: str, quote: str = "") -> str:
+    """Human-readable query with the patient id filled in, for logs and prompts"""
+    return template.replace(f":{PATIENT_PARAM}", f"{quote}{patient_id}{quote}")
+
+
+class SqlPlanCache:
+    """LRU cache of validated, parameterized SQL templates keyed by question intent.
+
+    A template is stored only after its query ran successfully, runs with the
+    patient id bound as a driver parameter, and is evicted as soon as it fails.
+    """
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._rejected = 0
+        self._failures = 0
+        self._evictions = 0
+
+    def get(self, intent_key: str) -> Optional[dict]:
+        """Cached plan for an intent, or None"""
+        with self._lock:
+            entry = self._entries.get(intent_key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(intent_key)
+            entry["hits"] += 1
+            self._hits += 1
+            return entry
+
+    def peek(self, intent_key: str) -> Optional[dict]:
+        """Cached plan without touching statistics or LRU order"""
+        with self._lock:
+            return self._entries.get(intent_key)
+
+    def store(self, intent_key: str, query: str, patient_id: str) -> bool:
+        """Parameterize and cache a query that just ran successfully"""
+        plan = parameterize_query(query, patient_id)
+        with self._lock:
+            if plan is None:
+                self._rejected += 1
+                return False
+            self._entries[intent_key] = {
+                "template": plan["template"],
+                "quote": plan["quote"],
+                # Reused across executions so SQLAlchemy's compiled cache is hit every time
+                "statement": text(plan["template"]),
+                "hits": 0,
+                "stored_at": time.time(),
+            }
+            self._entries.move_to_end(intent_key)
+            self._stores += 1
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        print(f"💾 Cached SQL plan for '{intent_key}': {plan['template']}")
+        return True
+
+    def execute(self, intent_key: str, plan: dict, patient_id: str):
+        """Run a cached plan for a patient; evicts the plan and re-raises on failure"""
+        try:
+            return db_manager.execute_query(plan["statement"], {PATIENT_PARAM: patient_id}, read_only=True)
+        except Exception:
+            self.evict(intent_key, failed=True)
+            raise
+
+    def evict(self, intent_key: str, failed: bool = False):
+        with self._lock:
+            if self._entries.pop(intent_key, None) is not None:
+                self._evictions += 1
+                if failed:
+                    self._failures += 1
+                    print(f"🗑️ Evicted failing SQL plan for '{intent_key}'")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        """Get cache hit/miss statistics"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self._max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+                "stores": self._stores,
+                "rejected": self._rejected,
+                "failures": self._failures,
+                "evictions": self._evictions,
+                "top_plans": sorted(
+                    ({"intent": key, "hits": entry["hits"]} for key, entry in self._entries.items()),
+                    key=lambda item: item["hits"],
+                    reverse=True,
+                )[:10],
+            }
+
+
+# Global SQL plan cache instance
+sql_plan_cache = SqlPlanCache(max_entries=settings.SQL_PLAN_CACHE_MAX_ENTRIES)
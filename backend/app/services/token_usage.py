@@ -0,0 +1,172 @@
+import json
+import threading
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.services.metrics import metrics_registry, Counter, Histogram
+from app.services.prompt_budget import token_counter
+
+# Per-request total tokens, from a greeting to a wide summarized table
+REQUEST_TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+llm_tokens = metrics_registry.register(Counter(
+    "llm_tokens_total", "LLM tokens by graph node and kind (prompt/completion)", ("node", "kind"),
+))
+llm_cost = metrics_registry.register(Counter(
+    "llm_cost_usd_total", "Estimated LLM spend in USD by graph node", ("node",),
+))
+llm_request_tokens = metrics_registry.register(Histogram(
+    "llm_request_tokens", "LLM tokens used per agent request", (), buckets=REQUEST_TOKEN_BUCKETS,
+))
+llm_ceiling_hits = metrics_registry.register(Counter(
+    "llm_token_ceiling_hits_total", "LLM calls refused by the per-request token ceiling", ("node",),
+))
+
+
+class TokenBudgetExceeded(Exception):
+    """The request's LLM token ceiling would be exceeded by the next call"""
+
+    def __init__(self, node: str, used: int, prompt_tokens: int, ceiling: int):
+        self.node = node
+        self.used = used
+        self.ceiling = ceiling
+        super().__init__(
+            f"Token ceiling of {ceiling} reached before {node} "
+            f"({used} tokens used, next prompt ~{prompt_tokens})"
+        )
+
+
+def token_cost(prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated USD cost at the configured per-million-token prices"""
+    return (prompt_tokens * settings.LLM_INPUT_COST_PER_1M_TOKENS
+            + completion_tokens * settings.LLM_OUTPUT_COST_PER_1M_TOKENS) / 1_000_000
+
+
+class TokenLedger:
+    """Prompt and completion tokens of one agent request, per graph node.
+
+    Usage comes from the model's usage metadata; when a response carries none
+    (e.g. a fake model) the prompt estimate and the counted reply are used and
+    the ledger is marked estimated.
+    """
+
+    def __init__(self, ceiling: Optional[int] = None):
+        self.ceiling = ceiling or None
+        self.nodes: Dict[str, dict] = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.estimated = False
+        self.ceiling_hit = False
+        self._closed = False
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def max_completion_tokens(self, node: str, prompt_tokens: int) -> Optional[int]:
+        """Completion tokens left for a call, or None without a ceiling.
+
+        Raises TokenBudgetExceeded when the prompt alone would cross the ceiling.
+        """
+        if not self.ceiling:
+            return None
+        remaining = self.ceiling - self.total_tokens - prompt_tokens
+        if remaining <= 0:
+            self.ceiling_hit = True
+            llm_ceiling_hits.inc(node=node)
+            raise TokenBudgetExceeded(node, self.total_tokens, prompt_tokens, self.ceiling)
+        return remaining
+
+    def record(self, node: str, message, prompt_tokens: int) -> dict:
+        """Charge one model response to the node; returns the usage that was recorded"""
+        usage = getattr(message, "usage_metadata", None) or {}
+        if usage.get("input_tokens") is not None:
+            usage = {"input_tokens": usage["input_tokens"], "output_tokens": usage.get("output_tokens", 0),
+                     "estimated": False}
+        else:
+            content = getattr(message, "content", "")
+            reply = content if isinstance(content, str) else str(content)
+            # Tool-call replies carry their output in the arguments
+            reply += "".join(json.dumps(call.get("args", {})) for call in getattr(message, "tool_calls", None) or [])
+            usage = {"input_tokens": prompt_tokens, "output_tokens": token_counter.count(reply), "estimated": True}
+            self.estimated = True
+
+        cost = token_cost(usage["input_tokens"], usage["output_tokens"])
+        stats = self.nodes.setdefault(node, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0})
+        stats["calls"] += 1
+        stats["prompt_tokens"] += usage["input_tokens"]
+        stats["completion_tokens"] += usage["output_tokens"]
+        stats["cost_usd"] += cost
+        self.prompt_tokens += usage["input_tokens"]
+        self.completion_tokens += usage["output_tokens"]
+
+        llm_tokens.inc(usage["input_tokens"], node=node, kind="prompt")
+        llm_tokens.inc(usage["output_tokens"], node=node, kind="completion")
+        llm_cost.inc(cost, node=node)
+        token_usage_stats.record_call(node, usage["input_tokens"], usage["output_tokens"], cost)
+        return {**usage, "cost_usd": round(cost, 6)}
+
+    def close(self):
+        """Count the finished request in the aggregate statistics (once)"""
+        if self._closed:
+            return
+        self._closed = True
+        if self.nodes:
+            llm_request_tokens.observe(self.total_tokens)
+        token_usage_stats.record_request(self.total_tokens, self.ceiling_hit)
+
+    def to_dict(self) -> dict:
+        return {
+            "model": settings.OPENAI_MODEL,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "cost_usd": round(token_cost(self.prompt_tokens, self.completion_tokens), 6),
+            "ceiling": self.ceiling,
+            "ceiling_hit": self.ceiling_hit,
+            "estimated": self.estimated,
+            "nodes": {node: {**stats, "cost_usd": round(stats["cost_usd"], 6)} for node, stats in self.nodes.items()},
+        }
+
+
+class TokenUsageStats:
+    """Token and cost totals across requests, per node"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nodes: Dict[str, dict] = {}
+        self._requests = 0
+        self._request_tokens = 0
+        self._ceiling_hits = 0
+
+    def record_call(self, node: str, prompt_tokens: int, completion_tokens: int, cost: float):
+        with self._lock:
+            stats = self._nodes.setdefault(node, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0})
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["cost_usd"] += cost
+
+    def record_request(self, total_tokens: int, ceiling_hit: bool):
+        with self._lock:
+            self._requests += 1
+            self._request_tokens += total_tokens
+            self._ceiling_hits += int(ceiling_hit)
+
+    def get_stats(self) -> dict:
+        """Get token usage statistics"""
+        with self._lock:
+            cost = sum(stats["cost_usd"] for stats in self._nodes.values())
+            return {
+                "requests": self._requests,
+                "avg_tokens_per_request": round(self._request_tokens / self._requests) if self._requests else 0,
+                "cost_usd": round(cost, 4),
+                "avg_cost_per_request_usd": round(cost / self._requests, 6) if self._requests else 0.0,
+                "ceiling": settings.LLM_MAX_TOKENS_PER_REQUEST or None,
+                "ceiling_hits": self._ceiling_hits,
+                "nodes": {node: {**stats, "cost_usd": round(stats["cost_usd"], 4)} for node, stats in self._nodes.items()},
+            }
+
+
+# Global token usage statistics
+token_usage_stats = TokenUsageStats()
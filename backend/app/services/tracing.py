@@ -0,0 +1,238 @@
+import contextvars
+import functools
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from app.core.config import settings
+from app.services.metrics import span_duration, spans_in_flight, span_errors
+
+EXPORT_BATCH_SPANS = 512
+EXPORT_QUEUE_SIZE = 10000
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional["Span"]:
+    """Innermost active span of this request, if any"""
+    return _current_span.get()
+
+
+def otlp_value(value) -> dict:
+    """OTLP/JSON AnyValue for an attribute"""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Span:
+    """One timed operation; children started while it is current share its trace"""
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional["Span"], attributes: dict):
+        self._tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = {key: value for key, value in attributes.items() if value is not None}
+        self.error: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._start = time.perf_counter()
+        spans_in_flight.inc(span=name)
+
+    def set_attribute(self, key: str, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def record_error(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"[:300]
+
+    @property
+    def duration(self) -> float:
+        return time.perf_counter() - self._start
+
+    def end(self):
+        """Finish the span; later calls are ignored"""
+        if self.end_ns is not None:
+            return
+        duration = self.duration
+        self.end_ns = self.start_ns + int(duration * 1e9)
+        spans_in_flight.dec(span=self.name)
+        span_duration.observe(duration, span=self.name)
+        if self.error:
+            span_errors.inc(span=self.name)
+        self._tracer.export(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": STATUS_ERROR, "message": self.error} if self.error else {"code": STATUS_OK},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Tracer:
+    """Spans around graph nodes, LLM, DB, Polly and Whisper calls.
+
+    Finished spans feed the span_* metrics and, when an export path is set, are
+    written by a background thread as OTLP/JSON lines (one ExportTraceServiceRequest
+    per line, the OpenTelemetry file exporter format) so a collector's
+    otlpjsonfile receiver or any JSON tooling can pick them up. The file rotates
+    to <path>.1 at max_bytes.
+    """
+
+    def __init__(self, path: Optional[str], max_bytes: int, service_name: str):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._service_name = service_name
+        self._queue: queue.Queue = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+        self._exported = 0
+        self._dropped = 0
+        self._write_errors = 0
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """Start a child of the current span without making it current; call end() on it"""
+        return Span(self, name, current_span(), attributes)
+
+    @staticmethod
+    def activate(span: Span) -> contextvars.Token:
+        """Make a span from start_span current; pass the token to deactivate"""
+        return _current_span.set(span)
+
+    @staticmethod
+    def deactivate(token: contextvars.Token):
+        _current_span.reset(token)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Time the block as a span that is current for everything it calls"""
+        span = self.start_span(name, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def export(self, span: Span):
+        if not self._path:
+            return
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(span.to_otlp())
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name="trace-export", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            span = self._queue.get()
+            if span is None:
+                return
+            batch = [span]
+            stop = False
+            while len(batch) < EXPORT_BATCH_SPANS:
+                try:
+                    span = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if span is None:
+                    stop = True
+                    break
+                batch.append(span)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, spans: list):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self._service_name}}]},
+            "scopeSpans": [{"scope": {"name": "app.services.tracing"}, "spans": spans}],
+        }]}
+        try:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if self._max_bytes and os.path.exists(self._path) and os.path.getsize(self._path) >= self._max_bytes:
+                os.replace(self._path, f"{self._path}.1")
+            with open(self._path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(payload, default=str) + "\n")
+        except OSError as e:
+            with self._lock:
+                self._write_errors += 1
+            print(f"⚠️ Could not write traces to {self._path}: {e}")
+            return
+        with self._lock:
+            self._exported += len(spans)
+
+    def shutdown(self, timeout: float = 5.0):
+        """Flush queued spans and stop the writer thread"""
+        with self._lock:
+            writer = self._writer
+        if writer is not None and writer.is_alive():
+            self._queue.put(None)
+            writer.join(timeout)
+
+    def get_stats(self) -> dict:
+        """Get span export statistics"""
+        with self._lock:
+            return {
+                "path": self._path,
+                "exported": self._exported,
+                "queued": self._queue.qsize(),
+                "dropped": self._dropped,
+                "write_errors": self._write_errors,
+            }
+
+
+def traced_node(name: str, node):
+    """Wrap an async graph node in a node.<name> span"""
+    @functools.wraps(node)
+    async def wrapper(*args, **kwargs):
+        with tracer.span(f"node.{name}", node=name):
+            return await node(*args, **kwargs)
+    return wrapper
+
+
+# Global tracer instance
+tracer = Tracer(
+    path=settings.TRACE_EXPORT_PATH if settings.TRACING_ENABLED else None,
+    max_bytes=settings.TRACE_EXPORT_MAX_BYTES,
+    service_name=settings.TRACE_SERVICE_NAME,
+)
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.llm_utilities import synthesize_speech
+
+# File extension per Polly output format
+FORMAT_EXTENSIONS = {"mp3": "mp3", "ogg_vorbis": "ogg", "pcm": "pcm"}
+
+
+def tts_cache_key(text: str, voice_id: str, engine: str, output_format: str, text_type: str = "text") -> str:
+    """Content address of an utterance: same text and voice settings -> same audio"""
+    payload = "\x1f".join([voice_id, engine, output_format, text_type, text])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TtsCache:
+    """Two-tier cache of synthesized speech keyed by tts_cache_key.
+
+    The memory tier holds recent utterances of this process and is LRU-evicted
+    to stay under its byte budget. The disk tier survives restarts and is shared
+    by workers on the same host: the directory itself is the index, a hit
+    refreshes the file's mtime, and after each write the oldest files are
+    removed until the directory is back under its budget. File I/O runs outside
+    the lock so lookups never wait on another request's disk access.
+    """
+
+    def __init__(self, memory_max_bytes: int, disk_dir: Optional[str], disk_max_bytes: int):
+        self._memory_max_bytes = memory_max_bytes
+        self._disk_dir = disk_dir
+        self._disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._memory_evictions = 0
+        self._disk_evictions = 0
+        self._synthesis_seconds = 0.0
+
+    def get(self, key: str, output_format: str = "mp3") -> Optional[bytes]:
+        """Cached audio from memory, then disk (promoted to memory), else None"""
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self._memory_hits += 1
+                return audio
+
+        audio = self._read_disk(key, output_format)
+        with self._lock:
+            if audio is None:
+                self._misses += 1
+                return None
+            self._disk_hits += 1
+            self._remember(key, audio)
+        return audio
+
+    def put(self, key: str, audio: bytes, output_format: str = "mp3"):
+        """Store audio in both tiers"""
+        with self._lock:
+            self._remember(key, audio)
+        if self._disk_dir and len(audio) <= self._disk_max_bytes:
+            if self._write_disk(key, audio, output_format):
+                evicted = self._evict_disk()
+                with self._lock:
+                    self._disk_evictions += evicted
+
+    def synthesize(self, polly_client, text: str, voice_id: str = "Ruth", engine: str = "neural",
+                   output_format: str = "mp3", text_type: str = "text") -> Optional[bytes]:
+        """synthesize_speech with the cache in front; Polly is only called on a miss"""
+        key = tts_cache_key(text, voice_id, engine, output_format, text_type)
+        audio = self.get(key, output_format)
+        if audio is not None:
+            return audio
+        start = time.time()
+        audio = synthesize_speech(polly_client, text, voice_id=voice_id, engine=engine,
+                                  output_format=output_format, text_type=text_type)
+        with self._lock:
+            self._synthesis_seconds += time.time() - start
+        if audio:
+            self.put(key, audio, output_format)
+        return audio
+
+    @staticmethod
+    def _disk_name(key: str, output_format: str) -> str:
+        return f"{key}.{FORMAT_EXTENSIONS.get(output_format, output_format)}"
+
+    def _read_disk(self, key: str, output_format: str) -> Optional[bytes]:
+        if not self._disk_dir:
+            return None
+        path = os.path.join(self._disk_dir, self._disk_name(key, output_format))
+        try:
+            with open(path, "rb") as file:
+                audio = file.read()
+            # Recently used files are evicted last, by every worker
+            os.utime(path)
+        except OSError:
+            return None
+        return audio
+
+    def _write_disk(self, key: str, audio: bytes, output_format: str) -> bool:
+        path = os.path.join(self._disk_dir, self._disk_name(key, output_format))
+        # Unique per writer, so concurrent workers never share a temp file
+        temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self._disk_dir, exist_ok=True)
+            with open(temp_path, "wb") as file:
+                file.write(audio)
+            # Atomic, so other workers never read a half-written file
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"⚠️ Could not write TTS cache file {path}: {e}")
+            return False
+        return True
+
+    def _disk_entries(self) -> List[Tuple[float, int, str]]:
+        """(mtime, size, path) of every cached file, oldest first"""
+        entries = []
+        try:
+            with os.scandir(self._disk_dir) as scan:
+                for entry in scan:
+                    key, _, extension = entry.name.partition(".")
+                    if len(key) != 64 or extension not in FORMAT_EXTENSIONS.values():
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return []
+        return sorted(entries)
+
+    def _evict_disk(self) -> int:
+        """Delete the least recently used files until the directory fits its budget"""
+        entries = self._disk_entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in entries:
+            if total <= self._disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                evicted += 1
+            except OSError:
+                pass  # Another worker got there first
+            total -= size
+        return evicted
+
+    def _remember(self, key: str, audio: bytes):
+        if len(audio) > self._memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self._memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self._memory_evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def get_stats(self) -> dict:
+        """Get cache hit/miss statistics"""
+        disk_entries = self._disk_entries() if self._disk_dir else []
+        with self._lock:
+            hits = self._memory_hits + self._disk_hits
+            lookups = hits + self._misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "memory_max_bytes": self._memory_max_bytes,
+                "disk_entries": len(disk_entries),
+                "disk_bytes": sum(size for _, size, _ in disk_entries),
+                "disk_max_bytes": self._disk_max_bytes,
+                "memory_hits": self._memory_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "memory_evictions": self._memory_evictions,
+                "disk_evictions": self._disk_evictions,
+                "polly_seconds": round(self._synthesis_seconds, 3),
+            }
+
+
+# Global TTS cache instance
+tts_cache = TtsCache(
+    memory_max_bytes=settings.TTS_CACHE_MEMORY_BYTES,
+    disk_dir=settings.TTS_CACHE_DIR or None,
+    disk_max_bytes=settings.TTS_CACHE_DISK_BYTES,
+)
@@ -0,0 +1,308 @@
+"""Per-node latency and memory of the agent pipeline and the chat routes, fully offline.
+
+Runs DatabaseAgent, POST /chat/send, GET /chat/audio and POST /chat/transcribe
+with a deterministic fake chat model, fake Polly/Whisper clients and a seeded
+SQLite database (or any DATABASE_URL with the same schema, e.g. a local MySQL).
+Timings come from a pass without tracemalloc; allocations and peak memory from
+a separate, shorter pass with it. Results are written as JSON so runs can be
+compared for regressions; app settings can be overridden through the environment.
+
+    cd backend
+    python -m benchmarks.bench_agent --iterations 20 --output bench.json
+    SQL_PLAN_CACHE_ENABLED=false python -m benchmarks.bench_agent --compare bench.json
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timezone
+
+# Point the app at local stand-ins before any app module is imported
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'health_informatics_bench.db')}")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ.setdefault("TIKTOKEN_ENABLED", "false")
+os.environ.setdefault("TRACING_ENABLED", "false")
+os.environ.setdefault("QUERY_LOG_ENABLED", "false")
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+os.environ.setdefault("TTS_CACHE_ENABLED", "false")
+os.environ.setdefault("AUDIO_EAGER_SYNTHESIS", "false")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.core.database import schema_cache  # noqa: E402
+from app.services import database_agent  # noqa: E402
+from app.services.answer_cache import answer_cache  # noqa: E402
+from app.services.audio_jobs import audio_jobs  # noqa: E402
+from app.services.patient_snapshot import patient_snapshots  # noqa: E402
+from app.services.sql_plan_cache import sql_plan_cache  # noqa: E402
+from app.services.token_usage import token_usage_stats  # noqa: E402
+from app.services.tracing import traced_node  # noqa: E402
+from app.routers import chat  # noqa: E402
+from app.main import app  # noqa: E402
+from benchmarks.fakes import FakeChatModel, FakePolly, FakeWhisperClient, fake_wav, patient_ids, seed_database  # noqa: E402
+
+SCHEMA_VERSION = 1
+QUESTIONS = [
+    "Show me the treatment history",
+    "What are the pathology results?",
+    "Get patient registration details",
+    "How many treatments did the patient have?",
+    "Hello!",
+]
+# Settings that change what is being measured; recorded with every run
+RECORDED_SETTINGS = [
+    "QUERY_ROUTER_ENABLED", "SQL_PLAN_CACHE_ENABLED", "ANSWER_CACHE_ENABLED", "SQL_GUARD_ENABLED",
+    "PATIENT_SNAPSHOT_ENABLED", "TTS_CACHE_ENABLED", "RESULT_PREVIEW_ROWS", "PROMPT_TOKEN_BUDGETS",
+]
+
+
+class NodeProbe:
+    """Wraps every graph node (on top of its tracing span) to time it and, optionally, trace its memory"""
+
+    def __init__(self):
+        self.active = False
+        self.trace_memory = False
+        self.samples = defaultdict(list)
+
+    def wrap(self, name, node):
+        traced = traced_node(name, node)
+
+        @functools.wraps(node)
+        async def probe(*args, **kwargs):
+            if not self.active:
+                return await traced(*args, **kwargs)
+            if self.trace_memory:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            try:
+                return await traced(*args, **kwargs)
+            finally:
+                sample = {"ms": (time.perf_counter() - start) * 1000}
+                if self.trace_memory:
+                    current, peak = tracemalloc.get_traced_memory()
+                    sample["net_bytes"] = current - before
+                    sample["peak_bytes"] = peak - before
+                self.samples[name].append(sample)
+        return probe
+
+
+def summarize(values):
+    """mean/p50/p95/max of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        "mean": round(statistics.mean(ordered), 3),
+        "p50": round(statistics.median(ordered), 3),
+        "p95": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def reset_caches():
+    sql_plan_cache.clear()
+    answer_cache.clear()
+    patient_snapshots.invalidate()
+
+
+def run_pass(client, loop, probe, patients, iterations, trace_memory, cold):
+    """One pass over every scenario; returns {scenario: [{"ms", "peak_bytes"?}, ...]}"""
+    results = defaultdict(list)
+    wav = fake_wav()
+
+    def timed(scenario, fn):
+        if trace_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        value = fn()
+        sample = {"ms": (time.perf_counter() - start) * 1000}
+        if trace_memory:
+            sample["peak_bytes"] = tracemalloc.get_traced_memory()[1] - before
+        results[scenario].append(sample)
+        return value
+
+    probe.trace_memory = trace_memory
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        for iteration in range(iterations):
+            for index, question in enumerate(QUESTIONS):
+                patient_id = patients[(iteration * len(QUESTIONS) + index) % len(patients)]
+                if cold:
+                    reset_caches()
+                probe.active = True
+                agent = database_agent.DatabaseAgent(patient_id, settings.OPENAI_API_KEY, question)
+                timed("agent", lambda: loop.run_until_complete(agent.acreate_agent()))
+                probe.active = False
+
+                if cold:
+                    reset_caches()
+                response = timed("route_send", lambda: client.post(
+                    f"{settings.API_V1_STR}/chat/send", json={"message": question, "patient_id": patient_id}
+                ))
+                response.raise_for_status()
+                audio = timed("route_audio", lambda: client.get(response.json()["audio_url"]))
+                audio.raise_for_status()
+            transcript = timed("route_transcribe", lambda: client.post(
+                f"{settings.API_V1_STR}/chat/transcribe", files={"file": ("question.wav", wav, "audio/wav")}
+            ))
+            transcript.raise_for_status()
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(args, seeded, timing, timing_nodes, memory, memory_nodes):
+    scenarios = {}
+    for name, samples in timing.items():
+        peaks = [sample["peak_bytes"] / 1024 for sample in memory.get(name, [])]
+        scenarios[name] = {
+            "requests": len(samples),
+            "latency_ms": summarize([sample["ms"] for sample in samples]),
+            "peak_kib": summarize(peaks),
+        }
+    nodes = {}
+    for name, samples in timing_nodes.items():
+        traced = memory_nodes.get(name, [])
+        nodes[name] = {
+            "calls": len(samples),
+            "latency_ms": summarize([sample["ms"] for sample in samples]),
+            "net_alloc_kib": summarize([sample["net_bytes"] / 1024 for sample in traced]),
+            "peak_kib": summarize([sample["peak_bytes"] / 1024 for sample in traced]),
+        }
+    return {
+        "benchmark": "bench_agent",
+        "schema_version": SCHEMA_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "iterations": args.iterations,
+            "memory_iterations": args.memory_iterations,
+            "cold": args.cold,
+            "llm_latency_ms": args.llm_latency_ms,
+            "polly_latency_ms": args.polly_latency_ms,
+            "database": settings.DATABASE_URL.split(":", 1)[0],
+            "dataset": seeded,
+            "questions": QUESTIONS,
+            "settings": {name: getattr(settings, name) for name in RECORDED_SETTINGS},
+        },
+        "scenarios": scenarios,
+        "nodes": nodes,
+        "tokens": token_usage_stats.get_stats(),
+        "sql_plan_cache": sql_plan_cache.get_stats(),
+    }
+
+
+def print_report(report, baseline=None):
+    def delta(section, name, stat="mean"):
+        if not baseline:
+            return ""
+        before = (baseline.get(section, {}).get(name) or {}).get("latency_ms") or {}
+        after = report[section][name]["latency_ms"]
+        if not before.get(stat):
+            return "   (new)"
+        return f" {(after[stat] - before[stat]) / before[stat] * 100:+7.1f}%"
+
+    def line(label, entry, section, name):
+        latency = entry["latency_ms"]
+        peak = entry.get("peak_kib") or {}
+        print(f"  {label:<26} mean={latency['mean']:9.3f}ms{delta(section, name)}  "
+              f"p95={latency['p95']:9.3f}ms{delta(section, name, 'p95')}  "
+              f"peak_mem={peak.get('max', 0):9.1f}KiB")
+
+    print(f"📊 {report['config']['iterations']} iterations x {len(QUESTIONS)} questions "
+          f"({report['config']['database']}, commit {report['git_commit']})")
+    if baseline:
+        print(f"   compared with {baseline.get('git_commit')} from {baseline.get('created_at')}")
+    print("Scenarios:")
+    for name, entry in report["scenarios"].items():
+        line(name, entry, "scenarios", name)
+    print("Agent graph nodes:")
+    for name, entry in sorted(report["nodes"].items(), key=lambda item: -item[1]["latency_ms"]["mean"]):
+        line(name, entry, "nodes", name)
+    tokens = report["tokens"]
+    print(f"🧾 LLM tokens per request: {tokens['avg_tokens_per_request']} (cost ${tokens['avg_cost_per_request_usd']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20, help="timing passes over the question set")
+    parser.add_argument("--memory-iterations", type=int, default=3, help="passes with tracemalloc on")
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--rows-per-patient", type=int, default=20)
+    parser.add_argument("--no-seed", action="store_true", help="use DATABASE_URL as is (same schema required)")
+    parser.add_argument("--cold", action="store_true", help="clear plan/answer/snapshot caches before each request")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated model latency per call")
+    parser.add_argument("--polly-latency-ms", type=float, default=0.0, help="simulated Polly latency per call")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="baseline JSON report to diff against")
+    args = parser.parse_args()
+
+    seeded = None
+    if not args.no_seed:
+        seeded = seed_database(settings.DATABASE_URL, args.patients, args.rows_per_patient)
+        schema_cache.invalidate()
+    patients = patient_ids(args.patients)
+
+    # Fakes in place of OpenAI, Polly and Whisper; the probe wraps nodes when the graph is built
+    probe = NodeProbe()
+    database_agent.create_llm = lambda openai_key: FakeChatModel(latency_ms=args.llm_latency_ms)
+    database_agent.traced_node = probe.wrap
+    database_agent.agent_graph_factory.reset()
+    audio_jobs._polly = FakePolly(latency_ms=args.polly_latency_ms)
+    whisper = FakeWhisperClient()
+    chat.openai_client = lambda: whisper
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # DatabaseAgent runs on one long-lived loop, like under uvicorn
+    loop = asyncio.new_event_loop()
+    with contextlib.redirect_stdout(io.StringIO()), TestClient(app) as client:
+        run_pass(client, loop, probe, patients, 1, trace_memory=False, cold=args.cold)  # warm-up (imports, graph compile)
+        probe.samples.clear()
+        timing = run_pass(client, loop, probe, patients, args.iterations, trace_memory=False, cold=args.cold)
+        timing_nodes = dict(probe.samples)
+        probe.samples.clear()
+        memory = run_pass(client, loop, probe, patients, args.memory_iterations, trace_memory=True, cold=args.cold)
+        memory_nodes = dict(probe.samples)
+    loop.close()
+
+    report = build_report(args, seeded, timing, timing_nodes, memory, memory_nodes)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2, default=str)
+        print(f"💾 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
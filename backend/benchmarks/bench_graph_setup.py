@@ -0,0 +1,72 @@
+"""Per-request agent setup cost: building the graph every request vs. the shared compiled graph.
+
+Runs fully offline against an in-memory SQLite database; no LLM calls are made.
+
+    cd backend
+    python -m benchmarks.bench_graph_setup --iterations 50
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import time
+import tracemalloc
+
+# Point the app at a local stand-in before any app module is imported
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from app.core.config import settings  # noqa: E402
+from app.core.database import db_manager  # noqa: E402
+from app.services.database_agent import agent_graph_factory, build_agent_graph, create_llm  # noqa: E402
+
+
+def per_request_setup():
+    """What create_agent() used to do on every request"""
+    return build_agent_graph(create_llm(settings.OPENAI_API_KEY), db_manager.get_database())
+
+
+def shared_graph():
+    """What create_agent() does now"""
+    return agent_graph_factory.get_graph(settings.OPENAI_API_KEY)
+
+
+def measure(fn, iterations):
+    """Return per-call latencies (ms) and traced peak memory (bytes)"""
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()  # warm-up (imports, first compile)
+        tracemalloc.start()
+        for _ in range(iterations):
+            start = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - start) * 1000)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return timings, peak
+
+
+def report(label, timings, peak):
+    print(
+        f"{label:<22} mean={statistics.mean(timings):8.3f}ms  "
+        f"p50={statistics.median(timings):8.3f}ms  "
+        f"max={max(timings):8.3f}ms  peak_mem={peak / 1024:8.1f}KiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"📊 Agent setup cost over {args.iterations} requests")
+    before, before_peak = measure(per_request_setup, args.iterations)
+    after, after_peak = measure(shared_graph, args.iterations)
+    report("before (per request)", before, before_peak)
+    report("after (shared graph)", after, after_peak)
+    print(f"⚡ Speedup: {statistics.mean(before) / max(statistics.mean(after), 1e-6):.0f}x")
+
+
+if __name__ == "__main__":
+    main()
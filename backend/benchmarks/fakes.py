@@ -0,0 +1,272 @@
+"""Offline stand-ins for the benchmarks: a deterministic chat model, Polly and
+Whisper clients, and a local database seeded with the patient tables.
+
+Nothing here touches the network, so timings only reflect our own code.
+"""
+import asyncio
+import io
+import json
+import random
+import re
+import time
+from datetime import date, timedelta
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from sqlalchemy import create_engine, text
+
+CHARS_PER_TOKEN = 4
+STREAM_CHUNK_CHARS = 16
+
+# Same tables the agent sees in production (see README)
+SCHEMA = [
+    """CREATE TABLE patients_registration (
+        patient_id VARCHAR(20) PRIMARY KEY,
+        first_name VARCHAR(50),
+        last_name VARCHAR(50),
+        date_of_birth DATE,
+        sex VARCHAR(10),
+        phone VARCHAR(20),
+        city VARCHAR(50),
+        registration_date DATE
+    )""",
+    """CREATE TABLE patients_treatment (
+        treatment_id INTEGER PRIMARY KEY,
+        patient_id VARCHAR(20) NOT NULL,
+        treatment_type VARCHAR(30),
+        drug_name VARCHAR(50),
+        dosage VARCHAR(30),
+        start_date DATE,
+        end_date DATE,
+        status VARCHAR(20)
+    )""",
+    """CREATE TABLE pathology_reports (
+        report_id INTEGER PRIMARY KEY,
+        patient_id VARCHAR(20) NOT NULL,
+        report_date DATE,
+        specimen VARCHAR(50),
+        diagnosis VARCHAR(100),
+        tumour_grade VARCHAR(10),
+        stage VARCHAR(10),
+        result_summary VARCHAR(255)
+    )""",
+    "CREATE INDEX idx_patients_treatment_patient_id ON patients_treatment (patient_id, start_date)",
+    "CREATE INDEX idx_pathology_reports_patient_id ON pathology_reports (patient_id, report_date)",
+]
+
+FIRST_NAMES = ["Ann", "Bob", "Chen", "Dana", "Eli", "Farah", "Gus", "Hana", "Ivan", "Jo"]
+LAST_NAMES = ["Smith", "Tremblay", "Nguyen", "Martin", "Roy", "Singh", "Brown", "Wilson"]
+CITIES = ["Toronto", "Montreal", "Vancouver", "Calgary", "Ottawa"]
+TREATMENTS = [
+    ("chemotherapy", "Cyclophosphamide", "600 mg/m2"), ("chemotherapy", "Doxorubicin", "60 mg/m2"),
+    ("hormonal", "Tamoxifen", "20 mg"), ("hormonal", "Letrozole", "2.5 mg"),
+    ("targeted", "Trastuzumab", "6 mg/kg"), ("radiation", "External beam", "50 Gy"),
+    ("surgery", "Lumpectomy", None),
+]
+SPECIMENS = ["Breast core biopsy", "Sentinel lymph node", "Excision specimen", "Blood panel"]
+DIAGNOSES = ["Invasive ductal carcinoma", "Ductal carcinoma in situ", "Benign fibroadenoma", "No malignancy"]
+
+
+def patient_ids(patients: int) -> List[str]:
+    return [str(100000 + index) for index in range(patients)]
+
+
+def seed_database(url: str, patients: int = 50, rows_per_patient: int = 20, seed: int = 0) -> dict:
+    """(Re)create the patient tables at url and fill them with reproducible rows"""
+    rng = random.Random(seed)
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        for table in ("pathology_reports", "patients_treatment", "patients_registration"):
+            connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        for statement in SCHEMA:
+            connection.execute(text(statement))
+
+        registrations, treatments, reports = [], [], []
+        for patient_id in patient_ids(patients):
+            registered = date(2015, 1, 1) + timedelta(days=rng.randrange(3000))
+            registrations.append({
+                "patient_id": patient_id, "first_name": rng.choice(FIRST_NAMES), "last_name": rng.choice(LAST_NAMES),
+                "date_of_birth": date(1940, 1, 1) + timedelta(days=rng.randrange(20000)),
+                "sex": rng.choice(["F", "M"]), "phone": f"555-{rng.randrange(1000, 9999)}",
+                "city": rng.choice(CITIES), "registration_date": registered,
+            })
+            for _ in range(rows_per_patient):
+                treatment_type, drug, dosage = rng.choice(TREATMENTS)
+                start = registered + timedelta(days=rng.randrange(1500))
+                treatments.append({
+                    "treatment_id": len(treatments) + 1, "patient_id": patient_id, "treatment_type": treatment_type,
+                    "drug_name": drug, "dosage": dosage, "start_date": start,
+                    "end_date": start + timedelta(days=rng.randrange(14, 180)) if rng.random() < 0.8 else None,
+                    "status": rng.choice(["completed", "active", "stopped"]),
+                })
+            for _ in range(max(rows_per_patient // 4, 1)):
+                reports.append({
+                    "report_id": len(reports) + 1, "patient_id": patient_id,
+                    "report_date": registered + timedelta(days=rng.randrange(1500)),
+                    "specimen": rng.choice(SPECIMENS), "diagnosis": rng.choice(DIAGNOSES),
+                    "tumour_grade": rng.choice(["G1", "G2", "G3", None]), "stage": rng.choice(["I", "IIA", "IIB", "III", None]),
+                    "result_summary": "Margins clear; ER positive, PR positive, HER2 negative",
+                })
+
+        def insert(table, rows):
+            columns = list(rows[0])
+            connection.execute(
+                text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})"), rows
+            )
+
+        insert("patients_registration", registrations)
+        insert("patients_treatment", treatments)
+        insert("pathology_reports", reports)
+    engine.dispose()
+    return {"patients": len(registrations), "treatments": len(treatments), "pathology_reports": len(reports)}
+
+
+# Canned SQL per topic, keyed by words of the question
+QUERY_TEMPLATES = [
+    (("pathology", "lab", "report", "biopsy", "grade", "stage", "diagnos"),
+     "SELECT report_date, specimen, diagnosis, tumour_grade, stage FROM pathology_reports "
+     "WHERE patient_id = '{patient_id}' ORDER BY report_date DESC"),
+    (("registration", "birth", "contact", "phone", "address", "demographic"),
+     "SELECT first_name, last_name, date_of_birth, sex, city, registration_date FROM patients_registration "
+     "WHERE patient_id = '{patient_id}'"),
+    (("how many", "count"),
+     "SELECT treatment_type, COUNT(*) AS treatments FROM patients_treatment "
+     "WHERE patient_id = '{patient_id}' GROUP BY treatment_type"),
+    ((),
+     "SELECT treatment_type, drug_name, dosage, start_date, end_date, status FROM patients_treatment "
+     "WHERE patient_id = '{patient_id}' ORDER BY start_date DESC"),
+]
+
+
+def message_text(message) -> str:
+    content = message.content if isinstance(message, BaseMessage) else message.get("content", "")
+    return content if isinstance(content, str) else json.dumps(content)
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic stand-in for ChatOpenAI.
+
+    Answers each graph node the way gpt-4o would (route word, SQL tool call,
+    summary JSON), reports usage metadata from a length estimate, streams the
+    summary in small chunks, and can add a fixed latency to mimic the network.
+    """
+
+    latency_ms: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def reply(self, messages: List, tools: Optional[list] = None) -> AIMessage:
+        prompt = "\n".join(message_text(message) for message in messages)
+        question = message_text(messages[-1]).lower()
+        tool_names = [tool["function"]["name"] for tool in tools or []]
+
+        if "sql_db_query" in tool_names:
+            match = re.search(r"patient_id=([\w-]+)", prompt)
+            patient_id = match.group(1) if match else "0"
+            if "SQL expert" in prompt:
+                query = message_text(messages[-1])  # check_query: reproduce the query
+            else:
+                query = next(template for words, template in QUERY_TEMPLATES
+                             if not words or any(word in question for word in words)).format(patient_id=patient_id)
+            message = AIMessage(content="", tool_calls=[{"name": "sql_db_query", "args": {"query": query}, "id": "call_query"}])
+        elif "routing system" in prompt:
+            message = AIMessage(content="greeting" if re.search(r"\b(hi|hello|thanks|bye)\b", question) else "list_tables")
+        elif "health informatics assistant helping doctors" in prompt:
+            rows = max(prompt.count("\n") - 12, 0)
+            message = AIMessage(content=json.dumps({
+                "summary": f"The patient has {rows} matching records; the most recent entries are listed first.",
+                "key_insights": ["Records are ordered by date", "Active entries are flagged in the status column"],
+                "explanation": "Synthetic data generated for benchmarking.",
+            }))
+        else:
+            message = AIMessage(content="Hello! I can help you review patient treatments, pathology and registration details.")
+
+        output = message.content + "".join(json.dumps(call["args"]) for call in message.tool_calls)
+        input_tokens = len(prompt) // CHARS_PER_TOKEN
+        output_tokens = len(output) // CHARS_PER_TOKEN
+        message.usage_metadata = {
+            "input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens,
+        }
+        return message
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self.reply(messages, kwargs.get("tools")))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self.reply(messages, kwargs.get("tools")))])
+
+    def _chunks(self, message: AIMessage) -> Iterator[ChatGenerationChunk]:
+        content = message.content
+        for start in range(0, len(content), STREAM_CHUNK_CHARS):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=content[start:start + STREAM_CHUNK_CHARS]))
+        # Usage arrives on the last chunk, as with stream_usage=True
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=message.usage_metadata))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        yield from self._chunks(self.reply(messages, kwargs.get("tools")))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        for chunk in self._chunks(self.reply(messages, kwargs.get("tools"))):
+            yield chunk
+
+
+class FakePolly:
+    """boto3 Polly client stand-in: about 1 KB of "audio" per 10 characters"""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    def synthesize_speech(self, Text: str, **kwargs) -> dict:
+        self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return {"AudioStream": io.BytesIO(b"\xff\xfb" * (len(Text) * 50))}
+
+
+class FakeWhisperClient:
+    """AsyncOpenAI stand-in exposing audio.transcriptions.create"""
+
+    def __init__(self, transcript: str = "show me the treatment history", latency_ms: float = 0.0):
+        self.transcript = transcript
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self.audio = self
+        self.transcriptions = self
+
+    def with_options(self, **kwargs) -> "FakeWhisperClient":
+        return self
+
+    async def create(self, model: str, file: Any, response_format: str = "text", **kwargs) -> str:
+        self.calls += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return self.transcript
+
+
+def fake_wav(seconds: float = 2.0, sample_rate: int = 16000) -> bytes:
+    """Silent 16-bit mono WAV upload"""
+    import wave
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b"\x00\x00" * int(seconds * sample_rate))
+    return buffer.getvalue()
@@ -0,0 +1,154 @@
+"""Synthetic clinical dataset at load-test scale, from 1k to 10M rows with realistic skew.
+
+Recreates patients_registration, patients_treatment and pathology_reports (the
+tables the agent queries) at DATABASE_URL, or --database-url, and fills them in
+batches so memory stays flat at any size. Treatments per patient are
+log-normally distributed (most histories are short, a few run to hundreds of
+rows), drugs and cities follow a Zipf-like popularity curve, registrations lean
+towards recent years and pathology reports track each patient's history.
+Output is reproducible for a given --seed.
+
+    cd backend
+    python -m benchmarks.generate_dataset --rows 1000000 --database-url sqlite:////tmp/health_load.db
+"""
+import argparse
+import math
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, text
+
+from benchmarks.fakes import CITIES, DIAGNOSES, FIRST_NAMES, LAST_NAMES, SCHEMA, SPECIMENS, TREATMENTS, patient_ids
+
+TABLES = ("patients_registration", "patients_treatment", "pathology_reports")
+BATCH_ROWS = 10000
+MEAN_TREATMENTS = 20
+# Spread of the per-patient history; mean stays MEAN_TREATMENTS
+HISTORY_SIGMA = 1.1
+REPORTS_PER_TREATMENT = 0.25
+# Last day of the generated history, fixed so runs are reproducible
+END_DATE = date(2025, 1, 1)
+HISTORY_DAYS = 3650
+DIAGNOSIS_WEIGHTS = [0.5, 0.2, 0.2, 0.1]
+
+
+def zipf_weights(count: int, exponent: float = 1.0) -> list:
+    return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+
+def patients_for_rows(rows: int, mean_treatments: int = MEAN_TREATMENTS) -> int:
+    """Patients needed for about `rows` rows across the three tables"""
+    per_patient = 1 + mean_treatments * (1 + REPORTS_PER_TREATMENT)
+    return max(round(rows / per_patient), 1)
+
+
+def generate_rows(patients: int, mean_treatments: int = MEAN_TREATMENTS, seed: int = 0):
+    """Yield (table, row) for the whole dataset, one patient at a time"""
+    rng = random.Random(seed)
+    mu = math.log(mean_treatments) - HISTORY_SIGMA ** 2 / 2
+    treatment_weights = zipf_weights(len(TREATMENTS))
+    city_weights = zipf_weights(len(CITIES), 0.8)
+    treatment_id = report_id = 0
+
+    for patient_id in patient_ids(patients):
+        registered = END_DATE - timedelta(days=int(rng.triangular(0, HISTORY_DAYS, 0)))
+        yield "patients_registration", {
+            "patient_id": patient_id, "first_name": rng.choice(FIRST_NAMES), "last_name": rng.choice(LAST_NAMES),
+            "date_of_birth": date(1935, 1, 1) + timedelta(days=int(rng.triangular(0, 25000, 12000))),
+            "sex": "F" if rng.random() < 0.8 else "M", "phone": f"555-{rng.randrange(1000, 9999)}",
+            "city": rng.choices(CITIES, city_weights)[0], "registration_date": registered,
+        }
+
+        history_days = max((END_DATE - registered).days, 1)
+        treatments = int(rng.lognormvariate(mu, HISTORY_SIGMA))
+        for _ in range(treatments):
+            treatment_type, drug, dosage = rng.choices(TREATMENTS, treatment_weights)[0]
+            start = registered + timedelta(days=rng.randrange(history_days))
+            end = start + timedelta(days=rng.randrange(14, 180)) if rng.random() < 0.85 else None
+            treatment_id += 1
+            yield "patients_treatment", {
+                "treatment_id": treatment_id, "patient_id": patient_id, "treatment_type": treatment_type,
+                "drug_name": drug, "dosage": dosage, "start_date": start, "end_date": end,
+                "status": "active" if end is None or end > END_DATE else rng.choice(["completed", "completed", "stopped"]),
+            }
+
+        diagnosis = rng.choices(DIAGNOSES, DIAGNOSIS_WEIGHTS)[0]
+        reports = 1 + sum(rng.random() < REPORTS_PER_TREATMENT for _ in range(treatments))
+        for _ in range(reports):
+            malignant = "carcinoma" in diagnosis
+            report_id += 1
+            yield "pathology_reports", {
+                "report_id": report_id, "patient_id": patient_id,
+                "report_date": registered + timedelta(days=rng.randrange(history_days)),
+                "specimen": rng.choice(SPECIMENS), "diagnosis": diagnosis,
+                "tumour_grade": rng.choice(["G1", "G2", "G3"]) if malignant else None,
+                "stage": rng.choice(["I", "IIA", "IIB", "III"]) if malignant else None,
+                "result_summary": "ER positive, PR positive, HER2 negative" if malignant else "No atypia identified",
+            }
+
+
+def generate_dataset(url: str, patients: int, mean_treatments: int = MEAN_TREATMENTS, seed: int = 0,
+                     batch_rows: int = BATCH_ROWS) -> dict:
+    """(Re)create the patient tables at url and insert the generated rows in batches"""
+    engine = create_engine(url)
+    counts = dict.fromkeys(TABLES, 0)
+    batches = {table: [] for table in TABLES}
+
+    def flush(connection, table):
+        rows = batches[table]
+        if rows:
+            columns = list(rows[0])
+            connection.execute(
+                text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})"), rows
+            )
+            counts[table] += len(rows)
+            batches[table] = []
+
+    with engine.connect() as connection:
+        for table in reversed(TABLES):
+            connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        for statement in SCHEMA:
+            connection.execute(text(statement))
+        connection.commit()
+
+        # One transaction per batch keeps MySQL undo logs and SQLite journals small
+        for table, row in generate_rows(patients, mean_treatments, seed):
+            batches[table].append(row)
+            if len(batches[table]) >= batch_rows:
+                flush(connection, table)
+                connection.commit()
+        for table in TABLES:
+            flush(connection, table)
+        connection.commit()
+    engine.dispose()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--rows", type=int, default=10000, help="approximate total rows across the tables")
+    size.add_argument("--patients", type=int, help="number of patients (overrides --rows)")
+    parser.add_argument("--mean-treatments", type=int, default=MEAN_TREATMENTS, help="mean treatments per patient")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="defaults to DATABASE_URL")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("set DATABASE_URL or pass --database-url")
+
+    patients = args.patients or patients_for_rows(args.rows, args.mean_treatments)
+    print(f"🧬 Generating {patients} patients (~{args.mean_treatments} treatments each) into {args.database_url}")
+    start = time.perf_counter()
+    counts = generate_dataset(args.database_url, patients, args.mean_treatments, args.seed, args.batch_rows)
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+    for table, count in counts.items():
+        print(f"  {table:<24} {count:>12,} rows")
+    print(f"✅ {total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
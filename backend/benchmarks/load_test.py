@@ -0,0 +1,336 @@
+"""Trace-replay load test of the chat API at increasing concurrency.
+
+Replays a recorded mix of interactions (benchmarks/traces/chat_mix.jsonl by
+default) across the patients in the database, the way the web client issues
+them: an optional POST /chat/transcribe for voice questions, POST /chat/send,
+then GET of the returned audio_url to play the answer. Patients are picked with
+a Zipf skew so a few are hot. Each concurrency level runs closed-loop for
+--duration seconds and reports throughput, latency percentiles and error rate
+per endpoint, and the level where throughput stops scaling is flagged.
+
+Without --url the app is started in a single uvicorn worker (as in the
+Dockerfile) with OpenAI, Polly and Whisper replaced by the benchmark fakes, each
+with a simulated latency, so nothing leaves the machine. --serve starts only
+that stub server, e.g. to profile it while another process drives the load.
+
+    cd backend
+    python -m benchmarks.generate_dataset --rows 100000 --database-url sqlite:////tmp/health_load.db
+    DATABASE_URL=sqlite:////tmp/health_load.db python -m benchmarks.load_test --concurrency 1,4,16,64 --output load.json
+
+Trace lines are JSON objects: {"message": ..., "weight": 10, "voice": false, "play_audio": true}.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import httpx
+from sqlalchemy import create_engine, text
+
+from benchmarks.fakes import fake_wav
+
+DEFAULT_TRACE = os.path.join(os.path.dirname(__file__), "traces", "chat_mix.jsonl")
+API_PREFIX = "/api/v1/chat"
+SERVER_START_TIMEOUT_SECONDS = 60
+# A level "stops scaling" when it adds less than this much throughput over the previous one
+MIN_SCALING_GAIN = 0.10
+
+
+def serve(args):
+    """Run the app in one uvicorn worker with the external APIs faked"""
+    os.environ.setdefault("OPENAI_API_KEY", "sk-load-test")
+    os.environ.setdefault("TIKTOKEN_ENABLED", "false")
+    import uvicorn
+
+    from app.routers import chat
+    from app.services import database_agent
+    from app.services.audio_jobs import audio_jobs
+    from app.main import app
+    from benchmarks.fakes import FakeChatModel, FakePolly, FakeWhisperClient
+
+    database_agent.create_llm = lambda openai_key: FakeChatModel(latency_ms=args.llm_latency_ms)
+    database_agent.agent_graph_factory.reset()
+    audio_jobs._polly = FakePolly(latency_ms=args.polly_latency_ms)
+    whisper = FakeWhisperClient(latency_ms=args.whisper_latency_ms)
+    chat.openai_client = lambda: whisper
+    print(f"🧪 Stub server on port {args.port} (LLM {args.llm_latency_ms}ms/call, "
+          f"Polly {args.polly_latency_ms}ms, Whisper {args.whisper_latency_ms}ms)", file=sys.stderr)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, workers=1, log_level="warning", access_log=False)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub_server(args):
+    """Start `--serve` in a subprocess and wait for /health; returns (process, base_url, log_path)"""
+    port = free_port()
+    log_path = os.path.join(tempfile.gettempdir(), f"health_load_server_{port}.log")
+    command = [
+        sys.executable, "-m", "benchmarks.load_test", "--serve", "--port", str(port),
+        "--llm-latency-ms", str(args.llm_latency_ms), "--polly-latency-ms", str(args.polly_latency_ms),
+        "--whisper-latency-ms", str(args.whisper_latency_ms),
+    ]
+    env = {**os.environ, "DATABASE_URL": args.database_url}
+    with open(log_path, "w", encoding="utf-8") as log:
+        # The app logs every request to stdout; only keep stderr
+        process = subprocess.Popen(
+            command, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env,
+            stdout=subprocess.DEVNULL, stderr=log,
+        )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Stub server exited with {process.returncode}, see {log_path}")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return process, base_url, log_path
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Stub server did not become healthy in {SERVER_START_TIMEOUT_SECONDS}s, see {log_path}")
+
+
+def load_trace(path: str) -> list:
+    with open(path, encoding="utf-8") as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+    if not entries:
+        raise ValueError(f"No interactions in {path}")
+    return entries
+
+
+def load_patient_ids(database_url: str, limit: int) -> list:
+    engine = create_engine(database_url)
+    try:
+        with engine.connect() as connection:
+            rows = connection.execute(
+                text("SELECT patient_id FROM patients_registration ORDER BY patient_id LIMIT :limit"), {"limit": limit}
+            ).fetchall()
+    finally:
+        engine.dispose()
+    return [row[0] for row in rows]
+
+
+class Workload:
+    """Weighted trace entries and Zipf-skewed patient ids, reproducible per seed"""
+
+    def __init__(self, trace: list, patients: list, patient_skew: float, seed: int):
+        self.rng = random.Random(seed)
+        self.trace = trace
+        self.trace_weights = list(itertools.accumulate(entry.get("weight", 1) for entry in trace))
+        self.patients = patients
+        self.patient_weights = list(itertools.accumulate(1 / (rank + 1) ** patient_skew for rank in range(len(patients))))
+
+    def next(self):
+        entry = self.rng.choices(self.trace, cum_weights=self.trace_weights)[0]
+        patient_id = self.rng.choices(self.patients, cum_weights=self.patient_weights)[0]
+        return entry, patient_id
+
+
+async def timed_request(client, samples, endpoint, method, url, **kwargs):
+    """Issue one request and record (latency_ms, status or exception name); returns the response or None"""
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        await response.aread()
+    except httpx.HTTPError as e:
+        samples[endpoint].append(((time.perf_counter() - start) * 1000, type(e).__name__))
+        return None
+    samples[endpoint].append(((time.perf_counter() - start) * 1000, response.status_code))
+    return response if response.status_code < 400 else None
+
+
+async def interaction(client, samples, entry, patient_id, wav):
+    """One user turn: transcribe (voice), send, then fetch the answer audio"""
+    if entry.get("voice"):
+        transcript = await timed_request(
+            client, samples, "transcribe", "POST", f"{API_PREFIX}/transcribe",
+            files={"file": ("question.wav", wav, "audio/wav")},
+        )
+        if transcript is None:
+            return
+    response = await timed_request(
+        client, samples, "send", "POST", f"{API_PREFIX}/send",
+        json={"message": entry["message"], "patient_id": patient_id},
+    )
+    if response is not None and entry.get("play_audio", True):
+        audio_url = response.json().get("audio_url")
+        if audio_url:
+            await timed_request(client, samples, "audio", "GET", audio_url)
+
+
+async def run_level(base_url, workload, concurrency, duration, timeout, wav):
+    """Closed loop: `concurrency` users issue interactions back to back for `duration` seconds"""
+    samples = defaultdict(list)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        deadline = time.perf_counter() + duration
+
+        async def user():
+            while time.perf_counter() < deadline:
+                entry, patient_id = workload.next()
+                await interaction(client, samples, entry, patient_id, wav)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return samples, elapsed
+
+
+def percentile(ordered: list, fraction: float) -> float:
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def summarize_endpoint(endpoint_samples: list, elapsed: float) -> dict:
+    latencies = sorted(latency for latency, _ in endpoint_samples)
+    errors = Counter(str(status) for _, status in endpoint_samples
+                     if not isinstance(status, int) or status >= 400)
+    failed = sum(errors.values())
+    return {
+        "requests": len(endpoint_samples),
+        # Successful responses only, so fast rejections don't look like capacity
+        "throughput_rps": round((len(endpoint_samples) - failed) / elapsed, 2),
+        "error_rate": round(failed / len(endpoint_samples), 4),
+        "errors": dict(errors),
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 1),
+            "p50": round(percentile(latencies, 0.50), 1),
+            "p90": round(percentile(latencies, 0.90), 1),
+            "p99": round(percentile(latencies, 0.99), 1),
+            "max": round(latencies[-1], 1),
+        },
+    }
+
+
+def find_saturation(levels: list, max_error_rate: float):
+    """First level that adds under MIN_SCALING_GAIN throughput on /send or exceeds the error budget"""
+    previous = None
+    for level in levels:
+        send = level["endpoints"].get("send")
+        if not send:
+            continue
+        if send["error_rate"] > max_error_rate:
+            return {"concurrency": level["concurrency"], "reason": f"error rate {send['error_rate']:.1%} on /send"}
+        if previous and send["throughput_rps"] < previous["throughput_rps"] * (1 + MIN_SCALING_GAIN):
+            return {"concurrency": level["concurrency"],
+                    "reason": f"/send throughput {previous['throughput_rps']} -> {send['throughput_rps']} req/s"}
+        previous = send
+    return None
+
+
+def print_level(level):
+    print(f"👥 concurrency={level['concurrency']:<4} {level['interactions_rps']:8.2f} interactions/s")
+    for endpoint, stats in level["endpoints"].items():
+        latency = stats["latency_ms"]
+        errors = ", ".join(f"{name}x{count}" for name, count in stats["errors"].items()) or "-"
+        print(f"  {endpoint:<11} {stats['throughput_rps']:8.2f} req/s  p50={latency['p50']:8.1f}ms  "
+              f"p90={latency['p90']:8.1f}ms  p99={latency['p99']:8.1f}ms  errors={stats['error_rate']:.1%} ({errors})")
+
+
+async def run(args, base_url, workload):
+    wav = fake_wav()
+    levels = []
+    for concurrency in args.concurrency:
+        samples, elapsed = await run_level(base_url, workload, concurrency, args.duration, args.timeout, wav)
+        endpoints = {endpoint: summarize_endpoint(samples[endpoint], elapsed)
+                     for endpoint in ("transcribe", "send", "audio") if samples.get(endpoint)}
+        level = {
+            "concurrency": concurrency,
+            "elapsed_s": round(elapsed, 2),
+            "interactions_rps": endpoints["send"]["throughput_rps"] if "send" in endpoints else 0.0,
+            "endpoints": endpoints,
+        }
+        levels.append(level)
+        print_level(level)
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="load an already running server instead of starting the stub server")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"),
+                        help="database with the patient tables (defaults to DATABASE_URL)")
+    parser.add_argument("--trace", default=DEFAULT_TRACE, help="JSON lines of recorded interactions")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32,64",
+                        type=lambda value: [int(level) for level in value.split(",")])
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per concurrency level")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout in seconds")
+    parser.add_argument("--patients", type=int, default=10000, help="patient ids to spread load across")
+    parser.add_argument("--patient-skew", type=float, default=1.0, help="Zipf exponent, 0 for uniform")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="stub server: per model call")
+    parser.add_argument("--polly-latency-ms", type=float, default=150.0, help="stub server: per synthesis")
+    parser.add_argument("--whisper-latency-ms", type=float, default=500.0, help="stub server: per transcription")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--serve", action="store_true", help="only run the stub server")
+    parser.add_argument("--port", type=int, default=8000, help="stub server port with --serve")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+    if not args.database_url:
+        parser.error("set DATABASE_URL or pass --database-url")
+
+    trace = load_trace(args.trace)
+    patients = load_patient_ids(args.database_url, args.patients)
+    if not patients:
+        parser.error(f"no patients in {args.database_url}; run benchmarks.generate_dataset first")
+    workload = Workload(trace, patients, args.patient_skew, args.seed)
+
+    process = None
+    base_url = args.url
+    if not base_url:
+        process, base_url, log_path = start_stub_server(args)
+        print(f"🧪 Stub server at {base_url} (single worker, log: {log_path})")
+    print(f"📼 Replaying {len(trace)} interaction kinds over {len(patients)} patients, "
+          f"{args.duration:.0f}s per level")
+    try:
+        levels = asyncio.run(run(args, base_url, workload))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    saturation = find_saturation(levels, args.max_error_rate)
+    if saturation:
+        print(f"📉 Stops scaling at concurrency {saturation['concurrency']}: {saturation['reason']}")
+    else:
+        print("📈 Throughput kept scaling across all levels")
+
+    if args.output:
+        report = {
+            "benchmark": "load_test",
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "target": args.url or "stub",
+            "config": {
+                "trace": args.trace, "duration_s": args.duration, "patients": len(patients),
+                "patient_skew": args.patient_skew, "seed": args.seed,
+                "stub_latency_ms": None if args.url else {
+                    "llm": args.llm_latency_ms, "polly": args.polly_latency_ms, "whisper": args.whisper_latency_ms,
+                },
+            },
+            "levels": levels,
+            "saturation": saturation,
+        }
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print(f"💾 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Importable app package and a local database stand-in before app settings load
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("TIKTOKEN_ENABLED", "false")
+os.environ.setdefault("TRACING_ENABLED", "false")
+os.environ.setdefault("QUERY_LOG_ENABLED", "false")
@@ -0,0 +1,42 @@
+import threading
+import time
+
+from app.services import patient_snapshot
+from app.services.patient_snapshot import PatientSnapshotStore
+
+
+def test_concurrent_loads_share_one_lock_that_is_dropped_afterwards(monkeypatch):
+    store = PatientSnapshotStore(max_bytes=1 << 20, max_rows=100, version_check_seconds=60)
+    loads = []
+
+    def slow_load(patient_id, version):
+        loads.append(patient_id)
+        time.sleep(0.05)
+        return None  # e.g. too large to snapshot
+
+    monkeypatch.setattr(patient_snapshot, "get_patient_data_version", lambda patient_id: "v1")
+    monkeypatch.setattr(store, "_load", slow_load)
+    threads = [threading.Thread(target=store._get_snapshot, args=(str(patient % 3),)) for patient in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(set(loads)) == ["0", "1", "2"]
+    assert store._load_locks == {}
+
+
+def test_oversized_patient_is_not_reloaded_until_the_version_check(monkeypatch):
+    store = PatientSnapshotStore(max_bytes=1 << 20, max_rows=100, version_check_seconds=60)
+    loads = []
+
+    def oversized_load(patient_id, version):
+        loads.append(patient_id)
+        store._mark_oversized(patient_id, version)
+
+    monkeypatch.setattr(patient_snapshot, "get_patient_data_version", lambda patient_id: "v1")
+    monkeypatch.setattr(store, "_load", oversized_load)
+    assert store._get_snapshot("7") is None
+    assert store._get_snapshot("7") is None
+    assert loads == ["7"]
+    assert store.get_stats()["oversized_patients"] == 1
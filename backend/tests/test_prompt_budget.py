@@ -0,0 +1,49 @@
+from app.services.prompt_budget import (
+    TokenCounter, fit_schema_to_budget, render_compact_schema, select_essential_columns, truncate_to_budget,
+)
+
+counter = TokenCounter("gpt-4o", use_tiktoken=False)
+
+COLUMNS = [
+    {"name": "report_id", "type": "INTEGER"},
+    {"name": "patient_id", "type": "VARCHAR(20)"},
+    {"name": "report_date", "type": "DATE"},
+    {"name": "specimen", "type": "VARCHAR(100)"},
+    {"name": "diagnosis", "type": "VARCHAR(200)"},
+    {"name": "tumour_grade", "type": "VARCHAR(10)"},
+    {"name": "stage", "type": "VARCHAR(10)"},
+    {"name": "result_summary", "type": "TEXT"},
+    {"name": "pathologist_notes", "type": "TEXT", "sample": "reviewed by second reader"},
+    {"name": "lab_reference", "type": "VARCHAR(50)", "sample": "LAB-0001"},
+]
+SCHEMAS = {"pathology_reports": COLUMNS}
+ESSENTIAL = {"pathology_reports": select_essential_columns(COLUMNS, "what was my diagnosis?")}
+
+
+def test_essential_columns_keep_keys_dates_and_findings():
+    assert ESSENTIAL["pathology_reports"] == [
+        "report_id", "patient_id", "report_date", "specimen", "diagnosis", "tumour_grade", "stage", "result_summary",
+    ]
+
+
+def test_essential_columns_include_mentioned_ones():
+    essential = select_essential_columns(COLUMNS, "show the pathologist notes")
+    assert "pathologist_notes" in essential and "lab_reference" not in essential
+
+
+def test_schema_within_budget_keeps_every_column():
+    text, kept = fit_schema_to_budget(SCHEMAS, ESSENTIAL, 10000, counter)
+    assert text == render_compact_schema(SCHEMAS)
+    assert kept["pathology_reports"] == [column["name"] for column in COLUMNS]
+
+
+def test_schema_over_budget_drops_only_non_essential_columns():
+    text, kept = fit_schema_to_budget(SCHEMAS, ESSENTIAL, 1, counter)
+    assert kept == ESSENTIAL
+    assert "+2 more" in text and "e.g." not in text
+
+
+def test_truncate_to_budget():
+    assert truncate_to_budget("short question", 100, counter) == "short question"
+    assert truncate_to_budget("x" * 100, 5, counter) == "x" * 5 * 4
+    assert truncate_to_budget("anything", 0, counter) == ""
@@ -0,0 +1,34 @@
+import pytest
+
+from app.core.config import settings
+from app.services.query_router import ROUTE_GREETING, ROUTE_PATIENT_DATA, query_router
+
+
+@pytest.mark.parametrize("query", [
+    "write a report on climate change",
+    "what is the age of the universe",
+    "history of rome",
+    "show labels",
+    "tell me about the history of medicine",
+])
+def test_off_topic_questions_never_take_the_sql_path_on_their_own(query):
+    decision = query_router.classify(query)
+    assert decision["route"] != ROUTE_PATIENT_DATA or decision["confidence"] < settings.QUERY_ROUTER_CONFIDENCE
+
+
+@pytest.mark.parametrize("query", [
+    "show me the treatment history",
+    "what medications am I on",
+    "latest lab results",
+    "when was my last chemo",
+    "what is the diagnosis and tumour stage",
+    "hi, show treatments",
+])
+def test_clinical_questions_route_to_patient_data(query):
+    decision = query_router.classify(query)
+    assert decision["route"] == ROUTE_PATIENT_DATA and decision["confidence"] >= settings.QUERY_ROUTER_CONFIDENCE
+
+
+@pytest.mark.parametrize("query", ["hello", "thanks!", "what can you do"])
+def test_small_talk_routes_to_greeting(query):
+    assert query_router.classify(query)["route"] == ROUTE_GREETING
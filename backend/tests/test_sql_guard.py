@@ -0,0 +1,113 @@
+import pytest
+
+from app.core.database import schema_cache
+from app.services.sql_guard import SqlGuard, tokenize_sql
+
+PATIENT = "143"
+
+
+@pytest.fixture(autouse=True)
+def patient_tables(monkeypatch):
+    monkeypatch.setattr(schema_cache, "get_patient_tables", lambda: {
+        "patients_registration": "patient_id",
+        "patients_treatment": "patient_id",
+        "pathology_reports": "patient_id",
+    })
+
+
+def check(query):
+    return SqlGuard.check_patient_filter(tokenize_sql(query), PATIENT)
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM patients_treatment WHERE patient_id = '143'",
+    "SELECT * FROM patients_treatment t WHERE t.patient_id = '143' AND t.status = 'active'",
+    "SELECT * FROM patients_treatment WHERE '143' = patient_id",
+    "SELECT * FROM patients_treatment WHERE patient_id IN ('143')",
+    "SELECT * FROM patients_treatment WHERE patient_id = :patient_id",
+    "SELECT * FROM patients_treatment WHERE (patient_id = '143')",
+    "SELECT * FROM patients_treatment WHERE patient_id = '143' AND (status = 'active' OR status = 'stopped')",
+    "SELECT * FROM patients_treatment WHERE patient_id = '143' AND start_date BETWEEN '2020-01-01' AND '2021-01-01'",
+    # Equi-join on the patient column carries the filter to the other alias
+    "SELECT * FROM patients_treatment t JOIN pathology_reports p ON t.patient_id = p.patient_id WHERE t.patient_id = '143'",
+    "SELECT * FROM patients_treatment t, pathology_reports p WHERE p.patient_id = t.patient_id AND t.patient_id = '143'",
+    "SELECT * FROM patients_treatment t JOIN pathology_reports p ON 1 = 1 WHERE t.patient_id = '143' AND p.patient_id = '143'",
+    "SELECT * FROM patients_treatment JOIN pathology_reports USING (patient_id) WHERE patients_treatment.patient_id = '143'",
+    "SELECT * FROM patients_registration r LEFT JOIN patients_treatment t ON t.patient_id = r.patient_id WHERE r.patient_id = '143'",
+    "SELECT * FROM (SELECT * FROM patients_treatment WHERE patient_id = '143') recent ORDER BY start_date",
+    "SELECT drug_name FROM patients_treatment WHERE patient_id = '143' UNION SELECT diagnosis FROM pathology_reports WHERE patient_id = '143'",
+    "WITH recent AS (SELECT * FROM patients_treatment WHERE patient_id = '143') SELECT * FROM recent",
+    "SELECT 1",
+    # Plain comments are ignored; "--" needs whitespace after it to start one
+    "SELECT * FROM patients_treatment WHERE patient_id = '143' -- latest first",
+    "SELECT * FROM patients_treatment /* all rows */ WHERE patient_id = '143'",
+    "SELECT * FROM patients_treatment WHERE patient_id = '143' AND 2 --1 = 3",
+])
+def test_allows_queries_scoped_to_the_patient(query):
+    assert check(query) is None
+
+
+@pytest.mark.parametrize("query, reason", [
+    ("SELECT * FROM patients_treatment", "missing patient filter"),
+    ("SELECT * FROM patients_treatment WHERE patient_id = '144'", "different patient"),
+    ("SELECT * FROM patients_treatment WHERE patient_id IN ('143', '144')", "different patient"),
+    # Filter on one alias of a cross join leaves the other unfiltered
+    ("SELECT * FROM patients_treatment t JOIN pathology_reports p ON 1=1 WHERE t.patient_id='143'", "pathology_reports p"),
+    ("SELECT * FROM patients_treatment t, pathology_reports p WHERE t.patient_id = '143'", "pathology_reports p"),
+    ("SELECT * FROM patients_treatment t JOIN patients_treatment u ON 1=1 WHERE t.patient_id = '143'", "patients_treatment u"),
+    # Unqualified column is ambiguous across two patient tables
+    ("SELECT * FROM patients_treatment t JOIN pathology_reports p ON 1=1 WHERE patient_id = '143'", "missing patient filter"),
+    ("SELECT * FROM patients_treatment WHERE patient_id = '143' OR 1=1", "OR is not allowed"),
+    ("SELECT * FROM patients_treatment WHERE patient_id = '143' XOR 1=1", "OR is not allowed"),
+    ("SELECT * FROM patients_treatment WHERE (patient_id = '143' OR 1=1)", "missing patient filter"),
+    ("SELECT * FROM patients_treatment t JOIN pathology_reports p ON t.patient_id = p.patient_id OR 1=1 "
+     "WHERE t.patient_id = '143'", "OR is not allowed"),
+    ("SELECT * FROM patients_treatment WHERE patient_id <> '143'", "only = or IN"),
+    ("SELECT * FROM patients_treatment WHERE patient_id != '143'", "only = or IN"),
+    ("SELECT * FROM patients_treatment WHERE patient_id > '143' AND patient_id = '143'", "only = or IN"),
+    ("SELECT * FROM patients_treatment WHERE patient_id LIKE '1%'", "only = or IN"),
+    ("SELECT * FROM patients_treatment WHERE patient_id NOT IN ('144')", "only = or IN"),
+    ("SELECT * FROM patients_treatment WHERE patient_id IS NOT NULL", "only = or IN"),
+    ("SELECT * FROM patients_treatment WHERE NOT patient_id = '143'", "only = or IN"),
+    ("SELECT * FROM patients_treatment WHERE '143' <> patient_id", "only = or IN"),
+    # LEFT JOIN's ON does not restrict the preserved table
+    ("SELECT * FROM patients_treatment t LEFT JOIN pathology_reports p ON t.patient_id = '143' AND p.patient_id = '143'",
+     "patients_treatment t"),
+    ("SELECT * FROM patients_treatment t RIGHT JOIN pathology_reports p ON p.patient_id = '143' "
+     "WHERE t.patient_id = '143'", "pathology_reports p"),
+    # Each SELECT block is checked on its own
+    ("SELECT * FROM patients_treatment WHERE patient_id = '143' AND drug_name IN (SELECT drug_name FROM patients_treatment)",
+     "missing patient filter"),
+    ("SELECT drug_name FROM patients_treatment WHERE patient_id = '143' UNION SELECT diagnosis FROM pathology_reports",
+     "pathology_reports"),
+    ("SELECT * FROM (SELECT * FROM pathology_reports) everything WHERE 1 = 1", "missing patient filter"),
+    ("SELECT * FROM (patients_treatment t JOIN pathology_reports p ON 1=1) WHERE t.patient_id = '143'",
+     "could not verify"),
+    # MySQL runs /*! ... */ bodies; "--1" is not a comment in MySQL
+    ("SELECT * FROM patients_treatment WHERE patient_id = '143' /*! OR 1=1 */", "executable comments"),
+    ("SELECT * FROM patients_treatment WHERE patient_id = '143' /*!50000 UNION SELECT * FROM pathology_reports */",
+     "executable comments"),
+    ("SELECT * FROM patients_treatment WHERE patient_id = '143' AND 1=1 --1 OR 1=1", "OR is not allowed"),
+])
+def test_rejects_queries_that_can_reach_other_patients(query, reason):
+    result = check(query)
+    assert result is not None and reason in result
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM patients_treatment WHERE patient_id = '143' /*! OR 1=1 */",
+    "SELECT * FROM patients_treatment WHERE patient_id = '143' /*!50000 ; DROP TABLE patients_treatment */",
+    "SELECT /*+ SET_VAR(max_execution_time=0) */ * FROM patients_treatment WHERE patient_id = '143'",
+    "SELECT /*+ MAX_EXECUTION_TIME(999999999) */ * FROM patients_treatment WHERE patient_id = '143'",
+])
+def test_guard_rejects_executable_comments_and_foreign_hints(query):
+    decision = SqlGuard().check(query, PATIENT)
+    assert not decision["allowed"] and decision["code"] == "comment"
+
+
+def test_guard_keeps_its_own_execution_time_hint(monkeypatch):
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "SQL_GUARD_EXPLAIN_ENABLED", False)
+    query = (f"SELECT /*+ MAX_EXECUTION_TIME({settings.SQL_GUARD_MAX_EXECUTION_MS}) */ * "
+             f"FROM patients_treatment WHERE patient_id = '143' LIMIT 10")
+    assert SqlGuard().check(query, PATIENT)["allowed"]
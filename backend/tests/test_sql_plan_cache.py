@@ -0,0 +1,48 @@
+import pytest
+
+from app.core.database import schema_cache
+from app.services.sql_plan_cache import parameterize_query, render_query
+
+
+@pytest.fixture(autouse=True)
+def patient_tables(monkeypatch):
+    monkeypatch.setattr(schema_cache, "get_patient_tables", lambda: {
+        "patients_registration": "patient_id",
+        "patients_treatment": "patient_id",
+        "pathology_reports": "patient_id",
+    })
+
+
+@pytest.mark.parametrize("query, template, quote", [
+    ("SELECT * FROM patients_treatment WHERE patient_id = '143'",
+     "SELECT * FROM patients_treatment WHERE patient_id = :patient_id", "'"),
+    ("SELECT * FROM patients_treatment t WHERE t.patient_id IN (143) LIMIT 10",
+     "SELECT * FROM patients_treatment t WHERE t.patient_id IN (:patient_id) LIMIT 10", ""),
+    ("SELECT * FROM patients_treatment WHERE '143' = patient_id;",
+     "SELECT * FROM patients_treatment WHERE :patient_id = patient_id", "'"),
+    ("SELECT * FROM patients_treatment t JOIN pathology_reports p ON p.patient_id = t.patient_id "
+     "WHERE t.patient_id = '143' AND p.report_id = 143",
+     "SELECT * FROM patients_treatment t JOIN pathology_reports p ON p.patient_id = t.patient_id "
+     "WHERE t.patient_id = :patient_id AND p.report_id = 143", "'"),
+])
+def test_parameterizes_only_patient_column_comparisons(query, template, quote):
+    assert parameterize_query(query, "143") == {"template": template, "quote": quote}
+
+
+def test_patient_id_colliding_with_other_literals_is_left_alone():
+    query = ("SELECT * FROM patients_treatment WHERE patient_id = 1 AND status = 1 "
+             "AND treatment_id IN (1, 2) ORDER BY start_date LIMIT 1")
+    plan = parameterize_query(query, "1")
+    assert plan["template"] == ("SELECT * FROM patients_treatment WHERE patient_id = :patient_id AND status = 1 "
+                                "AND treatment_id IN (1, 2) ORDER BY start_date LIMIT 1")
+    assert render_query(plan["template"], "2", plan["quote"]) == query.replace("patient_id = 1", "patient_id = 2")
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM patients_treatment WHERE status = '143'",
+    "SELECT * FROM patients_treatment t JOIN pathology_reports p ON 1 = 1 WHERE patient_id = '143'",
+    "UPDATE patients_treatment SET status = 'x' WHERE patient_id = '143'",
+    "SELECT * FROM patients_treatment WHERE patient_id = '143' AND drug_name = :drug",
+])
+def test_rejects_queries_it_cannot_bind_safely(query):
+    assert parameterize_query(query, "143") is None
@@ -34,4 +34,59 @@ export const sendMessage = async (message, patientId = null) => {
     console.error('Request config:', error.config);
     throw error;
   }
-};
\ No newline at end of file
+};
+
+// Streams /chat/stream (Server-Sent Events over POST) and calls onEvent(name, data) per event.
+// Events: progress, route, query, rows, summary_token, final, error
+export const streamMessage = async (message, patientId = null, onEvent = () => {}) => {
+  const requestBody = {
+    message: message
+  };
+
+  if (patientId) {
+    requestBody.patient_id = String(patientId);
+  }
+
+  const response = await fetch(`${API_BASE_URL}/chat/stream`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify(requestBody)
+  });
+
+  if (!response.ok || !response.body) {
+    const error = new Error(`Stream request failed with status ${response.status}`);
+    error.response = { status: response.status };
+    throw error;
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let eventName = 'message';
+      let data = '';
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) {
+          eventName = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+          data += line.slice(5).trim();
+        }
+      }
+      if (data) {
+        onEvent(eventName, JSON.parse(data));
+      }
+    }
+  }
+};
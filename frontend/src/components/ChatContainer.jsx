@@ -3,7 +3,7 @@ import React, { useState, useRef, useEffect } from 'react';
 import ChatMessage from './ChatMessage';
 import ChatInput from './ChatInput';
 import AudioPlayer from './AudioPlayer';
-import { sendMessage } from '../api/chat';
+import { sendMessage, streamMessage } from '../api/chat';
 import './ChatContainer.css';
 
 // Add this at the top after imports
@@ -45,24 +45,59 @@ const ChatContainer = ({ patientId = null }) => {
     
     setLoading(true);
     
+    // Placeholder assistant message, filled in as stream events arrive
+    const messageId = Date.now();
+    const updateStreamingMessage = (update) => {
+      setMessages(prev => prev.map(msg => 
+        msg.id === messageId ? { ...msg, ...update(msg) } : msg
+      ));
+    };
+    setMessages(prev => [...prev, {
+      id: messageId,
+      role: 'assistant',
+      content: '',
+      timestamp: new Date()
+    }]);
+    
     try {
-      // Send to API and get response
-      const response = await sendMessage(text, currentPatientId);
-      
-      // Add assistant message
-      setMessages(prev => [...prev, { 
-        role: 'assistant', 
-        content: response.message,
-        formattedResponse: response.formatted_response,
-        timestamp: new Date()
-      }]);
-      
-      // Set audio URL for playback if available
-      if (response.audio_url) {
-        setTimeout(() => {
-          setCurrentAudio(`${BACKEND_URL}${response.audio_url}`);
-        }, 500);
-      }
+      await streamMessage(text, currentPatientId, (eventName, data) => {
+        if (eventName === 'progress') {
+          updateStreamingMessage(msg => msg.formattedResponse ? {} : { content: `⏳ ${data.label}...` });
+        } else if (eventName === 'rows') {
+          // Show the table as soon as the query returns; the summary streams in after
+          updateStreamingMessage(() => ({
+            formattedResponse: {
+              type: data.record_count > 0 ? 'table_data' : 'text',
+              summary: '',
+              data: data.data,
+              columns: data.columns,
+              record_count: data.record_count,
+              table_html: data.table_html,
+              html: data.table_html,
+              key_insights: []
+            }
+          }));
+        } else if (eventName === 'summary_token') {
+          updateStreamingMessage(msg => msg.formattedResponse ? {
+            formattedResponse: {
+              ...msg.formattedResponse,
+              summary: (msg.formattedResponse.summary || '') + data.text
+            }
+          } : {});
+        } else if (eventName === 'final') {
+          updateStreamingMessage(() => ({
+            content: data.message,
+            formattedResponse: data.formatted_response
+          }));
+          setLoading(false);
+          // Audio is synthesized on the server while the player loads this URL
+          if (data.audio_url) {
+            setCurrentAudio(`${BACKEND_URL}${data.audio_url}`);
+          }
+        } else if (eventName === 'error') {
+          throw new Error(data.detail);
+        }
+      });
     } catch (error) {
       console.error('Error getting response:', error);
       
@@ -78,11 +113,7 @@ const ChatContainer = ({ patientId = null }) => {
         errorMessage = '🌐 Network error. Please check your connection and try again.';
       }
       
-      setMessages(prev => [...prev, { 
-        role: 'assistant', 
-        content: errorMessage,
-        timestamp: new Date()
-      }]);
+      updateStreamingMessage(() => ({ content: errorMessage, formattedResponse: null }));
     } finally {
       setLoading(false);
     }